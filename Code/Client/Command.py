@@ -1,20 +1,17 @@
+from Schema import SCHEMA, PROTOCOL_VERSION
+
 class COMMAND:
-    CMD_MOTOR = "CMD_MOTOR"
-    CMD_M_MOTOR = "CMD_M_MOTOR"
-    CMD_CAR_ROTATE= "CMD_CAR_ROTATE"
-    CMD_LED = "CMD_LED"
-    CMD_LED_MOD = "CMD_LED_MOD"
-    CMD_SERVO = "CMD_SERVO"
-    CMD_BUZZER = "CMD_BUZZER"
-    CMD_SONIC = "CMD_SONIC"
-    CMD_LIGHT = "CMD_LIGHT"
-    CMD_POWER = "CMD_POWER" 
-    CMD_CLOSE = "CMD_CLOSE"
-    CMD_LED_TYPE = "CMD_LED_TYPE"
-    CMD_START = "Start"
-    CMD_STOP = "Stop"
-    CMD_MODE ="CMD_MODE"
+    # Highest binary protocol version this client understands
+    PROTOCOL_VERSION = PROTOCOL_VERSION
+    # Numeric command ids used by the binary protocol, shared with the server through Schema.py
+    COMMAND_ID = {spec.name: spec.command_id for spec in SCHEMA}
     def __init__(self):
         pass
         #self.intervalChar
         #self.endChar
+
+# CMD_MOTOR, CMD_M_MOTOR, CMD_CAR_ROTATE, CMD_LED, CMD_LED_MOD, CMD_SERVO, CMD_BUZZER, CMD_SONIC,
+# CMD_LIGHT, CMD_POWER, CMD_MODE, CMD_LINE, CMD_PROTOCOL, CMD_SUBSCRIBE, CMD_TELEMETRY,
+# CMD_PING, CMD_PONG, CMD_ACK, CMD_SNAPSHOT and CMD_VISION, declared once in the schema
+for spec in SCHEMA:
+    setattr(COMMAND, spec.name, spec.name)
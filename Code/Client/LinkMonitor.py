@@ -0,0 +1,67 @@
+import collections
+import time
+
+class LinkMonitor:
+    def __init__(self,window=64,filterSize=8):
+        self.rtts=collections.deque(maxlen=window)
+        # (rtt, offset) of the latest pongs; the one with the shortest round trip gives the offset
+        self.filter=collections.deque(maxlen=filterSize)
+        self.jitter=0.0
+        self.offset=0.0      # Server clock minus client clock, seconds
+        self.lastRtt=None
+        self.samples=0
+        self.seq=0
+        self.sent={}
+        self.lastSeq=0
+        self.lastReceived=0
+    def nowUs(self):
+        return time.time_ns()//1000
+    def ping(self):
+        # CMD_PING arguments; the receive time of the last pong lets the server compute the same sample
+        self.seq=self.seq%2147483647+1
+        t0=self.nowUs()
+        self.sent[self.seq]=t0
+        for seq in [x for x in self.sent if x<self.seq-16]:
+            del self.sent[seq]
+        return (self.seq,t0,self.lastSeq,self.lastReceived)
+    def pong(self,args,received=None):
+        t3=self.nowUs() if received is None else received
+        seq,t0,t1,t2=args[:4]
+        if self.sent.pop(seq,None)!=t0:
+            return None
+        self.lastSeq=seq
+        self.lastReceived=t3
+        rtt=((t3-t0)-(t2-t1))/1000000.0
+        offset=((t1-t0)+(t2-t3))/2000000.0
+        if rtt<0:
+            return None
+        if self.lastRtt is not None:
+            self.jitter+=(abs(rtt-self.lastRtt)-self.jitter)/16.0
+        self.lastRtt=rtt
+        self.rtts.append(rtt)
+        self.filter.append((rtt,offset))
+        self.offset=min(self.filter)[1]
+        self.samples+=1
+        return rtt
+    def toLocal(self,serverTimeUs):
+        # A server timestamp (video or telemetry frame) on the client clock, for one-way latencies
+        return serverTimeUs-int(self.offset*1000000)
+    def percentile(self,percent):
+        if not self.rtts:
+            return 0.0
+        ordered=sorted(self.rtts)
+        return ordered[min(len(ordered)-1,int(len(ordered)*percent/100.0))]
+    def stats(self):
+        return {'samples':self.samples,
+                'rtt_p50_ms':self.percentile(50)*1000,
+                'rtt_p90_ms':self.percentile(90)*1000,
+                'rtt_p99_ms':self.percentile(99)*1000,
+                'jitter_ms':self.jitter*1000,
+                'offset_ms':self.offset*1000}
+    def report(self):
+        stats=self.stats()
+        return 'rtt p50/p90/p99 %.1f/%.1f/%.1f jitter %.1f offset %.1f (%d samples)' % (
+            stats['rtt_p50_ms'],stats['rtt_p90_ms'],stats['rtt_p99_ms'],stats['jitter_ms'],stats['offset_ms'],stats['samples'])
+
+if __name__ == '__main__':
+    pass
@@ -12,6 +12,7 @@ from threading import Timer
 from threading import Thread
 from PIL import Image
 from Command import COMMAND as cmd
+from Schema import HEARTBEAT_INTERVAL
 from Thread import *
 from Client_Ui import Ui_Client
 from Video import *
@@ -47,6 +48,7 @@ class mywindow(QMainWindow, Ui_Client):
         file.close()
         self.h = self.IP.text()
         self.TCP = VideoStreaming()
+        self.pingInterval = HEARTBEAT_INTERVAL  # Seconds between pings, which also keep the server's motor watchdog fed
         self.servo1 = 90
         self.servo2 = 90
         self.label_FineServo2.setText("0")
@@ -610,16 +612,28 @@ class mywindow(QMainWindow, Ui_Client):
 
     def on_btn_Ultrasonic(self):
         if self.Ultrasonic.text() == "Ultrasonic":
-            self.TCP.sendData(cmd.CMD_SONIC + self.intervalChar + '1' + self.endChar)
+            if self.TCP.telemetry_protocol:
+                self.TCP.subscribe(cmd.CMD_SONIC, 500)
+            else:
+                self.TCP.sendData(cmd.CMD_SONIC + self.intervalChar + '1' + self.endChar)
         else:
-            self.TCP.sendData(cmd.CMD_SONIC + self.intervalChar + '0' + self.endChar)
+            if self.TCP.telemetry_protocol:
+                self.TCP.subscribe(cmd.CMD_SONIC, 0)
+            else:
+                self.TCP.sendData(cmd.CMD_SONIC + self.intervalChar + '0' + self.endChar)
             self.Ultrasonic.setText("Ultrasonic")
 
     def on_btn_Light(self):
         if self.Light.text() == "Light":
-            self.TCP.sendData(cmd.CMD_LIGHT + self.intervalChar + '1' + self.endChar)
+            if self.TCP.telemetry_protocol:
+                self.TCP.subscribe(cmd.CMD_LIGHT, 300)
+            else:
+                self.TCP.sendData(cmd.CMD_LIGHT + self.intervalChar + '1' + self.endChar)
         else:
-            self.TCP.sendData(cmd.CMD_LIGHT + self.intervalChar + '0' + self.endChar)
+            if self.TCP.telemetry_protocol:
+                self.TCP.subscribe(cmd.CMD_LIGHT, 0)
+            else:
+                self.TCP.sendData(cmd.CMD_LIGHT + self.intervalChar + '0' + self.endChar)
             self.Light.setText("Light")
 
     def Change_Left_Right(self):  # Left or Right
@@ -634,12 +648,12 @@ class mywindow(QMainWindow, Ui_Client):
 
     def Fine_Tune_Left_Right(self):  # fine tune Left or Right
         self.label_FineServo1.setText(str(self.HSlider_FineServo1.value()))
-        data = self.servo1 + self.HSlider_FineServo1.value()
+        data = max(0, min(180, self.servo1 + self.HSlider_FineServo1.value()))  # The server clamps too; this keeps the frame binary
         self.TCP.sendData(cmd.CMD_SERVO + self.intervalChar + '0' + self.intervalChar + str(data) + self.endChar)
 
     def Fine_Tune_Up_Down(self):  # fine tune Up or Down
         self.label_FineServo2.setText(str(self.HSlider_FineServo2.value()))
-        data = self.servo2 + self.HSlider_FineServo2.value()
+        data = max(0, min(180, self.servo2 + self.HSlider_FineServo2.value()))  # The server clamps too; this keeps the frame binary
         self.TCP.sendData(cmd.CMD_SERVO + self.intervalChar + '1' + self.intervalChar + str(data) + self.endChar)
 
     def windowMinimumed(self):
@@ -776,6 +790,7 @@ class mywindow(QMainWindow, Ui_Client):
                 stop_thread(self.recv)
                 stop_thread(self.power)
                 stop_thread(self.streaming)
+                stop_thread(self.ping)
             except:
                 pass
             self.TCP.StopTcpcClient()
@@ -798,11 +813,21 @@ class mywindow(QMainWindow, Ui_Client):
     def Power(self):
         while True:
             try:
+                if self.TCP.telemetry_protocol:
+                    break  # The server pushes the battery voltage
                 self.TCP.sendData(cmd.CMD_POWER + self.endChar)
                 time.sleep(60)
             except:
                 break
 
+    def Ping(self):
+        while True:
+            try:
+                self.TCP.sendPing()
+                time.sleep(self.pingInterval)
+            except:
+                break
+
     def recvmassage(self):
         self.TCP.socket1_connect(self.h)
         self.power = Thread(target=self.Power)
@@ -811,8 +836,10 @@ class mywindow(QMainWindow, Ui_Client):
 
         while True:
             Alldata = restCmd + str(self.TCP.recvData())
+            received = self.TCP.link.nowUs()
             restCmd = ""
-            print(Alldata)
+            if cmd.CMD_PONG not in Alldata:
+                print(Alldata)
             if Alldata == "":
                 break
             else:
@@ -822,7 +849,25 @@ class mywindow(QMainWindow, Ui_Client):
                     cmdArray = cmdArray[:-1]
             for oneCmd in cmdArray:
                 Massage = oneCmd.split("#")
-                if cmd.CMD_SONIC in Massage:
+                if Massage[0].startswith('@'):
+                    Massage = Massage[1:]  # Reply to a tagged request, handled like any other
+                if cmd.CMD_TELEMETRY in Massage:
+                    for field in Massage[1:]:
+                        values = field.split(":")
+                        if values[0] == cmd.CMD_SONIC:
+                            self.U.send('Obstruction:%s cm' % values[1])
+                        elif values[0] == cmd.CMD_LIGHT:
+                            self.L.send("Left:" + values[1] + 'V' + ' ' + "Right:" + values[2] + 'V')
+                        elif values[0] == cmd.CMD_POWER:
+                            self.Pb.send(int((float(values[1]) - 7) / 1.40 * 100))
+                elif cmd.CMD_ACK in Massage:
+                    ack = self.TCP.acknowledged([int(x) for x in Massage[1:5]])
+                    if ack is not None and ack[1] != 0:
+                        print('%s not applied, status %d' % (ack[0], ack[1]))
+                elif cmd.CMD_PONG in Massage:
+                    if self.TCP.link.pong([int(x) for x in Massage[1:5]], received) is not None and self.TCP.link.samples % 60 == 0:
+                        print('Link ms: ' + self.TCP.link.report())
+                elif cmd.CMD_SONIC in Massage:
                     # self.Ultrasonic.setText('Obstruction:%s cm' % Massage[1])
                     u = 'Obstruction:%s cm' % Massage[1]
                     self.U.send(u)
@@ -834,6 +879,17 @@ class mywindow(QMainWindow, Ui_Client):
                     percent_power = int((float(Massage[1]) - 7) / 1.40 * 100)
                     # self.progress_Power.setValue(percent_power)
                     self.Pb.send(percent_power)
+                elif cmd.CMD_PROTOCOL in Massage:
+                    self.TCP.setProtocolVersion(int(Massage[1]))
+                    if len(Massage) > 2 and Massage[2].strip():
+                        self.pingInterval = int(Massage[2]) / 1000.0  # The car's heartbeat interval; its watchdog timeout follows it
+                    else:
+                        self.pingInterval = HEARTBEAT_INTERVAL
+                    if self.TCP.telemetry_protocol:
+                        self.TCP.subscribe(cmd.CMD_POWER, 60000)
+                    if self.TCP.link_protocol:
+                        self.ping = Thread(target=self.Ping)
+                        self.ping.start()
 
     def is_valid_jpg(self, jpg_file):
         try:
@@ -881,6 +937,7 @@ class mywindow(QMainWindow, Ui_Client):
         try:
             if self.is_valid_jpg('video.jpg'):
                 self.label_Video.setPixmap(QPixmap('video.jpg'))
+                self.TCP.frameShown()
                 if self.Btn_Tracking_Faces.text() == "Tracing-Off":
                     self.find_Face(self.TCP.face_x, self.TCP.face_y)
         except Exception as e:
@@ -5,16 +5,32 @@ import cv2
 import socket
 import io
 import sys
-import struct
 from PIL import Image
 from multiprocessing import Process
 from Command import COMMAND as cmd
+import time
+from Schema import COMMANDS, TEXT_SEPARATOR, UDP_PORT, UDP_MAGIC, UDP_HEADER, UDP_COMMANDS, VIDEO_HEADER, VIDEO_TIMED_HEADER, VIDEO_TIMED_MAGIC, tag_text, tag_binary
+from LinkMonitor import LinkMonitor
+from VideoTiming import VideoTiming
 
 class VideoStreaming:
     def __init__(self):
         self.face_cascade = cv2.CascadeClassifier(r'haarcascade_frontalface_default.xml')
         self.video_Flag=True
         self.connect_Flag=False
+        self.binary_protocol=False
+        self.telemetry_protocol=False
+        self.use_udp=True
+        self.udp_control=False
+        self.link_protocol=False
+        self.ack_protocol=False
+        self.link=LinkMonitor()
+        self.timing=VideoTiming()
+        self.requests={}
+        self.next_request=0
+        self.udp_socket=None
+        self.udp_seq=0
+        self.server_ip=None
         self.face_x=0
         self.face_y=0
     def StartTcpClient(self,IP):
@@ -26,6 +42,10 @@ class VideoStreaming:
             self.client_socket1.shutdown(2)
             self.client_socket.close()
             self.client_socket1.close()
+            if self.udp_socket is not None:
+                self.udp_socket.close()
+                self.udp_socket=None
+            self.udp_control=False
         except:
             pass
 
@@ -41,6 +61,10 @@ class VideoStreaming:
                 bValid = False
         return bValid
 
+    def frameShown(self):
+        # Called by the display timer once video.jpg is on screen
+        self.timing.shown()
+
     def face_detect(self,img):
         if sys.platform.startswith('win') or sys.platform.startswith('darwin') or sys.platform.startswith('linux'):
             gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
@@ -63,24 +87,112 @@ class VideoStreaming:
         except:
             #print "command port connect failed"
             pass
+        self.timing=VideoTiming()
         while True:
             try:
                 stream_bytes= self.connection.read(4) 
-                leng=struct.unpack('<L', stream_bytes[:4])
+                leng=VIDEO_HEADER.unpack(stream_bytes[:4])
+                frame=None
+                if leng[0]==VIDEO_TIMED_MAGIC:
+                    # Version 8 header: sequence number and the capture, encode and send times of the frame
+                    stream_bytes+=self.connection.read(VIDEO_TIMED_HEADER.size-4)
+                    _,length,seq,capture_us,encoded_us,send_us=VIDEO_TIMED_HEADER.unpack(stream_bytes)
+                    leng=(length,)
                 jpg=self.connection.read(leng[0])
+                if len(stream_bytes)==VIDEO_TIMED_HEADER.size:
+                    frame=self.timing.received(seq,capture_us,encoded_us,send_us,self.link)
                 if self.IsValidImage4Bytes(jpg):
                             image = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
                             if self.video_Flag:
                                 self.face_detect(image)
+                                if frame is not None:
+                                    self.timing.decoded(frame)
+                                    self.timing.written(frame)
                                 self.video_Flag=False
+                if frame is not None and self.timing.frames%300==0:
+                    print('Video latency ms p50/p90/p99: '+self.timing.report())
             except Exception as e:
                 print (e)
                 break
                   
+    def encodeBinary(self,s):
+        # Returns None for commands that have to stay text (unknown names, arguments outside the schema)
+        spec=COMMANDS.get(s.split(TEXT_SEPARATOR,1)[0].strip())
+        if spec is None:
+            return None
+        return spec.text_to_binary(s)
+
     def sendData(self,s):
         if self.connect_Flag:
+            if self.udp_control and s.split(TEXT_SEPARATOR,1)[0].strip() in UDP_COMMANDS:
+                frame=self.encodeBinary(s)
+                self.sendDatagram(frame if frame is not None else s.strip().encode('utf-8'))
+                return
+            if self.binary_protocol:
+                frame=self.encodeBinary(s)
+                if frame is not None:
+                    self.client_socket1.send(frame)
+                    return
             self.client_socket1.send(s.encode('utf-8'))
 
+    def sendCommand(self,name,*args):
+        # Encode straight from the schema, without building and re-parsing a text line
+        if self.connect_Flag:
+            spec=COMMANDS[name]
+            if self.udp_control and name in UDP_COMMANDS and spec.validate(args):
+                self.sendDatagram(spec.encode_binary(*args))
+            elif self.binary_protocol and spec.validate(args):
+                self.client_socket1.send(spec.encode_binary(*args))
+            else:
+                self.client_socket1.send(spec.encode_text(*args).encode('utf-8'))
+
+    def sendDatagram(self,frame):
+        # Setpoints over UDP: a lost datagram is simply superseded by the next one instead of stalling the stream
+        self.udp_seq=(self.udp_seq+1)%(1<<32)
+        try:
+            self.udp_socket.sendto(UDP_HEADER.pack(UDP_MAGIC,self.udp_seq,int(time.time()*1000000))+frame,(self.server_ip,UDP_PORT))
+        except Exception as e:
+            print(e)
+
+    def setProtocolVersion(self,version):
+        self.binary_protocol=version>=1
+        self.telemetry_protocol=version>=2
+        self.udp_control=self.use_udp and version>=3
+        self.link_protocol=version>=4
+        self.ack_protocol=version>=5
+        if self.udp_control and self.udp_socket is None:
+            self.udp_socket=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+
+    def sendPing(self):
+        # Round trip time, jitter and clock offset come back in the CMD_PONG reply
+        self.sendCommand(cmd.CMD_PING,*self.link.ping())
+
+    def request(self,name,*args):
+        # Tagged request: the reply and a CMD_ACK carry the id, so requests can be pipelined and matched out of order
+        if not self.connect_Flag or not self.ack_protocol:
+            self.sendCommand(name,*args)
+            return None
+        self.next_request=self.next_request%4294967295+1
+        self.requests[self.next_request]=(name,time.time())
+        spec=COMMANDS[name]
+        if self.binary_protocol and spec.validate(args):
+            self.client_socket1.send(tag_binary(self.next_request,spec.encode_binary(*args)))
+        else:
+            self.client_socket1.send(tag_text(self.next_request,spec.encode_text(*args)).encode('utf-8'))
+        return self.next_request
+
+    def acknowledged(self,args):
+        # (command, status, round trip seconds, service us, queue us) of a CMD_ACK, or None if the id is unknown
+        request_id,status,service_us,queue_us=args[:4]
+        request=self.requests.pop(request_id,None)
+        if request is None:
+            return None
+        return (request[0],status,time.time()-request[1],service_us,queue_us)
+
+    def subscribe(self,name,period_ms):
+        # Ask the server to push a sensor reading every period_ms, 0 cancels
+        self.sendCommand(cmd.CMD_SUBSCRIBE,cmd.COMMAND_ID[name],period_ms)
+
     def recvData(self):
         data=""
         try:
@@ -93,7 +205,17 @@ class VideoStreaming:
         try:
             self.client_socket1.connect((ip, 5000))
             self.connect_Flag=True
+            self.server_ip=ip
+            self.binary_protocol=False
+            self.telemetry_protocol=False
+            self.udp_control=False
+            self.link_protocol=False
+            self.ack_protocol=False
+            self.link=LinkMonitor()
+            self.requests={}
             print ("Connection Successful !")
+            # Offer the binary protocol; servers that do not know it ignore the request and we stay on text
+            self.sendData(cmd.CMD_PROTOCOL+'#'+str(cmd.PROTOCOL_VERSION)+'\n')
         except Exception as e:
             print ("Connect to server Failed!: Server IP is right? Server is opened?")
             self.connect_Flag=False
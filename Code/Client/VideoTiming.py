@@ -0,0 +1,62 @@
+import collections
+import time
+
+class VideoTiming:
+    # encode: sensor to JPEG ready, server: JPEG ready to first byte sent (handoff and viewer queue),
+    # network: first byte sent to whole frame received, decode: received to decoded and written,
+    # display: written to shown, capture_to_display: sensor to shown
+    STAGES=('encode','server','network','decode','display','capture_to_display')
+    def __init__(self,window=256):
+        self.stages={name:collections.deque(maxlen=window) for name in self.STAGES}
+        self.frames=0
+        self.shownFrames=0
+        self.lost=0          # Sequence numbers the server sent to other viewers or dropped from our queue
+        self.lastSeq=None
+        self.pending=None    # Frame written for the display timer, not shown yet
+    def nowUs(self):
+        return time.time_ns()//1000
+    def received(self,seq,captureUs,encodedUs,sendUs,link,receivedUs=None):
+        # Times of a timed frame header, on the server clock; they are moved to ours once the link monitor has an offset
+        receivedUs=self.nowUs() if receivedUs is None else receivedUs
+        self.frames+=1
+        if self.lastSeq is not None and seq>self.lastSeq+1:
+            self.lost+=seq-self.lastSeq-1
+        self.lastSeq=seq
+        self.stages['encode'].append((encodedUs-captureUs)/1000.0)
+        self.stages['server'].append((sendUs-encodedUs)/1000.0)
+        synced=link.samples>0
+        if synced:
+            self.stages['network'].append((receivedUs-link.toLocal(sendUs))/1000.0)
+        return {'seq':seq,'capture':link.toLocal(captureUs) if synced else None,'received':receivedUs,'decoded':None}
+    def decoded(self,frame):
+        frame['decoded']=self.nowUs()
+        self.stages['decode'].append((frame['decoded']-frame['received'])/1000.0)
+    def written(self,frame):
+        self.pending=frame
+    def shown(self):
+        frame=self.pending
+        if frame is None or frame['decoded'] is None:
+            return
+        self.pending=None
+        self.shownFrames+=1
+        now=self.nowUs()
+        self.stages['display'].append((now-frame['decoded'])/1000.0)
+        if frame['capture'] is not None:
+            self.stages['capture_to_display'].append((now-frame['capture'])/1000.0)
+    def percentile(self,name,percent):
+        values=self.stages[name]
+        if not values:
+            return 0.0
+        ordered=sorted(values)
+        return ordered[min(len(ordered)-1,int(len(ordered)*percent/100.0))]
+    def stats(self):
+        result={'frames':self.frames,'shown':self.shownFrames,'lost':self.lost}
+        for name in self.STAGES:
+            result[name]={'p50_ms':self.percentile(name,50),'p90_ms':self.percentile(name,90),'p99_ms':self.percentile(name,99)}
+        return result
+    def report(self):
+        return ' '.join('%s %.1f/%.1f/%.1f' % (name,self.percentile(name,50),self.percentile(name,90),self.percentile(name,99))
+                        for name in self.STAGES if self.stages[name])
+
+if __name__ == '__main__':
+    pass
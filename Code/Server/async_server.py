@@ -0,0 +1,369 @@
+import asyncio     # Import asyncio for the event loop and stream servers
+import collections # Import collections for the per-viewer frame queues
+import queue       # Import queue for the thread-safe message queues read by main
+import struct      # Import struct for the frame length header
+import threading   # Import threading to run the event loop beside the Qt main loop
+import time        # Import time for frame rate measurement
+from tcp_server import get_interface_ip, set_dead_peer_timeout, kernel_unsent_bytes, RawFramer, DRAIN_POLL_INTERVAL, VIDEO_MAX_UNSENT_BYTES, COMMAND_DEAD_PEER_TIMEOUT  # Import the wlan0 address helper, the dead peer socket options, the send queue probe, the default framer and the poll, budget and timeout constants
+from message import CommandFramer  # Import the framer that splits text and binary commands
+from send_queue import SendQueue  # Import the outbound queue with reply priority and telemetry coalescing
+
+class FrameSubscriber:
+    def __init__(self, writer: asyncio.StreamWriter, frame_queue_size: int, max_unsent_bytes: int = None):
+        """Initialize the frame queue and counters of one video viewer."""
+        self.writer = writer                      # Stream the frames are written to
+        self.address = writer.get_extra_info('peername')  # Viewer address, passed to frame timing
+        self.frame_queue = collections.deque()    # Frames waiting to be sent, oldest first
+        self.frame_queue_size = frame_queue_size  # Frames kept before the oldest is dropped
+        self.frame_ready = asyncio.Event()        # Set when a frame is queued
+        self.max_unsent_bytes = max_unsent_bytes  # Kernel send queue bytes allowed before the next frame is held back
+        self.bytes_sent = 0                       # Bytes written to the viewer
+        self.frames_sent = 0                      # Frames written to the viewer
+        self.dropped_frames = 0                   # Frames dropped because the viewer fell behind
+        self.fps = 0.0                            # Frames per second over the last measurement window
+        self.fps_frames = 0
+        self.fps_time = time.monotonic()
+        self.task = None                          # Task running the sender
+
+    def current_fps(self) -> float:
+        """Get the frame rate, falling back to the open window when the viewer has stalled."""
+        elapsed = time.monotonic() - self.fps_time
+        return self.fps if elapsed < 2.0 else self.fps_frames / elapsed
+
+    def kernel_unsent_bytes(self) -> int:
+        """Get the bytes in the kernel send queue not sent yet."""
+        return kernel_unsent_bytes(self.writer.get_extra_info('socket'))
+
+    def unsent_bytes(self) -> int:
+        """Get the bytes queued for this viewer in the transport and in the kernel."""
+        return self.writer.transport.get_write_buffer_size() + self.kernel_unsent_bytes()
+
+    def push_frame(self, parts: tuple, timing=None) -> None:
+        """Queue a frame, dropping the oldest queued frame if the queue is full."""
+        if len(self.frame_queue) >= self.frame_queue_size:
+            self.frame_queue.popleft()
+            self.dropped_frames += 1
+        self.frame_queue.append((parts, timing))
+        self.frame_ready.set()
+
+    async def run(self) -> None:
+        """Send queued frames, waiting for each one to drain before taking the next, until the viewer goes away."""
+        try:
+            await self.send_frames()
+        except (ConnectionError, OSError, ValueError) as e:  # ValueError: the socket was closed under the send queue probe
+            print(f"Error sending frames to {self.address}: {e}")
+
+    async def send_frames(self) -> None:
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            while self.frame_queue:
+                parts, timing = self.frame_queue.popleft()
+                if timing is not None:
+                    parts = (timing.header(self.address),) + tuple(parts)  # Built as the send starts, so it can carry the send time
+                self.writer.writelines(parts)
+                self.bytes_sent += sum(len(part) for part in parts)
+                self.frames_sent += 1
+                self.fps_frames += 1
+                now = time.monotonic()
+                if now - self.fps_time >= 1.0:
+                    self.fps = self.fps_frames / (now - self.fps_time)
+                    self.fps_frames = 0
+                    self.fps_time = now
+                await self.writer.drain()
+                if timing is not None:
+                    timing.sent(self.address)
+                # Hold the next frame back until this one has nearly left the kernel, so newer frames can replace it
+                while self.max_unsent_bytes is not None and self.kernel_unsent_bytes() > self.max_unsent_bytes:
+                    await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+class AsyncPortServer:
+    def __init__(self, max_buffer_size: int = 256 * 1024, framer=None, max_frame_size: int = 64 * 1024, frame_queue_size: int = 2, max_unsent_bytes: int = None, dead_peer_timeout: float = None, send_frames: bool = False):
+        """Initialize the state of one listening port served by the event loop; send_frames gives each client a FrameSubscriber for broadcast_frame()."""
+        self.server = None                     # The asyncio server object
+        self.send_frames = send_frames         # Video port: clients get broadcast frames
+        self.client_tasks = set()              # Running handle_client tasks, cancelled on close
+        self.dead_peer_timeout = dead_peer_timeout  # Seconds after which a peer that stopped acknowledging is dropped, None for the kernel defaults
+        self.on_disconnect = None              # Called as on_disconnect(address) from the loop thread when a client goes away
+        self.writers = {}                      # Connected clients, address -> StreamWriter
+        self.message_queue = queue.Queue()     # Incoming frames as (address, bytes)
+        self.framer = framer if framer is not None else RawFramer()  # Splits each client's stream into frames
+        self.max_frame_size = max_frame_size   # Largest frame a client may send before it is disconnected
+        self.max_clients = 1                   # Maximum number of clients allowed
+        self.max_buffer_size = max_buffer_size # Bytes a client may have pending before messages are dropped
+        self.dropped_messages = 0              # Messages dropped because a client's buffer was full
+        self.frame_queue_size = frame_queue_size  # Broadcast frames each client may have waiting
+        self.max_unsent_bytes = max_unsent_bytes  # Kernel send queue bytes a client may have in flight before its next frame is held back
+        self.subscribers = {}                  # Frame senders, address -> FrameSubscriber
+        self.retired_bytes_sent = 0            # Bytes sent to viewers that have since disconnected
+        self.retired_frames_sent = 0           # Frames sent to viewers that have since disconnected
+        self.throughput_time = time.monotonic()  # Time of the previous throughput reading
+        self.throughput_bytes = 0              # Total bytes at the previous throughput reading
+        self.throughput_frames = 0             # Total frames at the previous throughput reading
+
+    async def start(self, ip: str, port: int, max_clients: int, listen_count: int) -> None:
+        """Start listening on the given address."""
+        self.max_clients = max_clients
+        self.server = await asyncio.start_server(self.handle_client, ip, port, backlog=listen_count, reuse_address=True)
+        print(f"Server started, listening on {ip}:{port}")
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve one client until it disconnects."""
+        address = writer.get_extra_info('peername')
+        if len(self.writers) >= self.max_clients:
+            print(f"Rejected connection from {address}, max connections ({self.max_clients}) reached.")
+            writer.close()
+            return
+        self.writers[address] = writer
+        task = asyncio.current_task()
+        self.client_tasks.add(task)
+        if self.dead_peer_timeout is not None:
+            set_dead_peer_timeout(writer.get_extra_info('socket'), self.dead_peer_timeout)
+        subscriber = None
+        if self.send_frames:
+            subscriber = FrameSubscriber(writer, self.frame_queue_size, self.max_unsent_bytes)
+            self.subscribers[address] = subscriber
+            subscriber.task = asyncio.ensure_future(subscriber.run())
+        print(f"New connection from {address}, {len(self.writers)} active connections.")
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                buffer += data
+                # Queue only complete frames and keep the partial tail for the next read
+                frames, consumed = self.framer.split(buffer, len(buffer))
+                for frame in frames:
+                    self.message_queue.put((address, frame))
+                del buffer[:consumed]
+                if len(buffer) >= self.max_frame_size:
+                    print(f"Frame from {address} exceeds {self.max_frame_size} bytes, disconnecting.")
+                    break
+        except (ConnectionError, OSError) as e:
+            print(f"Error reading from {address}: {e}")
+        finally:
+            print(address, "disconnected")
+            if subscriber is not None:
+                subscriber.task.cancel()
+                self.retired_bytes_sent += subscriber.bytes_sent
+                self.retired_frames_sent += subscriber.frames_sent
+                self.subscribers.pop(address, None)
+            self.client_tasks.discard(task)
+            self.writers.pop(address, None)
+            writer.close()
+            if self.on_disconnect is not None:
+                self.on_disconnect(address)
+
+    def write(self, data, address=None) -> None:
+        """Queue data to one client, or to all clients when no address is given (loop thread only)."""
+        if isinstance(data, str):
+            parts = (data.encode('utf-8'),)
+        elif isinstance(data, (list, tuple)):
+            parts = data
+        else:
+            parts = (data,)
+        size = sum(len(part) for part in parts)
+        if address is not None:
+            writers = [self.writers[address]] if address in self.writers else []
+        else:
+            writers = list(self.writers.values())
+        for writer in writers:
+            if writer.is_closing():
+                continue
+            # Drop whole messages for clients that are not keeping up instead of buffering without bound
+            if writer.transport.get_write_buffer_size() + size > self.max_buffer_size:
+                self.dropped_messages += 1
+                continue
+            writer.writelines(parts)
+
+    def broadcast_frame(self, frame: bytes, timing=None) -> None:
+        """Queue a length-prefixed frame for every client (loop thread only); with timing, see TCPServer.broadcast_frame."""
+        parts = (struct.pack('<I', len(frame)), frame) if timing is None else (frame,)
+        for subscriber in self.subscribers.values():
+            subscriber.push_frame(parts, timing)
+
+    def get_frame_stats(self) -> dict:
+        """Get the frame rate and frame counters of every client."""
+        return {address: {'fps': round(subscriber.current_fps(), 1),
+                          'bytes_sent': subscriber.bytes_sent,
+                          'frames_sent': subscriber.frames_sent,
+                          'dropped_frames': subscriber.dropped_frames,
+                          'queued_frames': len(subscriber.frame_queue),
+                          'unsent_bytes': subscriber.unsent_bytes()}
+                for address, subscriber in list(self.subscribers.items())}
+
+    def get_throughput(self) -> dict:
+        """Get bytes and frames per second sent to all clients since the previous reading."""
+        subscribers = list(self.subscribers.values())
+        bytes_sent = self.retired_bytes_sent + sum(subscriber.bytes_sent for subscriber in subscribers)
+        frames_sent = self.retired_frames_sent + sum(subscriber.frames_sent for subscriber in subscribers)
+        now = time.monotonic()
+        elapsed = max(now - self.throughput_time, 1e-6)
+        throughput = {'bytes_per_second': round((bytes_sent - self.throughput_bytes) / elapsed),
+                      'frames_per_second': round((frames_sent - self.throughput_frames) / elapsed, 1),
+                      'bytes_sent': bytes_sent,
+                      'frames_sent': frames_sent}
+        self.throughput_time, self.throughput_bytes, self.throughput_frames = now, bytes_sent, frames_sent
+        return throughput
+
+    async def close(self) -> None:
+        """Close the listening socket and all client connections."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        senders = [subscriber.task for subscriber in self.subscribers.values()]
+        for task in senders:
+            task.cancel()
+        # Abort the connections so every handle_client sees end of stream and runs its cleanup; cancelling the
+        # handlers instead makes asyncio's stream callback raise on Python 3.11
+        for writer in list(self.writers.values()):
+            writer.transport.abort()
+        clients = list(self.client_tasks)
+        if clients:
+            _, pending = await asyncio.wait(clients, timeout=1.0)
+            for task in pending:
+                task.cancel()
+        await asyncio.gather(*senders, *clients, return_exceptions=True)  # Finish before the loop is closed under them
+        self.writers.clear()
+        self.subscribers.clear()
+        self.client_tasks.clear()
+
+class AsyncServer:
+    def __init__(self):
+        """Initialize the AsyncServer class, a drop-in replacement for server.Server on one event loop."""
+        self.ip_address = self.get_interface_ip()  # Get the IP address of the network interface
+        self.command_server = AsyncPortServer(framer=CommandFramer(), max_frame_size=4096, dead_peer_timeout=COMMAND_DEAD_PEER_TIMEOUT)  # Initialize the command port, which queues whole commands and drops vanished peers quickly
+        self.video_server = AsyncPortServer(frame_queue_size=1, max_unsent_bytes=VIDEO_MAX_UNSENT_BYTES, send_frames=True)  # Initialize the video port, each viewer only gets the newest frame once the previous one has nearly been sent
+        self.command_send_queue = SendQueue()      # Outbound queue of the command port, drained on the loop
+        self.video_send_queue = SendQueue()        # Outbound queue of the video port, drained on the loop
+        self.loop = None                           # The event loop serving both ports
+        self.loop_thread = None                    # The thread running the event loop
+
+    def get_interface_ip(self) -> str:
+        """Get the IP address of the wlan0 interface."""
+        try:
+            return get_interface_ip()
+        except Exception as e:
+            print(f"Error getting IP address: {e}")
+            return "127.0.0.1"  # Default to localhost if an error occurs
+
+    def start_tcp_servers(self, command_port: int = 5000, video_port: int = 8000, max_clients: int = 1, listen_count: int = 1, max_video_clients: int = 4) -> None:
+        """Start the event loop and both servers on the specified ports."""
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self.command_server.start(self.ip_address, command_port, max_clients, listen_count), self.loop).result()
+            asyncio.run_coroutine_threadsafe(self.video_server.start(self.ip_address, video_port, max_video_clients, max(listen_count, max_video_clients)), self.loop).result()
+        except Exception as e:
+            print(f"Error starting TCP servers: {e}")
+
+    def stop_tcp_servers(self) -> None:
+        """Stop both servers and the event loop."""
+        if self.loop is None:
+            return
+        self.command_send_queue.close()
+        self.video_send_queue.close()
+        try:
+            asyncio.run_coroutine_threadsafe(self.command_server.close(), self.loop).result()
+            asyncio.run_coroutine_threadsafe(self.video_server.close(), self.loop).result()
+        except Exception as e:
+            print(f"Error stopping TCP servers: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        self.loop = None
+        print("Server stopped.")
+
+    def drain_send_queue(self, send_queue: SendQueue, port_server: AsyncPortServer) -> None:
+        """Write everything queued for a port in priority order (loop thread only)."""
+        item = send_queue.get_nowait()
+        while item is not None:
+            data, ip_address = item
+            port_server.write(data, ip_address)
+            item = send_queue.get_nowait()
+
+    def queue_send(self, send_queue: SendQueue, port_server: AsyncPortServer, data, ip_address, priority: int, key: str = None) -> None:
+        """Queue data for a port and schedule a drain on the loop."""
+        if self.loop is None:
+            return
+        send_queue.put(data, ip_address, priority, key)
+        self.loop.call_soon_threadsafe(self.drain_send_queue, send_queue, port_server)
+
+    def send_data_to_command_client(self, data: bytes, ip_address: str = None) -> None:
+        """Queue a reply to the command server client(s); replies are sent before telemetry."""
+        self.queue_send(self.command_send_queue, self.command_server, data, ip_address, SendQueue.PRIORITY_REPLY)
+
+    def send_telemetry_to_command_client(self, key: str, data: bytes, ip_address: str = None) -> None:
+        """Queue telemetry to the command server client(s); a newer value with the same key replaces one not yet sent."""
+        self.queue_send(self.command_send_queue, self.command_server, data, ip_address, SendQueue.PRIORITY_TELEMETRY, key)
+
+    def send_data_to_video_client(self, data: bytes, ip_address: str = None) -> None:
+        """Queue data to the video server client(s). A tuple of parts is queued as one message."""
+        self.queue_send(self.video_send_queue, self.video_server, data, ip_address, SendQueue.PRIORITY_REPLY)
+
+    def get_send_queue_stats(self) -> dict:
+        """Get the depth and counters of both outbound queues."""
+        return {'command': self.command_send_queue.get_stats(), 'video': self.video_send_queue.get_stats()}
+
+    def broadcast_video_frame(self, frame: bytes, timing=None) -> None:
+        """Queue a frame for every video client; slow viewers drop their oldest frames instead of slowing the others.
+        timing (video_timing.FrameSend) builds each viewer's header and records the send times."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.video_server.broadcast_frame, frame, timing)
+
+    def get_video_client_stats(self) -> dict:
+        """Get the frame rate and sent/dropped frame counters of each video client."""
+        return self.video_server.get_frame_stats()
+
+    def get_video_throughput(self) -> dict:
+        """Get bytes and frames per second sent to all video clients since the previous call."""
+        return self.video_server.get_throughput()
+
+    def read_data_from_command_server(self) -> 'queue.Queue':
+        """Read data from the command server's message queue."""
+        return self.command_server.message_queue
+
+    def read_data_from_video_server(self) -> 'queue.Queue':
+        """Read data from the video server's message queue."""
+        return self.video_server.message_queue
+
+    def set_command_disconnect_handler(self, handler) -> None:
+        """Call handler(address) when a command client disconnects or is dropped as dead (on the loop thread)."""
+        self.command_server.on_disconnect = handler
+
+    def is_command_server_connected(self) -> bool:
+        """Check if the command server has any active connections."""
+        return len(self.command_server.writers) > 0
+
+    def is_video_server_connected(self) -> bool:
+        """Check if the video server has any active connections."""
+        return len(self.video_server.writers) > 0
+
+    def get_command_server_client_ips(self) -> list:
+        """Get the list of client IP addresses connected to the command server."""
+        return [address[0] for address in list(self.command_server.writers)]
+
+    def get_command_server_client_addresses(self) -> list:
+        """Get the (ip, port) addresses of the clients connected to the command server."""
+        return list(self.command_server.writers)
+
+    def get_video_server_client_ips(self) -> list:
+        """Get the list of client IP addresses connected to the video server."""
+        return [address[0] for address in list(self.video_server.writers)]
+
+if __name__ == '__main__':
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    server = AsyncServer()             # Create an instance of the AsyncServer class
+    server.start_tcp_servers(5003, 8003)  # Start the servers on specified ports
+
+    try:
+        cmd_queue = server.read_data_from_command_server()  # Get the command server's message queue
+        while True:
+            client_address, message = cmd_queue.get()  # Wait for a message from the queue
+            print(client_address, message)  # Print the client address and message
+            server.send_data_to_command_client(message + b'\n', client_address)  # Send the message back to the client
+    except KeyboardInterrupt:  # Catch keyboard interrupt
+        print("Received interrupt signal, stopping server...")  # Print interrupt information
+        server.stop_tcp_servers()  # Stop the servers
@@ -212,6 +212,37 @@ def warped_contours(contours):
     #print("Warped contours: ", warped_contours)
     return warped_contours
 
+LANE_FULL_LENGTH = 2 * 800  # Two lane edges running the full height of the warped view
+
+def lane_direction(gray: np.ndarray) -> tuple:
+    """
+    Estimate the lane direction from the grayscale pixels of the floor ahead, without printing or saving anything,
+    so it can run in a vision process.
+
+    Args:
+        gray (np.ndarray): The grayscale image, e.g. the Y plane of the bottom of the frame.
+
+    Returns:
+        tuple: (angle, confidence, total_length): the length-weighted average angle of all edge segments, each one
+        folded into 45 to 135 degrees by convert_angle (90 is straight ahead; nothing is filtered out), how much edge
+        was found from 0 to 1, and the edge length in warped pixels. With no edges the result is (0.0, 0.0, 0.0), so
+        callers must check the confidence before steering on the angle.
+    """
+    edges = cv2.Canny(gray, 50, 150)
+    contours = warped_contours(utils.reduce_contours(find_contours(edges)))
+
+    average_angle = 0
+    total_length = 0
+    for contour in contours:
+        for segment in get_segments(contour):
+            angle = convert_angle(get_angle_segment(segment[0], segment[1]))
+            length = get_length_segment(segment[0], segment[1])
+            total_length += length
+            average_angle += angle * length
+    if total_length > 0:
+        average_angle /= total_length
+    return float(average_angle), float(min(1.0, total_length / LANE_FULL_LENGTH)), float(total_length)
+
 def main():
     # Read the image
     
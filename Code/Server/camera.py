@@ -1,29 +1,62 @@
+import os
 import time
-from picamera2 import Picamera2, Preview
-from picamera2.encoders import H264Encoder, JpegEncoder
-from picamera2.outputs import FileOutput
-from libcamera import Transform
-from threading import Condition
-import io
-import cv2  # Import OpenCV for image processing (optional, can be used for displaying frames)
-import numpy as np
-
-class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        """Initialize the StreamingOutput class."""
-        self.frame = None
-        self.condition = Condition()  # Initialize the condition variable for thread synchronization
-
-    def write(self, buf: bytes) -> int:
-        """Write a buffer to the frame and notify all waiting threads."""
-        with self.condition:
-            self.frame = buf             # Update the frame buffer with new data
-            self.condition.notify_all()  # Notify all waiting threads that new data is available
-        return len(buf)
-
-class Camera:
-    def __init__(self, preview_size: tuple = (640, 480), hflip: bool = False, vflip: bool = False, stream_size: tuple = (400, 300)):
-        """Initialize the Camera class."""
+import contextlib
+from frame_bus import FrameBus, y_plane  # Import the ring of frames shared by the video sender and vision, and the Y plane view
+
+# Camera used by open_camera(): 'picamera2', 'opencv[:device]' (V4L2 / USB webcam) or 'replay[:file, pattern or directory]'
+CAMERA_BACKEND = os.environ.get('FREENOVE_CAMERA', 'picamera2')
+
+class CameraBackend:
+    """
+    The interface shared by every camera: start_stream(), stop_stream(), get_frame(), get_consumer(), vision_frame(),
+    save_image(), save_video() and close(), with encoded JPEG frames published on frame_bus.
+    """
+    def get_frame(self) -> bytes:
+        """Wait for the next frame from the stream; None once the stream stops."""
+        frame = self.frame_bus.next_after(self.frame_bus.seq)  # Wait for a frame newer than the current one
+        return frame.data if frame is not None else None
+
+    def get_consumer(self, name: str):
+        """Get a frame bus consumer: latest() without waiting, next() in order or newest() skipping a backlog, with a drop count."""
+        return self.frame_bus.consumer(name)
+
+    def get_stats(self) -> dict:
+        """Get the frame bus statistics."""
+        return self.frame_bus.get_stats()
+
+def open_camera(backend: str = None, **kwargs) -> CameraBackend:
+    """
+    Open the camera named by backend (default CAMERA_BACKEND); keyword arguments go to the backend's constructor.
+    Only the chosen backend's libraries are imported, so the OpenCV and replay cameras work without picamera2.
+    """
+    name, _, source = (backend or CAMERA_BACKEND).partition(':')
+    if name == 'picamera2':
+        return Camera(**kwargs)
+    if name == 'opencv':
+        from camera_opencv import OpenCVCamera
+        return OpenCVCamera(int(source) if source.isdigit() else (source or 0), **kwargs)
+    if name == 'replay':
+        from camera_opencv import ReplayCamera
+        return ReplayCamera(source or None, **kwargs)
+    raise ValueError("Unknown camera backend: {}".format(backend))
+
+def sensor_time(first_us: int, timestamp_us: int, now: float = None) -> float:
+    """
+    Convert a picamera2 encoder timestamp to time.monotonic(). picamera2 passes the SensorTimestamp (CLOCK_BOOTTIME)
+    in microseconds relative to encoder.firsttimestamp; boot time runs ahead of monotonic by the time spent suspended.
+    Returns now when the result is not a plausible capture time (in the future or more than a second old).
+    """
+    now = time.monotonic() if now is None else now
+    if first_us is None or timestamp_us is None:
+        return now
+    sensor = (first_us + timestamp_us) / 1000000.0 + now - time.clock_gettime(time.CLOCK_BOOTTIME)
+    return sensor if now - 1.0 < sensor <= now else now
+
+class Camera(CameraBackend):
+    def __init__(self, preview_size: tuple = (640, 480), hflip: bool = False, vflip: bool = False, stream_size: tuple = (400, 300), lores_size: tuple = None):
+        """Initialize the Camera class, the Picamera2 backend; lores_size (default stream_size) is the raw YUV420 stream for vision."""
+        from picamera2 import Picamera2  # Imported here so other backends run where picamera2 and libcamera are not installed
+        from libcamera import Transform
         self.camera = Picamera2()  # Initialize the Picamera2 object
         self.transform = Transform(hflip=1 if hflip else 0, vflip=1 if vflip else 0)  # Set the transformation for flipping the image
         preview_config = self.camera.create_preview_configuration(main={"size": preview_size}, transform=self.transform)  # Create the preview configuration
@@ -31,12 +64,16 @@ class Camera:
         
         # Configure video stream
         self.stream_size = stream_size  # Set the size of the video stream
-        self.stream_config = self.camera.create_video_configuration(main={"size": stream_size}, transform=self.transform)  # Create the video configuration
-        self.streaming_output = StreamingOutput()  # Initialize the streaming output object
+        self.lores_size = lores_size or stream_size  # Set the size of the raw stream for vision
+        # JPEG is encoded from main; vision reads the Y plane of lores directly, so it never decodes a JPEG
+        self.stream_config = self.camera.create_video_configuration(main={"size": stream_size}, lores={"size": self.lores_size, "format": "YUV420"},
+                                                                    transform=self.transform)  # Create the video configuration
+        self.frame_bus = FrameBus()  # Every encoded frame, with its sequence number and capture time, for any number of consumers
         self.streaming = False  # Initialize the streaming flag
 
     def start_image(self) -> None:
         """Start the camera preview and capture."""
+        from picamera2 import Preview
         self.camera.start_preview(Preview.QTGL)  # Start the camera preview using the QTGL backend
         self.camera.start()                      # Start the camera
 
@@ -56,12 +93,16 @@ class Camera:
                 self.camera.stop()                         # Stop the camera if it is currently running
             
             self.camera.configure(self.stream_config)      # Configure the camera with the video stream settings
+            from picamera2.encoders import H264Encoder, JpegEncoder
+            from picamera2.outputs import FileOutput
+            from camera_output import FrameBusOutput
             if filename:
                 encoder = H264Encoder()                    # Use H264 encoder for video recording
                 output = FileOutput(filename)              # Set the output file for the recorded video
             else:
                 encoder = JpegEncoder()                    # Use Jpeg encoder for streaming
-                output = FileOutput(self.streaming_output) # Set the streaming output object
+                self.frame_bus.reset()                     # Reopen the bus; the output closes it when recording stops
+                output = FrameBusOutput(self.frame_bus, encoder)  # Publish each JPEG with its sensor capture time
             self.camera.start_recording(encoder, output)   # Start recording or streaming
             self.streaming = True                          # Set the streaming flag to True
 
@@ -70,15 +111,26 @@ class Camera:
         if self.streaming:
             try:
                 self.camera.stop_recording()               # Stop the recording or streaming
+                self.frame_bus.close()                     # Release consumers waiting for a frame
                 self.streaming = False                     # Set the streaming flag to False
             except Exception as e:
                 print(f"Error stopping stream: {e}")       # Print error message if stopping fails
 
-    def get_frame(self) -> bytes:
-        """Get the current frame from the streaming output."""
-        with self.streaming_output.condition:
-            self.streaming_output.condition.wait()         # Wait for a new frame to be available
-            return self.streaming_output.frame             # Return the current frame
+    @contextlib.contextmanager
+    def vision_frame(self, roi: tuple = None):
+        """
+        Wait for the next frame and yield the grayscale (Y plane) pixels of roi as a numpy view into the camera buffer.
+        The view is only valid inside the with block, which holds the buffer; copy what must outlive it.
+        Parameters:
+        roi (tuple): (x, y, width, height) as fractions of the frame; None for the whole frame.
+        """
+        from picamera2 import MappedArray
+        request = self.camera.capture_request()            # Wait for the next completed request while streaming
+        try:
+            with MappedArray(request, "lores") as mapped:  # Map the lores buffer without copying it
+                yield y_plane(mapped.array, self.lores_size, roi)
+        finally:
+            request.release()                              # Give the buffer back to the camera
 
     def save_video(self, filename: str, duration: int = 10) -> None:
         """Save a video for the specified duration."""
@@ -93,8 +145,10 @@ class Camera:
         self.camera.close()                                # Close the camera
 
 if __name__ == '__main__':
+    import cv2  # Import OpenCV for image processing (optional, can be used for displaying frames)
+    import numpy as np
     print('Program is starting ... ')                    # Print a message indicating the start of the program
-    camera = Camera()                                    # Create a Camera instance
+    camera = open_camera()                               # Create a camera of the configured backend
 
     print("View image...")
     camera.start_stream()                                 # Start the camera preview
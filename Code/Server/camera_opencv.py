@@ -0,0 +1,307 @@
+import contextlib  # Import contextlib for the vision frame context manager
+import glob        # Import glob for image sequences given as a pattern
+import os          # Import os to list a directory of images
+import threading   # Import threading for the capture thread
+import time        # Import time to pace the replay
+import cv2         # Import OpenCV to capture, read, encode and convert the frames
+import numpy as np # Import numpy for the synthetic frames
+from camera import CameraBackend  # Import the camera interface
+from frame_bus import FrameBus, y_plane  # Import the frame ring and the Y plane view shared with camera.Camera
+
+class CaptureCamera(CameraBackend):
+    def __init__(self, hflip: bool = False, vflip: bool = False, stream_size: tuple = (400, 300), lores_size: tuple = None, jpeg_quality: int = 90):
+        """
+        Initialize the CaptureCamera class, the camera API over a thread that publishes BGR images from frames().
+        Each image goes out as a JPEG on frame_bus, like the Picamera2 encoder output, and as YUV420 on lores_bus for vision_frame().
+        Parameters:
+        stream_size (tuple): Size of the JPEG stream; lores_size (default stream_size) is the size of the vision frames.
+        jpeg_quality (int): JPEG quality of the stream.
+        """
+        self.flip = (1 if hflip else 0, 1 if vflip else 0)
+        self.stream_size = tuple(stream_size)
+        self.lores_size = tuple(lores_size or stream_size)
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.frame_bus = FrameBus()   # Encoded JPEG frames, as camera.Camera publishes them
+        self.lores_bus = FrameBus()   # YUV420 frames for vision_frame()
+        self.vision = self.lores_bus.consumer('vision')
+        self.streaming = False
+        self.thread = None
+
+    def frames(self):
+        """Yield BGR images until the source ends; pacing is up to the source."""
+        raise NotImplementedError
+
+    def run(self) -> None:
+        """Publish every image of the source until it ends or the stream stops."""
+        try:
+            for image in self.frames():
+                if not self.streaming:
+                    break
+                self.publish(image)
+        finally:
+            self.frame_bus.close()
+            self.lores_bus.close()
+
+    def publish(self, image) -> None:
+        """Publish one BGR image as a JPEG on frame_bus and as YUV420 on lores_bus."""
+        if self.flip == (1, 1):
+            image = cv2.flip(image, -1)
+        elif self.flip != (0, 0):
+            image = cv2.flip(image, 1 if self.flip[0] else 0)
+        timestamp = time.monotonic()
+        main = image if image.shape[1::-1] == self.stream_size else cv2.resize(image, self.stream_size)
+        lores = main if self.lores_size == self.stream_size else cv2.resize(image, self.lores_size)
+        ok, jpeg = cv2.imencode('.jpg', main, self.jpeg_params)
+        if ok:
+            self.frame_bus.publish(jpeg.tobytes(), timestamp)
+        self.lores_bus.publish(cv2.cvtColor(lores, cv2.COLOR_BGR2YUV_I420), timestamp)  # (height * 3 / 2, width), as picamera2 maps YUV420
+
+    def start_image(self) -> None:
+        """Start capturing; there is no preview window."""
+        self.start_stream()
+
+    def start_stream(self, filename: str = None) -> None:
+        """Start capturing; use save_video() to record to a file."""
+        if not self.streaming:
+            self.frame_bus.reset()
+            self.lores_bus.reset()
+            self.streaming = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop_stream(self) -> None:
+        """Stop capturing."""
+        if self.streaming:
+            self.streaming = False
+            self.thread.join(1)
+            self.thread = None
+            self.frame_bus.close()
+            self.lores_bus.close()
+
+    def save_image(self, filename: str) -> dict:
+        """Save the latest frame to the specified file."""
+        frame = self.frame_bus.latest()
+        if frame is None:
+            return None
+        with open(filename, 'wb') as f:
+            f.write(frame.data)
+        return {'SensorTimestamp': int(frame.timestamp * 1e9)}
+
+    @contextlib.contextmanager
+    def vision_frame(self, roi: tuple = None):
+        """Wait for a frame newer than the last one and yield the Y plane of roi as a view; None once the stream ends."""
+        frame = self.vision.newest(timeout=1.0)
+        yield y_plane(frame.data, self.lores_size, roi) if frame is not None else None
+
+    def save_video(self, filename: str, duration: int = 10) -> None:
+        """
+        Save a video of the frame_bus frames for the specified duration.
+        The JPEGs are kept as they arrive and written once the duration is over, at the rate they were captured.
+        Parameters:
+        filename (str): Video file; '.avi' is written as MJPG, anything else as MPEG-4 ('.mp4').
+        duration (int): Recording time in seconds.
+        """
+        started = not self.streaming
+        recorder = self.frame_bus.consumer('recorder')
+        recorder.latest()                          # Skip the frames published before the recording starts
+        self.start_stream()
+        frames = []
+        deadline = time.monotonic() + duration
+        try:
+            while time.monotonic() < deadline:
+                frame = recorder.next(timeout=max(0.0, deadline - time.monotonic()))
+                if frame is None:
+                    break                          # The duration is over or the source ended
+                frames.append(frame)
+        finally:
+            if started:
+                self.stop_stream()
+        if not frames:
+            print("No frames to record to {}".format(filename))
+            return
+        span = frames[-1].timestamp - frames[0].timestamp
+        fps = (len(frames) - 1) / span if span > 0 else 30.0
+        fourcc = 'MJPG' if os.path.splitext(filename)[1].lower() == '.avi' else 'mp4v'
+        writer = None
+        try:
+            for frame in frames:
+                image = cv2.imdecode(np.frombuffer(frame.data, np.uint8), cv2.IMREAD_COLOR)
+                if writer is None:
+                    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*fourcc), fps, image.shape[1::-1])
+                    if not writer.isOpened():
+                        print("Error opening video {}".format(filename))
+                        return
+                writer.write(image)
+        finally:
+            if writer is not None:
+                writer.release()
+
+    def close(self) -> None:
+        """Stop capturing."""
+        self.stop_stream()
+
+    def get_stats(self) -> dict:
+        """Get the statistics of both frame buses."""
+        return {'main': self.frame_bus.get_stats(), 'lores': self.lores_bus.get_stats()}
+
+class OpenCVCamera(CaptureCamera):
+    def __init__(self, device=0, **kwargs):
+        """Initialize the OpenCVCamera class, a V4L2 or USB camera read through cv2.VideoCapture (device number or path)."""
+        super().__init__(**kwargs)
+        self.device = device
+
+    def frames(self):
+        """Yield the device's frames as it delivers them."""
+        capture = cv2.VideoCapture(self.device)
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.stream_size[0])
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.stream_size[1])
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Keep the driver from queueing stale frames
+        if not capture.isOpened():
+            print("Error opening camera {}".format(self.device))
+            return
+        try:
+            while self.streaming:
+                ok, image = capture.read()
+                if not ok:
+                    break
+                yield image
+        finally:
+            capture.release()
+
+class ReplayCamera(CaptureCamera):
+    def __init__(self, source=None, fps: float = 30.0, realtime: bool = True, loop: bool = True, **kwargs):
+        """
+        Initialize the ReplayCamera class, recorded frames played back as a camera, for tests and benchmarks off the Pi.
+        Parameters:
+        source: A video file, an image sequence ('frame-%d.jpg' or a glob such as 'i*.png'), a directory of images,
+                a list of image files, or None for a synthetic lane.
+        fps (float): Replay rate when realtime is set.
+        realtime (bool): Pace the frames at fps; otherwise publish as fast as they can be encoded.
+        loop (bool): Start again at the end of the source; otherwise the stream stops.
+        """
+        super().__init__(**kwargs)
+        self.source = source
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+
+    def images(self):
+        """Yield the source images once."""
+        if self.source is None:
+            for i in range(300):
+                yield synthetic_frame(self.stream_size, i)
+            return
+        if isinstance(self.source, (list, tuple)):
+            names = list(self.source)
+        elif os.path.isdir(self.source):
+            names = [os.path.join(self.source, x) for x in sorted(os.listdir(self.source)) if x.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
+        elif any(x in self.source for x in '*?['):
+            names = sorted(glob.glob(self.source))
+        else:
+            names = None
+        if names is not None:
+            for name in names:
+                image = cv2.imread(name)
+                if image is not None:
+                    yield image
+            return
+        capture = cv2.VideoCapture(self.source)  # A video file or a printf-style image sequence
+        try:
+            while True:
+                ok, image = capture.read()
+                if not ok:
+                    break
+                yield image
+        finally:
+            capture.release()
+
+    def frames(self):
+        """Yield the source, looped if asked, at fps or at full speed."""
+        interval = 1.0 / self.fps
+        next_time = time.monotonic()
+        while self.streaming:
+            count = 0
+            for image in self.images():
+                yield image
+                count += 1
+                if self.realtime:
+                    next_time += interval
+                    time.sleep(max(0.0, next_time - time.monotonic()))
+            if not self.loop or count == 0:
+                return
+
+def synthetic_frame(size: tuple, i: int):
+    """Draw a dark lane line on a light floor that sways from side to side."""
+    width, height = size
+    image = np.full((height, width, 3), 170, dtype=np.uint8)
+    offset = int(width * 0.15 * np.sin(i / 15.0))
+    cv2.line(image, (width // 2 + offset, height), (width // 2 + offset // 2, height // 4), (30, 30, 30), 12)
+    cv2.putText(image, str(i), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (90, 90, 90), 2)
+    return image
+
+if __name__ == '__main__':
+    # Throughput of the whole streaming and vision pipeline on plain Linux: a replay camera at full speed feeds the
+    # video server the way main.threading_video_send does, a loopback viewer reads the stream, and a vision loop runs
+    # the Y plane and edge detection of mycar.get_direction; each takes frames from the bus at its own pace.
+    # python3 camera_opencv.py [video file | image pattern | directory] [seconds]
+    import socket
+    import struct
+    import sys
+    from server import Server
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    ROI = (0.0, 0.3, 1.0, 0.7)  # Bottom 70% of the frame, as get_direction uses
+    camera = ReplayCamera(sys.argv[1] if len(sys.argv) > 1 else None, realtime=False)  # Create an instance of the ReplayCamera class
+    server = Server()
+    server.ip_address = '127.0.0.1'
+    server.start_tcp_servers(command_port=0, video_port=0)
+    viewer = socket.create_connection(server.video_server.server_socket.getsockname())
+    received = {'frames': 0, 'bytes': 0}
+    def view():
+        reader = viewer.makefile('rb')
+        while True:
+            header = reader.read(4)
+            if len(header) < 4:
+                return
+            data = reader.read(struct.unpack('<I', header)[0])
+            received['frames'] += 1
+            received['bytes'] += len(data)
+    threading.Thread(target=view, daemon=True).start()
+    while not server.is_video_server_connected():
+        time.sleep(0.01)
+    running = True
+    def send_video():
+        video = camera.get_consumer('video')
+        while running:
+            frame = video.newest(timeout=1.0)
+            if frame is not None:
+                server.broadcast_video_frame(frame.data)
+    vision_cpu = []
+    def vision():
+        while running:
+            with camera.vision_frame(ROI) as gray:
+                if gray is None:
+                    continue
+                start = time.thread_time()
+                contours, _ = cv2.findContours(cv2.Canny(gray, 50, 150), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                vision_cpu.append(time.thread_time() - start)
+    camera.start_stream()
+    threads = [threading.Thread(target=send_video), threading.Thread(target=vision)]
+    for thread in threads:
+        thread.start()
+    time.sleep(SECONDS)
+    running = False
+    camera.close()
+    for thread in threads:
+        thread.join()
+    time.sleep(0.2)
+    stats = camera.get_stats()
+    print("camera:  {:.0f} frames/s published".format(stats['main']['frames'] / SECONDS))
+    print("video:   {:.0f} frames/s sent, {:.0f} frames/s ({:.1f} MB/s) received by the viewer, bus drops {}".format(
+        stats['main']['consumers']['video']['received'] / SECONDS, received['frames'] / SECONDS, received['bytes'] / SECONDS / 1e6,
+        stats['main']['consumers']['video']['dropped']))
+    print("vision:  {:.0f} frames/s, {:.3f} ms CPU per frame, bus drops {}".format(
+        stats['lores']['consumers']['vision']['received'] / SECONDS, sum(vision_cpu) / max(1, len(vision_cpu)) * 1000,
+        stats['lores']['consumers']['vision']['dropped']))
+    viewer.close()
+    server.stop_tcp_servers()
@@ -0,0 +1,28 @@
+from picamera2.outputs import Output  # Import the picamera2 output base class; this module is only imported by camera.Camera
+from camera import sensor_time        # Import the SensorTimestamp to time.monotonic() conversion
+from frame_bus import FrameBus        # Import the ring of frames the output publishes to
+
+class FrameBusOutput(Output):
+    def __init__(self, bus: FrameBus, encoder):
+        """
+        Initialize the FrameBusOutput class, a picamera2 output that publishes each JPEG on a FrameBus stamped with its
+        sensor capture time, where FileOutput would only give the time the encoder finished.
+        Parameters:
+        bus (FrameBus): The bus to publish to.
+        encoder: The encoder writing to this output; its firsttimestamp is the base of the frame timestamps.
+        """
+        super().__init__()
+        self.bus = bus
+        self.encoder = encoder
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False) -> None:
+        """Publish one encoded frame while recording."""
+        if audio or frame is None or not self.recording:
+            return
+        capture = sensor_time(getattr(self.encoder, 'firsttimestamp', None), timestamp)
+        self.bus.publish(bytes(frame), capture)
+
+    def stop(self) -> None:
+        """Stop recording and release consumers waiting for a frame, as FileOutput closing the bus did."""
+        super().stop()
+        self.bus.close()
@@ -1,14 +1,14 @@
+from command_schema import SCHEMA, PROTOCOL_VERSION  # Import the shared command schema
+
 class Command:
     def __init__(self):
-        self.CMD_MOTOR      = "CMD_MOTOR"
-        self.CMD_M_MOTOR    = "CMD_M_MOTOR"
-        self.CMD_CAR_ROTATE = "CMD_CAR_ROTATE"
-        self.CMD_LED        = "CMD_LED"
-        self.CMD_LED_MOD    = "CMD_LED_MOD"
-        self.CMD_SERVO      = "CMD_SERVO"
-        self.CMD_BUZZER     = "CMD_BUZZER"
-        self.CMD_SONIC      = "CMD_SONIC"
-        self.CMD_LIGHT      = "CMD_LIGHT"
-        self.CMD_POWER      = "CMD_POWER" 
-        self.CMD_MODE       = "CMD_MODE"
-        self.CMD_LINE       = "CMD_LINE"
\ No newline at end of file
+        # CMD_MOTOR, CMD_M_MOTOR, CMD_CAR_ROTATE, CMD_LED, CMD_LED_MOD, CMD_SERVO, CMD_BUZZER, CMD_SONIC,
+        # CMD_LIGHT, CMD_POWER, CMD_MODE, CMD_LINE, CMD_PROTOCOL, CMD_SUBSCRIBE, CMD_TELEMETRY,
+        # CMD_PING, CMD_PONG, CMD_ACK, CMD_SNAPSHOT and CMD_VISION, declared once in command_schema
+        for spec in SCHEMA:
+            setattr(self, spec.name, spec.name)
+        # Highest binary protocol version this server understands
+        self.PROTOCOL_VERSION = PROTOCOL_VERSION
+        # Numeric command ids used by the binary protocol, shared with the client through Schema.py
+        self.COMMAND_ID = {spec.name: spec.command_id for spec in SCHEMA}
+        self.COMMAND_NAME = {command_id: name for name, command_id in self.COMMAND_ID.items()}
@@ -0,0 +1,233 @@
+import struct  # Import struct for the precompiled binary codecs
+import sys     # Import sys for the command line of the client generator
+
+# The single description of the command protocol. The client copy (Code/Client/Schema.py) is generated from
+# this file with "python3 command_schema.py --client ../Client/Schema.py"; edit this file, never the copy.
+
+PROTOCOL_VERSION = 8            # Highest protocol version described here: 1 binary commands, 2 telemetry subscriptions, 3 UDP control, 4 link monitor,
+                                # 5 correlation ids and acknowledgements, 6 deadman heartbeats, 7 sensor snapshots, 8 timed video frames
+TEXT_SEPARATOR = '#'            # Separates the command name and the arguments of a text command
+TEXT_END = '\n'                 # Ends a text command
+BINARY_MAGIC = 0xA5             # Binary frames start with this byte, which never begins a text command
+BINARY_HEADER = struct.Struct('<BBBB')  # Magic, command id, argument format, argument count
+BINARY_ARG_FORMATS = {0: 'h', 1: 'i', 2: 'q'}  # Argument formats: 0 packs int16, 1 int32 and 2 int64 arguments
+BINARY_ARG_SIZES = {0: 2, 1: 4, 2: 8}
+# Words the legacy text protocol accepts in place of numbers
+LEGACY_WORDS = {'one': 0, 'two': 1, 'three': 3, 'four': 2}
+
+_binary_arg_structs = {}  # Precompiled argument structs, keyed by (argument format, argument count)
+
+def binary_arg_struct(arg_format: int, arg_count: int) -> struct.Struct:
+    """Get the precompiled struct for a binary argument block."""
+    key = (arg_format, arg_count)
+    arg_struct = _binary_arg_structs.get(key)
+    if arg_struct is None:
+        arg_struct = struct.Struct('<' + BINARY_ARG_FORMATS[arg_format] * arg_count)
+        _binary_arg_structs[key] = arg_struct
+    return arg_struct
+
+class Arg:
+    __slots__ = ('name', 'low', 'high', 'words')
+
+    def __init__(self, name: str, low: int, high: int, words: dict = None):
+        """Initialize the Arg class, an integer argument with its allowed range and optional word aliases."""
+        self.name = name
+        self.low = low
+        self.high = high
+        self.words = words if words is not None else LEGACY_WORDS
+
+class CommandSpec:
+    def __init__(self, name: str, command_id: int, args: tuple = (), min_args: int = None):
+        """
+        Initialize the CommandSpec class and precompile the text and binary codecs of one command.
+        Parameters:
+        name (str): The command name sent in text commands.
+        command_id (int): The id sent in binary frames.
+        args (tuple): The Arg of each argument, in order.
+        min_args (int): Fewest arguments a valid command has; defaults to all of them.
+        """
+        self.name = name
+        self.command_id = command_id
+        self.args = tuple(args)
+        self.arg_count = len(self.args)
+        self.min_args = self.arg_count if min_args is None else min_args
+        # The narrowest argument format every declared range fits, so the frame is as small as it can be
+        if all(-32768 <= arg.low and arg.high <= 32767 for arg in self.args):
+            self.arg_format = 0
+        elif all(-2147483648 <= arg.low and arg.high <= 2147483647 for arg in self.args):
+            self.arg_format = 1
+        else:
+            self.arg_format = 2
+        self.binary = struct.Struct('<BBBB' + BINARY_ARG_FORMATS[self.arg_format] * self.arg_count)
+        self.binary_prefix = (BINARY_MAGIC, command_id, self.arg_format, self.arg_count)
+        self.text = name + (TEXT_SEPARATOR + '{}') * self.arg_count + TEXT_END
+        self.ranges = tuple((arg.low, arg.high) for arg in self.args)
+
+    def encode_text(self, *args) -> str:
+        """Encode the command as a text line; trailing optional arguments (past min_args) may be left out."""
+        if len(args) == self.arg_count:
+            return self.text.format(*args)
+        return TEXT_SEPARATOR.join([self.name] + [str(x) for x in args]) + TEXT_END
+
+    def encode_binary(self, *args) -> bytes:
+        """Encode the command as a binary frame."""
+        return self.binary.pack(*self.binary_prefix, *args)
+
+    def decode_binary(self, frame) -> tuple:
+        """Decode the arguments of a binary frame of this command."""
+        _, _, arg_format, arg_count = BINARY_HEADER.unpack_from(frame)
+        if arg_format == self.arg_format and arg_count == self.arg_count:
+            return self.binary.unpack_from(frame)[4:]
+        return binary_arg_struct(arg_format, arg_count).unpack_from(frame, BINARY_HEADER.size)
+
+    def decode_text(self, tokens: list) -> tuple:
+        """Decode the argument tokens (str or bytes) of a text command of this command."""
+        try:
+            return tuple(map(int, tokens))  # Fast path, nearly every command is plain integers
+        except ValueError:
+            pass
+        args = []
+        for token in tokens:
+            if isinstance(token, bytes):
+                token = token.decode('utf-8', errors='replace')
+            token = token.strip()
+            if token == '':
+                continue
+            words = self.args[len(args)].words if len(args) < self.arg_count else LEGACY_WORDS
+            if token in words:
+                args.append(words[token])
+                continue
+            try:
+                args.append(round(float(token)))
+            except ValueError:
+                args.append(0)
+        return tuple(args)
+
+    def text_to_binary(self, line: str) -> bytes:
+        """Convert a text command line of this command to a binary frame, or None if it does not fit the schema."""
+        args = self.decode_text(line.strip().split(TEXT_SEPARATOR)[1:])
+        if len(args) != self.arg_count or not self.validate(args):
+            return None
+        return self.encode_binary(*args)
+
+    def validate(self, args) -> bool:
+        """Check the argument count and ranges."""
+        if len(args) < self.min_args:
+            return False
+        for value, (low, high) in zip(args, self.ranges):
+            if value < low or value > high:
+                return False
+        return True
+
+# Optional UDP control channel (protocol version 3) for idempotent setpoints: each datagram is this header
+# followed by one text or binary command. Receivers keep the newest sequence number per sender and actuator
+# and drop anything older, so a late datagram never undoes a newer setpoint.
+UDP_PORT = 5001
+UDP_MAGIC = 0x5C
+UDP_HEADER = struct.Struct('<BIq')  # Magic, sequence number (wraps at 2**32), send time in microseconds
+UDP_COMMANDS = ('CMD_MOTOR', 'CMD_M_MOTOR', 'CMD_SERVO')
+
+# Local control socket for programs running on the car: the same frames as the command port, one per
+# SOCK_SEQPACKET message (or newline framed where only SOCK_STREAM exists), without the Wi-Fi and TCP hops
+LOCAL_SOCKET_PATH = '/tmp/freenove_car.sock'
+
+# Video port frames: the length of the JPEG, then the JPEG. Viewers from hosts that agreed to version 8 on the
+# command port get the timed header instead, which starts with a magic no JPEG length reaches, so frames sent
+# before and after the handshake can both be read. Times are server wall clock microseconds, like CMD_PONG.
+VIDEO_HEADER = struct.Struct('<I')                  # JPEG length
+VIDEO_TIMING_VERSION = 8
+VIDEO_TIMED_MAGIC = 0xA7A7A7A7
+VIDEO_TIMED_HEADER = struct.Struct('<IIIqqq')       # Magic, JPEG length, frame sequence number, capture, encode done and send start times
+
+# Optional correlation ids (protocol version 5): a request prefixed with an id gets its reply prefixed with the
+# same id, followed by a CMD_ACK, so a client can pipeline requests and match the answers out of order.
+TEXT_TAG = '@'                        # Tagged text request or reply: @17#CMD_POWER
+BINARY_TAG_MAGIC = 0xA6               # Tagged binary request: this prefix followed by a normal binary frame
+BINARY_TAG = struct.Struct('<BI')     # Magic, request id
+REQUEST_ID = (0, 4294967295)
+# CMD_ACK status of a tagged request
+ACK_OK = 0          # The handler ran
+ACK_UNKNOWN = 1     # No handler for the command
+ACK_REJECTED = 2    # Wrong argument count or out of range
+ACK_FAILED = 3      # The handler raised
+ACK_DROPPED = 4     # Superseded by a newer setpoint or a stop before it ran
+
+def tag_text(request_id: int, line: str) -> str:
+    """Prefix a text command or reply with a request id."""
+    return TEXT_TAG + str(request_id) + TEXT_SEPARATOR + line
+
+def tag_binary(request_id: int, frame: bytes) -> bytes:
+    """Prefix a binary frame with a request id."""
+    return BINARY_TAG.pack(BINARY_TAG_MAGIC, request_id) + frame
+
+DUTY = (-4095, 4095)    # Motor duty, as clamped by Motor.duty_range
+ANGLE = (-360, 360)     # Mecanum direction angle in degrees
+SEQ = (0, 2147483647)   # Ping sequence number
+# Deadman watchdog (protocol version 6): clients that agree to version 6 ping at least every heartbeat interval, and
+# once they do the server zeroes the motors when it hears nothing for its watchdog timeout. Older clients are stopped on
+# disconnect. The server's CMD_PROTOCOL reply to such a client carries the interval it wants, in milliseconds; a reply
+# without one means HEARTBEAT_INTERVAL. The car sets both in params.json (Heartbeat_Interval_Ms, Watchdog_Timeout_Ms),
+# and the timeout never goes below 3 heartbeats, so a 20 ms heartbeat allows a cut-off from 60 ms on.
+WATCHDOG_VERSION = 6
+WATCHDOG_TIMEOUT = 0.5      # Default; Wi-Fi retransmits and power save stall TCP for 100 ms and more, so allow several lost heartbeats.
+HEARTBEAT_INTERVAL = 0.1    # Default
+HEARTBEAT_MS = (10, 1000)   # Heartbeat intervals a server may ask for
+TIME_US = (0, 1 << 62)  # Wall clock time in microseconds since the epoch
+
+SCHEMA = (
+    CommandSpec('CMD_MOTOR', 1, (Arg('front_left', *DUTY), Arg('back_left', *DUTY), Arg('front_right', *DUTY), Arg('back_right', *DUTY))),
+    CommandSpec('CMD_M_MOTOR', 2, (Arg('left_angle', *ANGLE), Arg('left_power', *DUTY), Arg('right_angle', *ANGLE), Arg('right_power', *DUTY))),
+    CommandSpec('CMD_CAR_ROTATE', 3, (Arg('left_angle', *ANGLE), Arg('left_power', *DUTY), Arg('right_angle', *ANGLE), Arg('right_power', *DUTY))),
+    CommandSpec('CMD_LED', 4, (Arg('index', 0, 255), Arg('red', 0, 255), Arg('green', 0, 255), Arg('blue', 0, 255))),
+    CommandSpec('CMD_LED_MOD', 5, (Arg('mode', 0, 5),)),
+    CommandSpec('CMD_SERVO', 6, (Arg('channel', 0, 7), Arg('angle', 0, 180))),
+    CommandSpec('CMD_BUZZER', 7, (Arg('state', 0, 1),)),
+    CommandSpec('CMD_SONIC', 8, (Arg('state', 0, 1),), min_args=0),
+    CommandSpec('CMD_LIGHT', 9, (Arg('state', 0, 1),), min_args=0),
+    CommandSpec('CMD_POWER', 10),
+    CommandSpec('CMD_MODE', 11, (Arg('mode', 0, 3, LEGACY_WORDS),)),
+    CommandSpec('CMD_LINE', 12, (Arg('state', 0, 1),), min_args=0),
+    # The server's reply to a version 6 or later client also carries the heartbeat interval it wants
+    CommandSpec('CMD_PROTOCOL', 13, (Arg('version', 0, 255), Arg('heartbeat_ms', *HEARTBEAT_MS)), min_args=0),
+    # Push the reading of one sensor command (by command id) every period_ms; 0 cancels the subscription
+    CommandSpec('CMD_SUBSCRIBE', 14, (Arg('channel', 0, 255), Arg('period_ms', 0, 600000))),
+    # Sent by the server only, as text: CMD_TELEMETRY#CMD_SONIC:23.50#CMD_LIGHT:1.21:1.37
+    CommandSpec('CMD_TELEMETRY', 15, min_args=0),
+    # Link monitor: the client sends its send time and the receive time of the previous pong, so both sides
+    # get the same NTP-style sample (round trip time and clock offset) from four timestamps
+    CommandSpec('CMD_PING', 16, (Arg('seq', *SEQ), Arg('client_send_us', *TIME_US), Arg('last_seq', *SEQ), Arg('last_client_receive_us', *TIME_US))),
+    # Sent by the server only, as text, in reply to CMD_PING
+    CommandSpec('CMD_PONG', 17, (Arg('seq', *SEQ), Arg('client_send_us', *TIME_US), Arg('server_receive_us', *TIME_US), Arg('server_send_us', *TIME_US))),
+    # Sent by the server only, as text, after the reply of a tagged request: handler time and time queued, in microseconds
+    CommandSpec('CMD_ACK', 18, (Arg('request_id', *REQUEST_ID), Arg('status', ACK_OK, ACK_DROPPED), Arg('service_us', *TIME_US), Arg('queue_us', *TIME_US))),
+    # Latest reading of every sensor, answered with one CMD_TELEMETRY frame; readings older than max_age_ms are
+    # refreshed first, without the argument the cached readings are returned as they are
+    CommandSpec('CMD_SNAPSHOT', 19, (Arg('max_age_ms', 0, 60000),), min_args=0),
+    # Local control socket only: 1 has the server feed the camera's grayscale frames into a shared memory ring and
+    # answer CMD_VISION#<ring name>, 0 stops the feed (also when the local client goes away) and answers CMD_VISION#
+    CommandSpec('CMD_VISION', 20, (Arg('state', 0, 1),)),
+)
+COMMANDS = {spec.name: spec for spec in SCHEMA}              # Spec of each command name
+COMMANDS_BY_ID = {spec.command_id: spec for spec in SCHEMA}  # Spec of each binary command id
+
+def write_client_schema(path: str) -> None:
+    """Write the client copy of this module."""
+    with open(__file__, 'r') as source:
+        code = source.read()
+    with open(path, 'w') as target:
+        target.write("# Generated from Code/Server/command_schema.py, do not edit.\n")
+        target.write(code)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--client':
+        write_client_schema(sys.argv[2])
+        print("Wrote {}".format(sys.argv[2]))
+        sys.exit(0)
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    for spec in SCHEMA:
+        print("{:2d} {:<15} args={} {}".format(spec.command_id, spec.name, [arg.name for arg in spec.args], spec.binary.format))
+    motor = COMMANDS['CMD_M_MOTOR']
+    line = motor.encode_text(0, 1500, 0, 0)
+    frame = motor.encode_binary(0, 1500, 0, 0)
+    print(repr(line), frame.hex(), motor.decode_binary(frame), motor.decode_text(line.strip().split('#')[1:]))
+    print(COMMANDS['CMD_MODE'].text_to_binary('CMD_MODE#three\n').hex())
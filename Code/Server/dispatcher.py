@@ -0,0 +1,268 @@
+import collections  # Import collections for the per-class FIFO queues
+import multiprocessing  # Import multiprocessing for the benchmark of the old command queue
+import queue        # Import queue for the command server queue in the benchmark
+import threading    # Import threading for the condition shared by the receiver and the dispatch thread
+import time         # Import time to measure how long commands wait
+from command import Command  # Import the command names and binary command ids
+from message import ParsedCommand, parse_command  # Import the thread-safe command parser
+from stats import LatencyHistogram  # Import the latency histogram kept per command class
+
+class CommandCoalescer:
+    def __init__(self):
+        """Initialize the CommandCoalescer class, which tells the actuator each setpoint drives, so only the newest one per actuator is kept."""
+        self.command = Command()
+        # Setpoint commands only carry the desired state, so an older one can be dropped when a newer one is queued
+        self.motor_commands = {self.command.CMD_MOTOR, self.command.CMD_M_MOTOR}
+        self.servo_commands = {self.command.CMD_SERVO}
+        self.coalesced_commands = 0  # Number of setpoint commands dropped in favour of a newer one
+
+    def actuator_key(self, command: ParsedCommand):
+        """Get the actuator a setpoint command drives, or None for commands that must all be applied in order."""
+        if command.command in self.motor_commands:
+            return 'motor'
+        if command.command in self.servo_commands and len(command.args) > 0:
+            return ('servo', command.args[0])
+        return None
+
+class PriorityDispatcher:
+    # Command classes and their priorities, lowest value first
+    CLASS_PRIORITIES = {'stop': 0, 'motion': 1, 'actuator': 2, 'led': 3, 'telemetry': 4}
+    DEFAULT_CLASS = 'actuator'  # Class of commands missing from the class table
+
+    def __init__(self, command_classes: dict = None, class_priorities: dict = None, on_drop=None):
+        """
+        Initialize the PriorityDispatcher class, a command queue served highest priority class first.
+        Parameters:
+        command_classes (dict): Class name of each Command constant; commands not listed use DEFAULT_CLASS.
+        class_priorities (dict): Priority of each class name, lowest value served first.
+        on_drop (callable): Called as on_drop(address, ParsedCommand) for each queued command dropped in favour
+        of a newer setpoint or a stop, e.g. to tell the client its tagged request never ran.
+        """
+        self.on_drop = on_drop
+        self.coalescer = CommandCoalescer()
+        self.command = self.coalescer.command
+        self.command_classes = {self.command.CMD_MOTOR: 'motion',
+                                self.command.CMD_M_MOTOR: 'motion',
+                                self.command.CMD_CAR_ROTATE: 'motion',
+                                self.command.CMD_MODE: 'motion',
+                                self.command.CMD_SERVO: 'actuator',
+                                self.command.CMD_BUZZER: 'actuator',
+                                self.command.CMD_PROTOCOL: 'actuator',
+                                self.command.CMD_LED: 'led',
+                                self.command.CMD_LED_MOD: 'led',
+                                self.command.CMD_SONIC: 'telemetry',
+                                self.command.CMD_LIGHT: 'telemetry',
+                                self.command.CMD_LINE: 'telemetry',
+                                self.command.CMD_POWER: 'telemetry',
+                                self.command.CMD_SNAPSHOT: 'telemetry'}
+        if command_classes is not None:
+            self.command_classes.update(command_classes)
+        self.class_priorities = dict(class_priorities if class_priorities is not None else self.CLASS_PRIORITIES)
+        self.condition = threading.Condition()  # Signals the dispatch thread when commands arrive or the dispatcher closes
+        # One FIFO per class, in priority order; entries are [address, ParsedCommand, class name, enqueue time, live, actuator key]
+        self.queues = collections.OrderedDict((name, collections.deque()) for name in sorted(self.class_priorities, key=self.class_priorities.get))
+        self.setpoints = {}                     # Queued entry of each actuator, so a newer setpoint can drop it
+        self.closed = False                     # Set by close() to release the dispatch thread
+        self.pending = 0                        # Live entries waiting to be dispatched
+        self.invalid = 0                        # Frames that could not be parsed
+        self.latency = {name: LatencyHistogram() for name in self.queues}  # Arrival to handled, per class
+
+    def classify(self, command: ParsedCommand) -> str:
+        """Get the class of a command; a motion command that stops the car is in the stop class."""
+        class_name = self.command_classes.get(command.command, self.DEFAULT_CLASS)
+        if class_name == 'motion' and 'stop' in self.queues and self.is_stop(command):
+            return 'stop'
+        return class_name if class_name in self.queues else self.DEFAULT_CLASS
+
+    def is_stop(self, command: ParsedCommand) -> bool:
+        """Check whether a motion command brings the car to a standstill."""
+        name, args = command.command, command.args
+        if name == self.command.CMD_MODE:
+            return len(args) > 0 and args[0] == 0
+        if name == self.command.CMD_MOTOR:
+            return len(args) >= 4 and args[:4] == (0, 0, 0, 0)
+        if name in (self.command.CMD_M_MOTOR, self.command.CMD_CAR_ROTATE):
+            return len(args) >= 4 and args[1] == 0 and args[3] == 0  # Both power values zero
+        return False
+
+    def put(self, address, frame) -> None:
+        """Parse and queue a frame from a client. A newer setpoint drops the queued one for the same actuator,
+        and a stop drops all queued motion commands."""
+        command = parse_command(frame)
+        if command is None:
+            self.invalid += 1
+            return
+        self.put_command(address, command)
+
+    def put_command(self, address, command: ParsedCommand) -> None:
+        """Queue a command that has already been parsed."""
+        class_name = self.classify(command)
+        key = self.coalescer.actuator_key(command)
+        entry = [address, command, class_name, time.monotonic(), True, key]
+        dropped = []
+        with self.condition:
+            if self.closed:
+                return
+            if class_name == 'stop' and 'motion' in self.queues:
+                for queued in self.queues['motion']:
+                    if self.drop(queued):
+                        dropped.append(queued)
+            if key is not None:
+                queued = self.setpoints.get(key)
+                if queued is not None and self.drop(queued):
+                    dropped.append(queued)
+                self.setpoints[key] = entry
+            self.queues[class_name].append(entry)
+            self.pending += 1
+            self.condition.notify()
+        if self.on_drop is not None:
+            for queued in dropped:
+                self.on_drop(queued[0], queued[1])
+
+    def drop(self, entry: list) -> bool:
+        """Mark a queued entry as superseded (condition held); it is skipped when it reaches the front.
+        Returns True if the entry was still live."""
+        if entry[4]:
+            entry[4] = False
+            self.pending -= 1
+            self.coalescer.coalesced_commands += 1
+            return True
+        return False
+
+    def take(self):
+        """Remove and return the oldest live entry of the highest priority class, or None (condition held)."""
+        for entries in self.queues.values():
+            while entries:
+                entry = entries.popleft()
+                if not entry[4]:
+                    continue
+                self.pending -= 1
+                if entry[5] is not None and self.setpoints.get(entry[5]) is entry:
+                    del self.setpoints[entry[5]]
+                return entry
+        return None
+
+    def get(self, timeout: float = None):
+        """Wait for the next command as (address, ParsedCommand, class name, enqueue time).
+        Returns None once the dispatcher is closed or on timeout."""
+        with self.condition:
+            while not self.closed and self.pending == 0:
+                if not self.condition.wait(timeout):
+                    return None
+            if self.closed:
+                return None
+            entry = self.take()
+            return None if entry is None else tuple(entry[:4])
+
+    def done(self, class_name: str, enqueued_at: float) -> None:
+        """Record that a command taken with get() has been handled."""
+        self.latency[class_name].record(time.monotonic() - enqueued_at)
+
+    def close(self) -> None:
+        """Close the dispatcher and release the dispatch thread."""
+        with self.condition:
+            self.closed = True
+            for entries in self.queues.values():
+                entries.clear()
+            self.setpoints.clear()
+            self.pending = 0
+            self.condition.notify_all()
+
+    def get_stats(self) -> dict:
+        """Get the queue depth of each class, the coalesced count and the latency histogram of each class."""
+        with self.condition:
+            depths = {name: sum(1 for entry in entries if entry[4]) for name, entries in self.queues.items()}
+        return {'depth': depths,
+                'coalesced': self.coalescer.coalesced_commands,
+                'invalid': self.invalid,
+                'latency': {name: histogram.get_stats() for name, histogram in self.latency.items()}}
+
+if __name__ == '__main__':
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    dispatcher = PriorityDispatcher()  # Create an instance of the PriorityDispatcher class
+    burst = [('client', b'CMD_M_MOTOR#0#1000#0#0'),
+             ('client', b'CMD_SERVO#0#80'),
+             ('client', b'CMD_BUZZER#1'),
+             ('client', b'CMD_M_MOTOR#0#1500#0#0'),
+             ('client', b'CMD_SERVO#1#100'),
+             ('client', b'CMD_SERVO#0#85'),
+             ('client', b'CMD_BUZZER#0')]
+    for address, frame in burst:
+        dispatcher.put(address, frame)
+    while True:
+        item = dispatcher.get(timeout=0)
+        if item is None:
+            break
+        print(item[1])
+    print("Coalesced commands: {}".format(dispatcher.get_stats()['coalesced']))
+
+    # Congested link: a stop arrives behind a flood of LED and power requests that each take 2 ms to handle
+    def stop_latency(dispatcher, frames):
+        for frame in frames:
+            dispatcher.put('client', frame)
+        while True:
+            address, command, class_name, enqueued_at = dispatcher.get(timeout=0)
+            if command.command != 'CMD_MOTOR':
+                time.sleep(0.002)
+            dispatcher.done(class_name, enqueued_at)
+            if command.command == 'CMD_MOTOR':
+                return time.monotonic() - enqueued_at
+    flood = [b'CMD_LED#255#0#0#255', b'CMD_POWER'] * 25 + [b'CMD_MOTOR#0#0#0#0']
+    single = PriorityDispatcher(class_priorities={'actuator': 0})  # Every command in one FIFO, as before
+    priority = PriorityDispatcher()
+    print("Stop latency, single FIFO: {:.1f} ms".format(stop_latency(single, flood) * 1000))
+    print("Stop latency, by priority: {:.1f} ms".format(stop_latency(priority, flood) * 1000))
+    print(priority.get_stats())
+
+    # Old path against new: the command thread used to move every command through a multiprocessing.Queue
+    # and poll it with sleep(0.001); now a receive thread blocks on the server queue and feeds the dispatcher
+    def old_path(source, done, running):
+        queue_cmd = multiprocessing.Queue()
+        while running.is_set():
+            if source.qsize() > 0:
+                queue_cmd.put(source.get())
+            while not queue_cmd.empty():
+                done(queue_cmd.get()[0])
+            if queue_cmd.empty():
+                time.sleep(0.001)
+    def new_path(source, done, running):
+        dispatcher = PriorityDispatcher()
+        def receive():
+            while running.is_set():
+                try:
+                    address, frame = source.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                dispatcher.put(address, frame)
+            dispatcher.close()
+        threading.Thread(target=receive).start()
+        while True:
+            item = dispatcher.get()
+            if item is None:
+                break
+            done(item[0])
+    def measure(path, count=500, interval=0.002, idle=1.0):
+        source = queue.Queue()
+        running = threading.Event()
+        running.set()
+        latency = LatencyHistogram()
+        received = threading.Semaphore(0)
+        def done(sent_at):
+            latency.record(time.perf_counter() - sent_at)
+            received.release()
+        worker = threading.Thread(target=path, args=(source, done, running))
+        worker.start()
+        time.sleep(0.1)
+        cpu = time.process_time()
+        time.sleep(idle)
+        idle_cpu = (time.process_time() - cpu) / idle
+        for _ in range(count):
+            source.put((time.perf_counter(), b'CMD_M_MOTOR#0#1500#0#0'))
+            received.acquire()
+            time.sleep(interval)
+        running.clear()
+        worker.join()
+        return idle_cpu, latency.get_stats()
+    for name, path in (("multiprocessing.Queue + polling", old_path), ("blocking dispatcher", new_path)):
+        idle_cpu, stats = measure(path)
+        print("{:<32} idle CPU {:5.1f}%  latency mean {:.3f} ms  p99 {:.3f} ms".format(name, idle_cpu * 100, stats['mean_ms'], stats['p99_ms']))
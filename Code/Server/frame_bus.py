@@ -0,0 +1,168 @@
+import collections  # Import collections for the frame record
+import io           # Import io so the bus can be the file object of a picamera2 FileOutput
+import threading    # Import threading for the condition shared by the camera and the consumers
+import time         # Import time for the capture timestamps
+
+# One published frame: sequence number (from 1), capture time (time.monotonic()), the encoded bytes and when it was published
+Frame = collections.namedtuple('Frame', ['seq', 'timestamp', 'data', 'published'], defaults=(None,))
+
+def y_plane(array, size: tuple, roi: tuple = None):
+    """
+    Get the Y (grayscale) plane of a YUV420 frame, or a region of it, as a view without copying.
+    Parameters:
+    array (numpy.ndarray): The frame as (height * 3 / 2, stride) bytes, as picamera2 maps a YUV420 buffer.
+    size (tuple): (width, height) of the frame; the stride may be wider than the width.
+    roi (tuple): (x, y, width, height) as fractions of the frame; None for the whole frame.
+    """
+    width, height = size
+    x, y, w, h = roi if roi is not None else (0.0, 0.0, 1.0, 1.0)
+    return array[round(y * height):round((y + h) * height), round(x * width):round((x + w) * width)]
+
+class FrameBus(io.BufferedIOBase):
+    def __init__(self, size: int = 4, clock=time.monotonic):
+        """
+        Initialize the FrameBus class, a ring of the latest frames shared by any number of consumers.
+        The encoder writes each frame once; consumers get references to the same bytes, never copies.
+        Parameters:
+        size (int): Frames kept; a consumer more than size frames behind loses the oldest ones.
+        clock (callable): Returns the capture time stamped on each frame.
+        """
+        self.size = size
+        self.clock = clock
+        self.ring = [None] * size             # Frame seq is stored in slot seq % size
+        self.seq = 0                          # Sequence number of the newest frame, 0 before the first
+        self.condition = threading.Condition()  # Signals consumers when a frame is published or the bus closes
+        self.stopped = False
+        self.consumers = {}                   # Consumer name -> FrameConsumer, for the stats
+
+    def write(self, buf: bytes) -> int:
+        """Publish one encoded frame and wake every waiting consumer."""
+        self.publish(buf)
+        return len(buf)
+
+    def publish(self, data, timestamp: float = None) -> Frame:
+        """Publish one frame, stamped now unless a capture time is given."""
+        with self.condition:
+            self.seq += 1
+            now = self.clock()
+            frame = Frame(self.seq, now if timestamp is None else timestamp, data, now)
+            self.ring[self.seq % self.size] = frame
+            self.condition.notify_all()
+        return frame
+
+    def latest(self) -> Frame:
+        """Get the newest frame without waiting, or None before the first."""
+        with self.condition:
+            return self.ring[self.seq % self.size] if self.seq > 0 else None
+
+    def next_after(self, seq: int, timeout: float = None) -> Frame:
+        """
+        Wait for a frame newer than seq and return the oldest one still in the ring.
+        Returns:
+        Frame: The frame, or None on timeout or once the bus is closed.
+        """
+        with self.condition:
+            while self.seq <= seq and not self.stopped:
+                if not self.condition.wait(timeout):
+                    return None
+            if self.seq <= seq:
+                return None
+            return self.ring[max(seq + 1, self.seq - self.size + 1) % self.size]
+
+    def consumer(self, name: str) -> 'FrameConsumer':
+        """Get the consumer with this name, creating it at the current frame."""
+        with self.condition:
+            consumer = self.consumers.get(name)
+            if consumer is None:
+                consumer = FrameConsumer(self, name)
+                self.consumers[name] = consumer
+            return consumer
+
+    def reset(self) -> None:
+        """Reopen the bus for a new stream; sequence numbers keep counting up so consumers need no reset."""
+        with self.condition:
+            self.stopped = False
+
+    def close(self) -> None:
+        """Release every waiting consumer."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def get_stats(self) -> dict:
+        """Get the frame count and the received and dropped counts of each consumer."""
+        with self.condition:
+            return {'frames': self.seq,
+                    'consumers': {name: consumer.get_stats() for name, consumer in self.consumers.items()}}
+
+class FrameConsumer:
+    def __init__(self, bus: FrameBus, name: str):
+        """Initialize the FrameConsumer class, one reader of a FrameBus with its own position and drop count."""
+        self.bus = bus
+        self.name = name
+        self.seq = bus.seq   # Newest frame this consumer has seen
+        self.received = 0    # Frames returned
+        self.dropped = 0     # Frames published after the last one returned and skipped
+
+    def take(self, frame: Frame) -> Frame:
+        """Move past a frame and count the ones skipped before it."""
+        if frame is not None and frame.seq > self.seq:
+            self.dropped += frame.seq - self.seq - 1
+            self.received += 1
+            self.seq = frame.seq
+        return frame
+
+    def next(self, timeout: float = None) -> Frame:
+        """Wait for the next frame in order; frames that left the ring before being read count as dropped."""
+        return self.take(self.bus.next_after(self.seq, timeout))
+
+    def newest(self, timeout: float = None) -> Frame:
+        """Wait until a frame newer than the last one exists and return the newest, skipping any backlog."""
+        if self.bus.next_after(self.seq, timeout) is None:
+            return None
+        return self.take(self.bus.latest())
+
+    def latest(self) -> Frame:
+        """Get the newest frame without waiting; it may be the one returned last time."""
+        return self.take(self.bus.latest())
+
+    def get_stats(self) -> dict:
+        """Get the position and the received and dropped counts."""
+        return {'seq': self.seq, 'received': self.received, 'dropped': self.dropped}
+
+if __name__ == '__main__':
+    # A 30 fps camera feeding a video sender (newest frame, as fast as the link allows), a vision loop that
+    # takes 80 ms per frame and a recorder that wants every frame but is slightly too slow; each runs at its own pace.
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    bus = FrameBus()  # Create an instance of the FrameBus class
+    FRAMES = 90
+    results = {}
+    def run(name, method, work):
+        consumer = bus.consumer(name)
+        ages = []
+        while True:
+            frame = getattr(consumer, method)(timeout=1.0)
+            if frame is None:
+                break
+            ages.append(time.monotonic() - frame.timestamp)
+            time.sleep(work)
+        results[name] = sum(ages) / len(ages) * 1000 if ages else 0.0
+    threads = [threading.Thread(target=run, args=('video', 'newest', 0.012)),
+               threading.Thread(target=run, args=('vision', 'newest', 0.080)),
+               threading.Thread(target=run, args=('recorder', 'next', 0.040))]
+    for name in ('video', 'vision', 'recorder'):
+        bus.consumer(name)
+    for thread in threads:
+        thread.start()
+    payload = bytes(20000)  # One encoded JPEG, shared by reference
+    start = time.monotonic()
+    for i in range(FRAMES):
+        bus.write(payload)
+        time.sleep(max(0.0, start + (i + 1) / 30.0 - time.monotonic()))
+    time.sleep(0.2)
+    print("Latest: seq {}, same bytes object as written: {}".format(bus.latest().seq, bus.latest().data is payload))
+    bus.close()
+    for thread in threads:
+        thread.join()
+    for name, stats in bus.get_stats()['consumers'].items():
+        print("{:<9} received {:3d}  dropped {:3d}  mean frame age {:.1f} ms".format(name, stats['received'], stats['dropped'], results[name]))
@@ -0,0 +1,192 @@
+import collections  # Import collections for the result record
+import struct       # Import struct for the headers in shared memory
+import time         # Import time for the capture timestamps
+import numpy as np  # Import numpy to map the frames without copying
+from multiprocessing import resource_tracker, shared_memory  # Import shared_memory for the segment shared with the vision process
+
+RING_MAGIC = 0x474E5246                  # 'FRNG'
+RING_HEADER = struct.Struct('<IIIIQ')    # Magic, width, height, slots, newest frame sequence number
+RESULT = struct.Struct('<QQdddddQQ')     # Seqlock counter, frame seq, captured, started, finished, angle, confidence, processed, torn
+SLOT_HEADER = struct.Struct('<QQd')      # Seqlock counter, frame seq, capture time
+ALIGN = 64                               # Cache line, so a slot's pixels never share a line with another slot's header
+RESULT_OFFSET = ALIGN                    # The result record gets its own cache lines after the ring header
+SLOTS_OFFSET = -(-(RESULT_OFFSET + RESULT.size) // ALIGN) * ALIGN
+assert RING_HEADER.size <= RESULT_OFFSET and RESULT_OFFSET + RESULT.size <= SLOTS_OFFSET, "frame ring regions overlap"
+
+# Result of one frame: sequence number, capture, analysis start and end times (time.monotonic()), steering angle and
+# confidence (0 to 1), and the worker's counts of frames analysed and frames overwritten while being analysed
+VisionResult = collections.namedtuple('VisionResult', ['seq', 'captured', 'started', 'finished', 'angle', 'confidence', 'processed', 'torn'])
+
+class SharedFrameRing:
+    def __init__(self, name: str = None, size: tuple = None, slots: int = 4, track: bool = True):
+        """
+        Initialize the SharedFrameRing class, grayscale frames in a multiprocessing.shared_memory ring that another
+        process maps without copying, plus a small record for the result sent back.
+        Each slot and the result are guarded by a seqlock: the counter is odd while the writer is inside, and a reader
+        re-checks it once done, so a frame overwritten while it was read is detected instead of locking the writer out.
+        Python has no memory fences; the seqlock relies on the counter and pixel stores being separate interpreter
+        calls. That holds on the Pi in practice, and a torn frame costs one steering estimate, never a crash.
+        Parameters:
+        name (str): Attach to this existing ring; None creates a new one.
+        size (tuple): (width, height) of the frames, when creating.
+        slots (int): Frames kept; a reader slower than slots frames sees its frame overwritten (counted as torn).
+        track (bool): When attaching, leave the ring to this process's resource tracker, which removes it when the
+                      program exits. False for a ring created by an unrelated process, such as the server's.
+        """
+        if name is None:
+            width, height = size
+            self.slot_size = -(-(SLOT_HEADER.size + width * height) // ALIGN) * ALIGN
+            self.shm = shared_memory.SharedMemory(create=True, size=SLOTS_OFFSET + slots * self.slot_size)
+            RING_HEADER.pack_into(self.shm.buf, 0, RING_MAGIC, width, height, slots, 0)
+            self.owner = True
+        else:
+            self.shm = self.attach(name, track)
+            magic, width, height, slots, _ = RING_HEADER.unpack_from(self.shm.buf, 0)
+            if magic != RING_MAGIC:
+                self.shm.close()
+                raise ValueError("Not a frame ring: {}".format(name))
+            self.slot_size = -(-(SLOT_HEADER.size + width * height) // ALIGN) * ALIGN
+            self.owner = False
+        self.name = self.shm.name
+        self.size = (width, height)
+        self.slots = slots
+        self.seq = RING_HEADER.unpack_from(self.shm.buf, 0)[4]   # Newest frame this process wrote or read
+        self.result_counter = 0
+        # One (height, width) uint8 array per slot, straight over the shared pages
+        self.frames = [np.ndarray((height, width), dtype=np.uint8, buffer=self.shm.buf,
+                                  offset=SLOTS_OFFSET + i * self.slot_size + SLOT_HEADER.size) for i in range(slots)]
+
+    @staticmethod
+    def attach(name: str, track: bool) -> shared_memory.SharedMemory:
+        """Map an existing segment; untracked, so exiting does not remove a ring another program still feeds."""
+        try:
+            return shared_memory.SharedMemory(name=name, track=track)  # Python 3.13 and later
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            if not track:
+                resource_tracker.unregister(shm._name, 'shared_memory')  # Before 3.13 every attach is tracked
+            return shm
+
+    def slot_offset(self, seq: int) -> int:
+        return SLOTS_OFFSET + (seq % self.slots) * self.slot_size
+
+    def newest(self) -> int:
+        """Get the sequence number of the newest complete frame, 0 before the first."""
+        return RING_HEADER.unpack_from(self.shm.buf, 0)[4]
+
+    def publish(self, gray, timestamp: float = None) -> int:
+        """Copy one frame into the next slot (the only copy on its way to the vision process) and return its sequence number."""
+        seq = self.newest() + 1
+        offset = self.slot_offset(seq)
+        SLOT_HEADER.pack_into(self.shm.buf, offset, 2 * seq - 1, seq, 0.0)           # Odd: being written
+        np.copyto(self.frames[seq % self.slots], gray)
+        SLOT_HEADER.pack_into(self.shm.buf, offset, 2 * seq, seq, time.monotonic() if timestamp is None else timestamp)
+        struct.pack_into('<Q', self.shm.buf, 16, seq)                               # Newest seq field of RING_HEADER
+        self.seq = seq
+        return seq
+
+    def wait(self, seq: int = None, timeout: float = None, poll: float = 0.002) -> int:
+        """
+        Wait for a frame newer than seq (default the last one written or read here) and return the newest sequence number.
+        There is no cross-process condition to wait on, so this polls the header every poll seconds.
+        Returns:
+        int: The sequence number, or None on timeout.
+        """
+        seq = self.seq if seq is None else seq
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            newest = self.newest()
+            if newest > seq:
+                return newest
+            if end is not None and time.monotonic() >= end:
+                return None
+            time.sleep(poll)
+
+    def read(self, seq: int):
+        """
+        Get frame seq as a view of the shared pages and its capture time, without copying.
+        The view stays valid until the writer comes back to its slot; check valid(seq) after using it.
+        Returns:
+        tuple: (view, captured), or None if the frame was already overwritten.
+        """
+        counter, _, captured = SLOT_HEADER.unpack_from(self.shm.buf, self.slot_offset(seq))
+        self.seq = max(self.seq, seq)  # Move past it either way, so wait() does not hand the same frame back at once
+        if counter != 2 * seq:
+            return None
+        return self.frames[seq % self.slots], captured
+
+    def valid(self, seq: int) -> bool:
+        """Check that frame seq has not been overwritten since read(seq)."""
+        return SLOT_HEADER.unpack_from(self.shm.buf, self.slot_offset(seq))[0] == 2 * seq
+
+    def publish_result(self, seq: int, captured: float, started: float, angle: float, confidence: float, processed: int, torn: int) -> None:
+        """Write the result of frame seq (vision process side); only one process may publish results."""
+        self.result_counter += 1
+        struct.pack_into('<Q', self.shm.buf, RESULT_OFFSET, 2 * self.result_counter - 1)  # Odd: being written
+        RESULT.pack_into(self.shm.buf, RESULT_OFFSET, 2 * self.result_counter - 1, seq, captured, started, time.monotonic(),
+                         angle, confidence, processed, torn)
+        struct.pack_into('<Q', self.shm.buf, RESULT_OFFSET, 2 * self.result_counter)
+
+    def result(self) -> VisionResult:
+        """Get the newest result without waiting, or None before the first."""
+        while True:
+            values = RESULT.unpack_from(self.shm.buf, RESULT_OFFSET)
+            if values[0] == 0:
+                return None
+            if values[0] % 2 == 0 and struct.unpack_from('<Q', self.shm.buf, RESULT_OFFSET)[0] == values[0]:
+                return VisionResult(*values[1:])
+            time.sleep(0)  # The vision process is inside the record; it only stays there for a few stores
+
+    def close(self) -> None:
+        """Unmap the ring; the creating process also removes it."""
+        self.frames = []  # The views must go before the mapping can close
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+if __name__ == '__main__':
+    # A writer and a reader process; the reader checks that every frame it validates is intact (each frame is filled
+    # with its sequence number), and that frames overwritten during its slow reads are caught as torn.
+    import multiprocessing
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    def reader(name, results):
+        ring = SharedFrameRing(name)
+        good, torn, bad = 0, 0, 0
+        while True:
+            seq = ring.wait(timeout=2.0)
+            if seq is None:
+                break
+            frame = ring.read(seq)
+            if frame is None:
+                torn += 1
+                continue
+            view, _ = frame
+            first, last = int(view[0, 0]), int(view[-1, -1])
+            time.sleep(0.001 if seq % 50 else 0.02)  # Now and then slower than the ring
+            if not ring.valid(seq):
+                torn += 1
+            elif first != seq % 256 or last != seq % 256:
+                bad += 1
+            else:
+                good += 1
+        ring.close()
+        results.put((good, torn, bad))
+    ring = SharedFrameRing(size=(400, 210))  # Create an instance of the SharedFrameRing class
+    context = multiprocessing.get_context('fork')  # The demo reader is local to this block, so it is forked rather than spawned
+    results = context.Queue()
+    process = context.Process(target=reader, args=(ring.name, results))
+    process.start()
+    time.sleep(0.5)
+    frame = np.empty((210, 400), dtype=np.uint8)
+    start = time.monotonic()
+    for i in range(1, 1001):
+        frame.fill(i % 256)
+        ring.publish(frame)
+        time.sleep(max(0.0, start + i / 200.0 - time.monotonic()))
+    good, torn, bad = results.get()
+    process.join()
+    ring.close()
+    print("1000 frames at 200 fps: {} read intact, {} overwritten while read (caught), {} corrupt (missed)".format(good, torn, bad))
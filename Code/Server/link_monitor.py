@@ -0,0 +1,175 @@
+import collections  # Import collections for the rolling sample windows
+import threading    # Import threading for the lock shared by the receive thread and readers
+import time         # Import time for the microsecond timestamps
+from command_schema import COMMANDS  # Import the CMD_PONG codec
+
+def now_us() -> int:
+    """Get the wall clock time in microseconds, the unit of the ping and pong timestamps."""
+    return time.time_ns() // 1000
+
+def exchange_sample(t0: int, t1: int, t2: int, t3: int) -> tuple:
+    """
+    Compute one NTP-style sample from the four timestamps of a ping and its pong, in microseconds.
+    t0 and t3 are the requester's send and receive times, t1 and t2 the responder's receive and send times.
+    Returns:
+    tuple: (round trip time, responder clock minus requester clock), both in seconds.
+    """
+    rtt = ((t3 - t0) - (t2 - t1)) / 1000000.0
+    offset = ((t1 - t0) + (t2 - t3)) / 2000000.0
+    return rtt, offset
+
+class LinkEstimator:
+    def __init__(self, window: int = 64, filter_size: int = 8):
+        """
+        Initialize the LinkEstimator class, the rolling round trip time, jitter and clock offset of one peer.
+        Parameters:
+        window (int): Round trip times kept for the percentiles.
+        filter_size (int): Latest samples the clock filter chooses the offset from.
+        """
+        self.rtts = collections.deque(maxlen=window)
+        self.filter = collections.deque(maxlen=filter_size)  # (rtt, offset) of the latest samples
+        self.jitter = 0.0      # Smoothed round trip time variation in seconds (RFC 3550 style)
+        self.offset = 0.0      # Peer clock minus local clock in seconds
+        self.last_rtt = None
+        self.samples = 0
+
+    def add_sample(self, rtt: float, offset: float) -> None:
+        """Add one sample; offset is the peer clock minus the local clock."""
+        if rtt < 0:
+            return  # A clock step during the exchange
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16.0
+        self.last_rtt = rtt
+        self.rtts.append(rtt)
+        self.filter.append((rtt, offset))
+        # Clock filter: the sample with the shortest round trip had the least queueing, so its offset is the most accurate
+        self.offset = min(self.filter)[1]
+        self.samples += 1
+
+    def percentile(self, percent: float) -> float:
+        """Get a percentile of the round trip times in the window, in seconds."""
+        if not self.rtts:
+            return 0.0
+        ordered = sorted(self.rtts)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+    def to_local(self, peer_time_us: int) -> int:
+        """Convert a peer timestamp in microseconds to the local clock."""
+        return peer_time_us - int(self.offset * 1000000)
+
+    def get_stats(self) -> dict:
+        """Get the sample count, the round trip percentiles, jitter and clock offset in milliseconds."""
+        return {'samples': self.samples,
+                'rtt_min_ms': min(self.rtts) * 1000 if self.rtts else 0.0,
+                'rtt_p50_ms': self.percentile(50) * 1000,
+                'rtt_p90_ms': self.percentile(90) * 1000,
+                'rtt_p99_ms': self.percentile(99) * 1000,
+                'jitter_ms': self.jitter * 1000,
+                'offset_ms': self.offset * 1000}
+
+class LinkMonitor:
+    def __init__(self, send, connected=None, window: int = 64, clock=now_us):
+        """
+        Initialize the LinkMonitor class, which answers CMD_PING and keeps a LinkEstimator per client.
+        Parameters:
+        send (callable): Called as send(address, text) to send a pong to a client.
+        connected (callable): Returns the addresses still connected; other clients are forgotten.
+        window (int): Round trip times kept per client.
+        clock (callable): Returns the local time in microseconds.
+        """
+        self.send = send
+        self.clock = clock
+        self.connected = connected
+        self.window = window
+        self.lock = threading.Lock()
+        self.peers = {}  # Client address -> estimator and the timestamps of the last pong sent
+        self.pong = COMMANDS['CMD_PONG']
+
+    def handle_ping(self, address, args, received_us: int = None) -> bool:
+        """
+        Answer a CMD_PING and add the sample of the previous exchange, whose receive time the ping carries.
+        Parameters:
+        address: The client address.
+        args (tuple): seq, client send time, last seq and last client receive time.
+        received_us (int): When the ping arrived; stamp it as early as possible, the default is now.
+        """
+        t1 = self.clock() if received_us is None else received_us
+        if len(args) < 4:
+            return False
+        seq, t0, last_seq, last_t3 = args[:4]
+        with self.lock:
+            peer = self.peers.get(address)
+            if peer is None:
+                self.prune()
+                peer = {'estimator': LinkEstimator(self.window), 'last': None, 'pings': 0}
+                self.peers[address] = peer
+            peer['pings'] += 1
+            last = peer['last']
+            if last is not None and last[0] == last_seq and last_t3 > 0:
+                rtt, offset = exchange_sample(last[1], last[2], last[3], last_t3)
+                peer['estimator'].add_sample(rtt, -offset)  # The client is the requester, so its offset is the negative
+            t2 = self.clock()
+            peer['last'] = (seq, t0, t1, t2)
+        self.send(address, self.pong.encode_text(seq, t0, t1, t2))
+        return True
+
+    def prune(self) -> None:
+        """Forget clients that are no longer connected (lock held)."""
+        if self.connected is not None:
+            connected = set(self.connected())
+            for address in [x for x in self.peers if x not in connected]:
+                del self.peers[address]
+
+    def forget(self, address) -> None:
+        """Forget a client."""
+        with self.lock:
+            self.peers.pop(address, None)
+
+    def to_local(self, ip: str, peer_time_us: int) -> int:
+        """Convert a timestamp from the clock of the client at ip to the local clock; unchanged while no sample exists."""
+        with self.lock:
+            for address, peer in self.peers.items():
+                if address[0] == ip and peer['estimator'].samples > 0:
+                    return peer['estimator'].to_local(peer_time_us)
+        return peer_time_us
+
+    def get_stats(self) -> dict:
+        """Get the link statistics of each client, keyed by 'ip:port'."""
+        with self.lock:
+            return {"{}:{}".format(*address): dict(peer['estimator'].get_stats(), pings=peer['pings']) for address, peer in self.peers.items()}
+
+if __name__ == '__main__':
+    # Simulated client whose clock runs 250 ms ahead, on a link with 2 ms base delay each way plus random queueing
+    # that is occasionally large; the server and the client get the same samples from the four timestamps.
+    import random
+    from message import parse_command
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    SKEW_US = 250000
+    pongs = []
+    server_clock = [1700000000000000]
+    monitor = LinkMonitor(lambda address, text: pongs.append(text), clock=lambda: server_clock[0])  # Create an instance of the LinkMonitor class
+    client = LinkEstimator()
+    address = ('192.168.1.20', 50123)
+    last_seq, last_t3 = 0, 0
+    for seq in range(1, 201):
+        delay_up = 2000 + random.expovariate(1 / 300.0) + (20000 if random.random() < 0.05 else 0)
+        delay_down = 2000 + random.expovariate(1 / 300.0)
+        t0 = server_clock[0] + SKEW_US
+        server_clock[0] += int(delay_up)
+        monitor.handle_ping(address, (seq, t0, last_seq, last_t3))
+        pong = parse_command(pongs[-1].strip().encode('utf-8'))
+        _, _, t1, t2 = pong.args
+        t3 = int(t2 + delay_down + SKEW_US)
+        rtt, offset = exchange_sample(t0, t1, t2, t3)
+        client.add_sample(rtt, offset)
+        last_seq, last_t3 = seq, t3
+        server_clock[0] += 100000  # 10 Hz pings
+    print(pongs[-1].strip())
+    print("client:", client.get_stats())
+    print("server:", monitor.get_stats())
+    print("offset error: server {:.3f} ms, client {:.3f} ms".format(monitor.get_stats()["192.168.1.20:50123"]['offset_ms'] - SKEW_US / 1000.0,
+                                                                  client.offset * 1000 + SKEW_US / 1000.0))
+    # A client timestamp converted to the server clock gives a true one-way latency
+    sent = server_clock[0] + SKEW_US
+    server_clock[0] += 2500
+    print("one-way latency of a frame sent 2.5 ms ago: {:.3f} ms".format((server_clock[0] - monitor.to_local('192.168.1.20', sent)) / 1000.0))
@@ -0,0 +1,227 @@
+import socket     # Import socket for the command connection
+import sys        # Import sys for the command line
+import threading  # Import threading for the reader thread and the send window
+import time       # Import time to measure end-to-end latency
+from command_schema import COMMANDS, PROTOCOL_VERSION, TEXT_SEPARATOR, TEXT_TAG, ACK_OK, ACK_UNKNOWN, ACK_REJECTED, ACK_FAILED, ACK_DROPPED, tag_text, tag_binary
+from stats import LatencyHistogram  # Import the latency histogram for the results
+
+ACK_NAMES = {ACK_OK: 'ok', ACK_UNKNOWN: 'unknown', ACK_REJECTED: 'rejected', ACK_FAILED: 'failed', ACK_DROPPED: 'dropped'}
+
+class LoadTester:
+    def __init__(self, host: str, port: int = 5000, binary: bool = True):
+        """
+        Initialize the LoadTester class, which pipelines tagged requests to a command server and matches the acks.
+        Parameters:
+        host (str): The car's address.
+        port (int): The command port.
+        binary (bool): Send binary frames when the server supports them.
+        """
+        self.host = host
+        self.port = port
+        self.binary = binary
+        self.sock = None
+        self.version = 0
+        self.condition = threading.Condition()  # Signals the sender when the window has room
+        self.pending = {}       # Request id -> send time of requests not acknowledged yet
+        self.next_id = 0
+        self.replies = 0        # Tagged replies received
+        self.statuses = {}      # Ack count per status
+        self.malformed = 0      # CMD_ACK lines that could not be parsed
+        self.reading = False    # Set while the reader thread is running
+        self.end_to_end = LatencyHistogram()  # Request sent to CMD_ACK received
+        self.service = LatencyHistogram()     # Time in the handler, reported by the server
+        self.queued = LatencyHistogram()      # Time in the dispatch queue, reported by the server
+
+    def connect(self) -> int:
+        """Connect and agree on the protocol version; correlation ids need version 5."""
+        self.sock = socket.create_connection((self.host, self.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(COMMANDS['CMD_PROTOCOL'].encode_text(PROTOCOL_VERSION).encode('utf-8'))
+        self.sock.settimeout(2.0)
+        rest = b''
+        try:
+            while self.version == 0:
+                data = self.sock.recv(4096)
+                if not data:
+                    break
+                lines = (rest + data).split(b'\n')
+                rest = lines.pop()
+                for line in lines:
+                    tokens = line.decode('utf-8', errors='replace').split(TEXT_SEPARATOR)
+                    if tokens[0] == 'CMD_PROTOCOL' and len(tokens) > 1:
+                        self.version = int(tokens[1])
+        except socket.timeout:
+            pass  # Servers without the handshake never answer
+        self.sock.settimeout(None)
+        return self.version
+
+    def read(self) -> None:
+        """Match CMD_ACK lines to the pending requests until the connection closes, then wake run()."""
+        try:
+            self.read_acks()
+        finally:
+            with self.condition:
+                self.reading = False
+                self.condition.notify_all()
+
+    def read_acks(self) -> None:
+        rest = b''
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            received = time.monotonic()
+            lines = (rest + data).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                tokens = line.decode('utf-8', errors='replace').strip().split(TEXT_SEPARATOR)
+                if tokens[0].startswith(TEXT_TAG):
+                    self.replies += 1
+                elif tokens[0] == 'CMD_ACK' and len(tokens) >= 5:
+                    try:
+                        request_id, status, service_us, queue_us = (int(x) for x in tokens[1:5])
+                    except ValueError:
+                        self.malformed += 1  # Count it and keep reading; one bad line must not stop the run
+                        continue
+                    with self.condition:
+                        sent = self.pending.pop(request_id, None)
+                        if sent is None:
+                            continue
+                        self.statuses[status] = self.statuses.get(status, 0) + 1
+                        self.condition.notify()
+                    self.end_to_end.record(received - sent)
+                    self.service.record(service_us / 1000000.0)
+                    self.queued.record(queue_us / 1000000.0)
+
+    def run(self, requests: list, window: int = 32, timeout: float = 5.0) -> dict:
+        """
+        Send every request with at most window unacknowledged, then wait for the last acks.
+        Sending stops early if the connection closes or the window stays full for timeout seconds.
+        Parameters:
+        requests (list): (command name, args) pairs.
+        window (int): Requests in flight at most.
+        timeout (float): Seconds to wait for an ack before giving up.
+        Returns:
+        dict: Ack counts by status, latency percentiles and the request rate.
+        """
+        self.reading = True
+        reader = threading.Thread(target=self.read, daemon=True)
+        reader.start()
+        use_binary = self.binary and self.version >= 1
+        start = time.monotonic()
+        for name, args in requests:
+            spec = COMMANDS[name]
+            with self.condition:
+                deadline = time.monotonic() + timeout
+                while len(self.pending) >= window and self.reading and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+                if not self.reading or len(self.pending) >= window:
+                    break  # The connection closed or no ack came within timeout; stop instead of hanging
+                self.next_id += 1
+                request_id = self.next_id
+                self.pending[request_id] = time.monotonic()
+            if use_binary:
+                self.sock.sendall(tag_binary(request_id, spec.encode_binary(*args)))
+            else:
+                self.sock.sendall(tag_text(request_id, spec.encode_text(*args)).encode('utf-8'))
+        with self.condition:
+            deadline = time.monotonic() + timeout
+            while self.pending and self.reading and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            lost = len(self.pending)
+        elapsed = time.monotonic() - start
+        return {'requests': len(requests),
+                'sent': self.next_id,
+                'acks': {ACK_NAMES.get(status, status): count for status, count in self.statuses.items()},
+                'unacknowledged': lost,
+                'replies': self.replies,
+                'malformed': self.malformed,
+                'requests_per_s': len(requests) / elapsed,
+                'end_to_end': self.end_to_end.get_stats(),
+                'service': self.service.get_stats(),
+                'queued': self.queued.get_stats()}
+
+    def close(self) -> None:
+        """Close the connection."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+def start_local_server() -> tuple:
+    """Start a command server on loopback with the dispatcher and registry of main.py and stand-in handlers."""
+    from tcp_server import TCPServer
+    from message import CommandFramer
+    from dispatcher import PriorityDispatcher
+    from registry import CommandRegistry
+    tcp = TCPServer(framer=CommandFramer(), max_frame_size=4096)
+    tcp.start('127.0.0.1', 0)
+    ack = COMMANDS['CMD_ACK']
+    send_ack = lambda address, request_id, status, service=0.0, queued=0.0: tcp.send_to_client(address, ack.encode_text(request_id, status, int(service * 1000000), int(queued * 1000000)).encode('utf-8'))
+    dispatcher = PriorityDispatcher(on_drop=lambda address, command: command.request_id is not None and send_ack(address, command.request_id, ACK_DROPPED))
+    registry = CommandRegistry()
+    context = threading.local()
+    def reply(address, text):
+        tcp.send_to_client(address, tag_text(context.request_id, text).encode('utf-8'))
+    registry.register_command(COMMANDS['CMD_PROTOCOL'], lambda address, args: tcp.send_to_client(address, COMMANDS['CMD_PROTOCOL'].encode_text(min(args[0], PROTOCOL_VERSION)).encode('utf-8')))
+    registry.register_command(COMMANDS['CMD_SERVO'], lambda address, args: time.sleep(0.0002))  # An I2C write to the PCA9685
+    registry.register_command(COMMANDS['CMD_M_MOTOR'], lambda address, args: time.sleep(0.0004))  # Four motor channels
+    registry.register_command(COMMANDS['CMD_POWER'], lambda address, args: reply(address, "CMD_POWER#7.8\n"))
+    def feed():
+        while True:
+            address, frame = tcp.message_queue.get()
+            if frame is None:
+                return
+            dispatcher.put(address, frame)
+    def dispatch():
+        while True:
+            item = dispatcher.get()
+            if item is None:
+                return
+            address, command, class_name, enqueued_at = item
+            context.request_id = command.request_id
+            queued = time.monotonic() - enqueued_at
+            status, service = registry.dispatch_status(command.command, command.args, address)
+            if command.request_id is not None:
+                send_ack(address, command.request_id, status, service, queued)
+            dispatcher.done(class_name, enqueued_at)
+    threading.Thread(target=feed, daemon=True).start()
+    threading.Thread(target=dispatch, daemon=True).start()
+    return tcp, dispatcher
+
+if __name__ == '__main__':
+    # python3 load_test.py [host|local [count [window]]]; with no host or 'local' a loopback server with stand-in handlers is started
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    host = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != 'local' else None
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    window = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    local = None
+    port = 5000
+    if host is None:
+        local = start_local_server()
+        host, port = local[0].server_socket.getsockname()
+    requests = []
+    for i in range(count):
+        if i % 10 == 0:
+            requests.append(('CMD_POWER', ()))
+        elif i % 2 == 0:
+            requests.append(('CMD_SERVO', (0, 60 + i % 60)))
+        else:
+            requests.append(('CMD_M_MOTOR', (0, 1000 + i % 1000, 0, 0)))
+    tester = LoadTester(host, port)  # Create an instance of the LoadTester class
+    version = tester.connect()
+    if version < 5:
+        print("Server speaks protocol version {}, correlation ids need version 5".format(version))
+        sys.exit(1)
+    result = tester.run(requests, window)
+    tester.close()
+    print("{} requests, window {}: {:.0f} requests/s, acks {}, unacknowledged {}, tagged replies {}".format(
+        result['requests'], window, result['requests_per_s'], result['acks'], result['unacknowledged'], result['replies']))
+    for name in ('end_to_end', 'queued', 'service'):
+        stats = result[name]
+        print("  {:<10} p50 {:.3f} ms  p90 {:.3f} ms  p99 {:.3f} ms  max {:.3f} ms".format(name, stats['p50_ms'], stats['p90_ms'], stats['p99_ms'], stats['max_ms']))
+    if local is not None:
+        local[1].close()
+        local[0].close()
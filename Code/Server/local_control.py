@@ -0,0 +1,380 @@
+import itertools  # Import itertools for the local client ids
+import os         # Import os to replace a stale socket file
+import selectors  # Import selectors to serve every local client from one thread
+import socket     # Import socket for the AF_UNIX socket
+import stat       # Import stat to recognise a stale socket file
+import threading  # Import threading for the server thread
+import time       # Import time for the benchmark
+from command_schema import COMMANDS, LOCAL_SOCKET_PATH, TEXT_SEPARATOR, DUTY, BINARY_MAGIC, BINARY_TAG_MAGIC, tag_text  # Import the shared command schema
+from message import CommandFramer, parse_command  # Import the framer and the thread-safe command parser
+
+LOCAL_ADDRESS = 'local'  # First element of the (LOCAL_ADDRESS, id) address of a local client
+
+def is_local_address(address) -> bool:
+    """Check whether a client address belongs to a LocalControlServer client."""
+    return isinstance(address, tuple) and len(address) == 2 and address[0] == LOCAL_ADDRESS
+
+class LocalControlServer:
+    def __init__(self, deliver, snapshot=None, path: str = LOCAL_SOCKET_PATH, on_disconnect=None, vision=None):
+        """
+        Initialize the LocalControlServer class, the command port for programs running on the car itself.
+        Parameters:
+        deliver (callable): Called as deliver(address, ParsedCommand) for each command, e.g. PriorityDispatcher.put_command.
+        snapshot (callable): Called as snapshot(max_age) to answer CMD_SNAPSHOT on the server thread, e.g. TelemetryHub.snapshot.
+        path (str): Filesystem path of the socket.
+        on_disconnect (callable): Called as on_disconnect(address) when a local client goes away.
+        vision (callable): Called as vision(address, state) to answer CMD_VISION; returns the name of the frame ring
+                           it feeds for the client, or None.
+        """
+        self.deliver = deliver
+        self.snapshot = snapshot
+        self.path = path
+        self.on_disconnect = on_disconnect
+        self.vision = vision
+        # Message boundaries make every recv exactly one command, so no framing is needed where SEQPACKET exists
+        self.sock_type = getattr(socket, 'SOCK_SEQPACKET', socket.SOCK_STREAM)
+        self.framer = CommandFramer()
+        self.server_socket = None
+        self.selector = None
+        self.thread = None
+        self.running = False
+        self.stop_r, self.stop_w = None, None
+        self.clients = {}          # Client address -> [socket, receive buffer]
+        self.clients_lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.received = 0          # Commands received
+        self.invalid = 0           # Frames that could not be parsed
+        self.snapshots = 0         # CMD_SNAPSHOT requests answered
+        self.dropped = 0           # Replies dropped because a client was not reading
+
+    def start(self) -> None:
+        """Create the socket, replacing a stale one left by an earlier run, and start the server thread."""
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.server_socket = socket.socket(socket.AF_UNIX, self.sock_type)
+        self.server_socket.bind(self.path)
+        os.chmod(self.path, 0o660)  # Owner and group only: this socket drives the motors
+        self.server_socket.listen(8)
+        self.server_socket.setblocking(False)
+        self.stop_r, self.stop_w = socket.socketpair()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.selector.register(self.stop_r, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print("Local control listening on {}".format(self.path))
+
+    def stop(self) -> None:
+        """Stop the server thread, close every client and remove the socket file."""
+        if not self.running:
+            return
+        self.running = False
+        self.stop_w.send(b'x')
+        self.thread.join(1)
+        self.thread = None
+        with self.clients_lock:
+            clients = list(self.clients.values())
+            self.clients.clear()
+        for sock, _ in clients:
+            sock.close()
+        self.selector.close()
+        self.server_socket.close()
+        self.stop_r.close()
+        self.stop_w.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def run(self) -> None:
+        """Accept local clients and handle their commands until stopped."""
+        while self.running:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.server_socket:
+                    self.accept()
+                elif key.fileobj is self.stop_r:
+                    return
+                else:
+                    self.read(key.data)
+
+    def accept(self) -> None:
+        """Accept one local client."""
+        try:
+            sock, _ = self.server_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        address = (LOCAL_ADDRESS, next(self.ids))
+        with self.clients_lock:
+            self.clients[address] = [sock, bytearray()]
+        self.selector.register(sock, selectors.EVENT_READ, address)
+
+    def read(self, address) -> None:
+        """Receive from one client and handle every complete command."""
+        sock, buffer = self.clients[address]
+        try:
+            data = sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.close_client(address)
+            return
+        if self.sock_type != socket.SOCK_STREAM:
+            # One message per recv: drain what is queued before going back to select()
+            self.handle(address, self.message_frame(data))
+            for _ in range(63):
+                try:
+                    data = sock.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    self.close_client(address)
+                    return
+                self.handle(address, self.message_frame(data))
+            return
+        buffer += data
+        frames, consumed = self.framer.split(buffer, len(buffer))
+        del buffer[:consumed]
+        for frame in frames:
+            self.handle(address, frame)
+
+    def message_frame(self, data: bytes) -> bytes:
+        """
+        Get the command frame of one SEQPACKET message. A binary frame is returned as it is, since its last argument
+        byte may look like whitespace; a text frame loses its trailing newline only.
+        """
+        if data[0] == BINARY_MAGIC or data[0] == BINARY_TAG_MAGIC:
+            return data
+        return data[:-1] if data.endswith(b'\n') else data
+
+    def handle(self, address, frame: bytes) -> None:
+        """Answer a snapshot request here, hand everything else to deliver()."""
+        command = parse_command(frame)
+        if command is None:
+            self.invalid += 1
+            return
+        self.received += 1
+        if command.command == 'CMD_SNAPSHOT' and self.snapshot is not None:
+            self.snapshots += 1
+            reply = self.snapshot(command.args[0] / 1000.0 if command.args else None)
+            self.send(address, reply if command.request_id is None else tag_text(command.request_id, reply))
+            return
+        if command.command == 'CMD_VISION' and self.vision is not None:
+            name = self.vision(address, command.args[0] if command.args else 1)
+            reply = 'CMD_VISION' + TEXT_SEPARATOR + (name or '') + '\n'
+            self.send(address, reply if command.request_id is None else tag_text(command.request_id, reply))
+            return
+        self.deliver(address, command)
+
+    def send(self, address, data) -> bool:
+        """Send a reply to one local client; a client that is not reading loses the reply rather than stall the server."""
+        with self.clients_lock:
+            client = self.clients.get(address)
+        if client is None:
+            return False
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.sock_type != socket.SOCK_STREAM:
+            data = data.rstrip(b'\n')  # One reply per message
+        try:
+            client[0].send(data)
+            return True
+        except (BlockingIOError, InterruptedError):
+            self.dropped += 1
+        except OSError:
+            pass
+        return False
+
+    def close_client(self, address) -> None:
+        """Forget a client that disconnected."""
+        with self.clients_lock:
+            client = self.clients.pop(address, None)
+        if client is None:
+            return
+        try:
+            self.selector.unregister(client[0])
+        except (KeyError, ValueError):
+            pass
+        client[0].close()
+        if self.on_disconnect is not None:
+            self.on_disconnect(address)
+
+    def get_client_addresses(self) -> list:
+        """Get the addresses of the connected local clients."""
+        with self.clients_lock:
+            return list(self.clients.keys())
+
+    def get_stats(self) -> dict:
+        """Get the client count and the command, snapshot and drop counters."""
+        return {'clients': len(self.clients),
+                'received': self.received,
+                'invalid': self.invalid,
+                'snapshots': self.snapshots,
+                'dropped': self.dropped}
+
+class LocalCar:
+    def __init__(self, path: str = LOCAL_SOCKET_PATH):
+        """
+        Initialize the LocalCar class, a client of the local control socket for programs on the car.
+        It drives the motors and servos through the running server instead of opening the PCA9685 a second time.
+        """
+        self.sock = socket.socket(socket.AF_UNIX, getattr(socket, 'SOCK_SEQPACKET', socket.SOCK_STREAM))
+        self.sock.connect(path)
+        self.stream = self.sock.type == socket.SOCK_STREAM
+        self.request_id = 0
+        self.pending = b''
+
+    def command(self, name: str, *args) -> None:
+        """Send one command, binary when the arguments fit the schema."""
+        spec = COMMANDS[name]
+        frame = spec.encode_binary(*args) if len(args) == spec.arg_count and spec.validate(args) else spec.encode_text(*args).encode('utf-8')
+        self.sock.send(frame)
+
+    def set_motor_model(self, duty1, duty2, duty3, duty4) -> None:
+        """Set the four wheel duties, like Ordinary_Car.set_motor_model."""
+        self.command('CMD_MOTOR', *(max(DUTY[0], min(DUTY[1], int(x))) for x in (duty1, duty2, duty3, duty4)))
+
+    def set_servo_pwm(self, channel, angle) -> None:
+        """Turn a servo, like Servo.set_servo_pwm."""
+        self.command('CMD_SERVO', int(channel), int(angle))
+
+    def receive(self) -> bytes:
+        """Receive one reply."""
+        if not self.stream:
+            return self.sock.recv(65536)
+        while b'\n' not in self.pending:
+            data = self.sock.recv(65536)
+            if not data:
+                return b''
+            self.pending += data
+        line, _, self.pending = self.pending.partition(b'\n')
+        return line
+
+    def request(self, line: str) -> str:
+        """Send a text request tagged with a new id and return the reply to it, without the tag."""
+        self.request_id += 1
+        tag = "@{}#".format(self.request_id).encode('utf-8')
+        self.sock.send(tag_text(self.request_id, line).encode('utf-8'))
+        while True:
+            reply = self.receive()
+            if not reply:
+                raise ConnectionError("local control socket closed")
+            if reply.startswith(tag):
+                return reply[len(tag):].decode('utf-8').strip()  # Pushed telemetry and replies to other requests are skipped
+
+    def snapshot(self, max_age_ms: int = None) -> dict:
+        """Get the latest reading of every sensor as {command name: tuple of values}."""
+        line = 'CMD_SNAPSHOT\n' if max_age_ms is None else COMMANDS['CMD_SNAPSHOT'].encode_text(int(max_age_ms))
+        readings = {}
+        for field in self.request(line).split(TEXT_SEPARATOR)[1:]:
+            values = field.split(':')
+            readings[values[0]] = tuple(float(x) for x in values[1:])
+        return readings
+
+    def vision_ring(self, state: int = 1) -> str:
+        """
+        Have the server feed the camera's grayscale frames into a shared memory ring (state 1) or stop (state 0).
+        The camera belongs to the server, so this is how a program on the car gets its frames; attach with
+        SharedFrameRing(name, track=False) or VisionProcess(name, ...).
+        Returns:
+        str: The ring name, or None if the server feeds none.
+        """
+        name = self.request(COMMANDS['CMD_VISION'].encode_text(state)).partition(TEXT_SEPARATOR)[2]
+        return name or None
+
+    def close(self) -> None:
+        """Stop the car and close the socket."""
+        try:
+            self.set_motor_model(0, 0, 0, 0)
+        except OSError:
+            pass
+        self.sock.close()
+
+if __name__ == '__main__':
+    # Round trip of a sensor snapshot and rate of motor setpoints: local socket against the Wi-Fi path's TCP
+    # command port, both on this machine, so the difference is the transport and the queue hops alone.
+    from dispatcher import PriorityDispatcher
+    from tcp_server import TCPServer
+    from telemetry import TelemetryHub
+    from stats import LatencyHistogram
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    ROUNDS = 5000
+    hub = TelemetryHub(lambda address, frame: None)
+    hub.add_channel('CMD_SONIC', lambda: 23.5, 0.05)
+    hub.add_channel('CMD_LIGHT', lambda: (1.21, 1.37), 0.02)
+    hub.add_channel('CMD_POWER', lambda: 7.8, 0.5)
+    applied = []
+    dispatcher = PriorityDispatcher()
+    def dispatch():
+        while True:
+            item = dispatcher.get()
+            if item is None:
+                return
+            applied.append(item[1])
+    threading.Thread(target=dispatch, daemon=True).start()
+
+    path = '/tmp/freenove_car_test.sock'
+    local = LocalControlServer(dispatcher.put_command, hub.snapshot, path)  # Create an instance of the LocalControlServer class
+    local.start()
+    car = LocalCar(path)
+    print(car.snapshot())
+    latency = LatencyHistogram()
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        car.snapshot()
+        latency.record(time.perf_counter() - start)
+    local_snapshot = latency.get_stats()
+    # Setpoint rate counts commands the server has parsed, not bytes left in a socket buffer
+    start = time.perf_counter()
+    received = local.received
+    for i in range(ROUNDS):
+        car.set_motor_model(i % 4000, 0, 0, 0)
+    while local.received < received + ROUNDS:
+        time.sleep(0.0001)
+    local_rate = ROUNDS / (time.perf_counter() - start)
+
+    # The same snapshot through the TCP command port: selector thread, message queue, dispatcher, reply queue
+    tcp = TCPServer(framer=CommandFramer(), max_frame_size=4096)
+    tcp.start('127.0.0.1', 0)
+    tcp_received = [0]
+    def tcp_serve():
+        while True:
+            address, frame = tcp.message_queue.get()
+            command = parse_command(frame)
+            tcp_received[0] += 1
+            if command.command == 'CMD_SNAPSHOT':
+                tcp.send_to_client(address, tag_text(command.request_id, hub.snapshot()).encode('utf-8'))
+            else:
+                dispatcher.put_command(address, command)
+    threading.Thread(target=tcp_serve, daemon=True).start()
+    client = socket.create_connection(tcp.server_socket.getsockname())
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    reader = client.makefile('rb')
+    latency = LatencyHistogram()
+    for i in range(ROUNDS):
+        start = time.perf_counter()
+        client.sendall(tag_text(i, 'CMD_SNAPSHOT\n').encode('utf-8'))
+        reader.readline()
+        latency.record(time.perf_counter() - start)
+    tcp_snapshot = latency.get_stats()
+    frame = COMMANDS['CMD_MOTOR'].encode_binary(1000, 0, 0, 0)
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        client.sendall(frame)
+    while tcp_received[0] < 2 * ROUNDS:
+        time.sleep(0.0001)
+    tcp_rate = ROUNDS / (time.perf_counter() - start)
+    client.close()
+    tcp.close()
+    car.close()
+    local.stop()
+    dispatcher.close()
+    print("{} socket: snapshot p50 {:.3f} ms  p99 {:.3f} ms, setpoints {:.0f}/s".format(
+        "SEQPACKET" if local.sock_type != socket.SOCK_STREAM else "STREAM", local_snapshot['p50_ms'], local_snapshot['p99_ms'], local_rate))
+    print("TCP loopback:     snapshot p50 {:.3f} ms  p99 {:.3f} ms, setpoints {:.0f}/s".format(tcp_snapshot['p50_ms'], tcp_snapshot['p99_ms'], tcp_rate))
@@ -1,5 +1,4 @@
 import sys
-import struct
 import time
 import signal
 import math
@@ -7,22 +6,39 @@ from PyQt5.QtWidgets import QMainWindow, QApplication
 from PyQt5.QtCore import QTimer
 from server_ui import Ui_server_ui
 from server import Server
+from async_server import AsyncServer
 import threading
 import multiprocessing
-from message import Message_Parse
+import queue
+from dispatcher import PriorityDispatcher
+from registry import CommandRegistry
+from telemetry import TelemetryHub
+from udp_control import UdpControlServer
+from local_control import LocalControlServer, is_local_address
+from link_monitor import LinkMonitor, now_us
+from watchdog import Watchdog
+from video_timing import VideoTiming
+from vision_process import VisionFeed
 from command import Command
+from command_schema import COMMANDS, ACK_DROPPED, WATCHDOG_VERSION, WATCHDOG_TIMEOUT, HEARTBEAT_INTERVAL, HEARTBEAT_MS, VIDEO_TIMING_VERSION, tag_text
+from message import parse_command
 from led import Led
-from camera import Camera
+from parameter import ParameterManager
+from camera import open_camera
 from car import Car
 from buzzer import Buzzer
 from Thread import stop_thread
 from threading import Thread
 
+DEADMAN_ADDRESS = ('deadman', 0)  # Sender of the stop the watchdog queues; its handler never replies
+
 class mywindow(QMainWindow, Ui_server_ui):
-    def __init__(self):
+    def __init__(self, use_asyncio=False):
         self.app = QApplication(sys.argv)
         super(mywindow, self).__init__()
         self.setupUi(self)
+        # Serve both ports from one asyncio event loop instead of a selector thread per port
+        self.server_class = AsyncServer if use_asyncio else Server
         self.ui_button_state = True
         self.config_task()
         self.Button_Server.clicked.connect(self.on_pushButton_handle)
@@ -37,18 +53,55 @@ class mywindow(QMainWindow, Ui_server_ui):
         self.time_record = time.time()
 
     def config_task(self):
-        self.tcp_server = Server()
+        self.tcp_server = self.server_class()
         self.command = Command()
         self.led = Led()
         self.car = Car()
         self.buzzer = Buzzer()
-        self.camera = Camera(stream_size=(400, 300))
-        self.queue_cmd = multiprocessing.Queue()
-        self.cmd_parse = Message_Parse()
+        self.camera = open_camera(stream_size=(400, 300))  # Picamera2 on the car; FREENOVE_CAMERA selects an OpenCV or replay source
+        self.video_timing = VideoTiming()  # Per-stage latency of each frame from capture to the viewer's socket
+        # Grayscale frames for vision programs on the car, which cannot open the camera while the server holds it
+        self.vision_feed = VisionFeed(self.camera)
+        self.vision_clients = set()  # Local clients the feed runs for
+        self.camera_lock = threading.Lock()  # The video thread and the vision feed start and stop the same stream
+        self.cmd_dispatcher = PriorityDispatcher(on_drop=self.acknowledge_dropped)
+        self.request_context = threading.local()  # Request id of the tagged command being handled on this thread
         self.queue_led = multiprocessing.Queue()
-        self.led_parse = Message_Parse()
+        self.cmd_registry = CommandRegistry()
+        self.led_registry = CommandRegistry()
+        self.telemetry = TelemetryHub(lambda address, frame: self.send_to_client(address, frame, self.command.CMD_TELEMETRY),
+                                      lambda: self.get_command_client_addresses())
+        self.telemetry.add_channel(self.command.CMD_SONIC, lambda: self.car.sonic.get_distance(), 0.05)
+        self.telemetry.add_channel(self.command.CMD_LIGHT, lambda: (self.car.adc.read_adc(0), self.car.adc.read_adc(1)), 0.02)
+        self.telemetry.add_channel(self.command.CMD_LINE, lambda: tuple(self.car.infrared.read_one_infrared(i) for i in (1, 2, 3)), 0.02)
+        self.telemetry.add_channel(self.command.CMD_POWER, lambda: self.car.adc.read_adc(2) * (3 if self.car.adc.pcb_version == 1 else 2), 0.5)
+        # Round trip time, jitter and clock offset of each client, from the CMD_PING exchanges
+        self.link_monitor = LinkMonitor(lambda address, text: self.send_to_client(address, text),
+                                        lambda: self.get_command_client_addresses())
+        # Deadman switch: once a client sends heartbeats (pings), silence longer than the timeout stops the car
+        # Clients are told the heartbeat interval in the CMD_PROTOCOL reply, so a short one buys a short timeout
+        parameters = ParameterManager()
+        heartbeat_ms = round(parameters.get_heartbeat_interval(HEARTBEAT_INTERVAL) * 1000)
+        self.heartbeat_ms = max(HEARTBEAT_MS[0], min(HEARTBEAT_MS[1], heartbeat_ms))
+        watchdog_timeout = max(3 * self.heartbeat_ms / 1000.0, parameters.get_watchdog_timeout(WATCHDOG_TIMEOUT))
+        self.watchdog = Watchdog(watchdog_timeout, self.deadman_stop)
+        # The deadman stop is queued like a client's stop, so only the dispatch thread ever drives the motors
+        self.deadman_command = parse_command(self.command.CMD_MODE + "#0\n")
+        self.heartbeat_clients = set()  # Clients that agreed to send heartbeats
+        # Optional datagram port for motor and servo setpoints, only for hosts connected to the command port
+        self.udp_control = UdpControlServer(lambda address, command: self.deliver_udp_command(address, command),
+                                            lambda: self.tcp_server.get_command_server_client_ips(),
+                                            to_local=self.link_monitor.to_local)
+        # Unix socket for programs on the car itself (vision scripts, autonomy loops); same commands, no network stack
+        self.local_control = LocalControlServer(lambda address, command: self.deliver_local_command(address, command),
+                                                lambda max_age: self.telemetry.snapshot(max_age),
+                                                on_disconnect=self.on_local_client_disconnect,
+                                                vision=self.local_vision)
+        self.local_drivers = set()  # Local clients that sent motion commands, and so stop the car when they close
+        self.register_handlers()
 
         self.cmd_thread = None
+        self.dispatch_thread = None
         self.video_thread = None
         self.car_thread = None
         self.led_process = None
@@ -60,13 +113,15 @@ class mywindow(QMainWindow, Ui_server_ui):
         self.action_process_is_running = False
         self.car_mode = 1
         self.rotation_flag = False
+        self.Rotate_Mode = None
         self.send_sonic_data_time = time.time()
         self.send_light_data_time = time.time()
-        self.send_line_data_time = time.time()
         self.led_mode = 0
+        self.led_animation_step = 0.005
 
     def stop_car(self):
         self.led.colorBlink(0)
+        self.vision_feed.stop()
         self.camera.stop_stream()
         self.camera.close()
         self.car.close()
@@ -75,6 +130,7 @@ class mywindow(QMainWindow, Ui_server_ui):
         if self.label.text() == "Server Off":
             self.label.setText("Server On")
             self.Button_Server.setText("Off")
+            self.tcp_server.set_command_disconnect_handler(self.on_command_client_disconnect)
             self.tcp_server.start_tcp_servers()
             self.set_threading_cmd_receive(True)
             self.set_threading_video_send(True)
@@ -88,42 +144,87 @@ class mywindow(QMainWindow, Ui_server_ui):
             self.set_threading_video_send(False)
             self.set_threading_car_task(False)
             self.set_process_led_running(False)
-            self.tcp_server = Server()
-
-    def send_sonic_data(self):
-        if time.time() - self.send_sonic_data_time > 0.5:
-            self.send_sonic_data_time = time.time()
-            if self.tcp_server.get_command_server_busy() == False:
-                distance = self.car.sonic.get_distance()
-                cmd = self.command.CMD_MODE + "#3#{:.2f}".format(distance) + "\n"
-                self.tcp_server.send_data_to_command_client(cmd)
-                #print(cmd)
-
-    def send_light_data(self):
-        if time.time() - self.send_light_data_time > 0.3:
-            self.send_light_data_time = time.time()
-            if self.tcp_server.get_command_server_busy() == False:
-                adc_light_1 = self.car.adc.read_adc(0)
-                adc_light_2 = self.car.adc.read_adc(1)
-                cmd = self.command.CMD_MODE + "#2#{:.2f}#{:.2f}".format(adc_light_1, adc_light_2) + "\n" 
-                self.tcp_server.send_data_to_command_client(cmd)
-                #print(cmd)
-    def send_line_data(self):
-        if time.time() - self.send_line_data_time > 0.3:
-            self.send_line_data_time = time.time()
-            if self.tcp_server.get_command_server_busy() == False:
-                ir_value_1 = self.car.infrared.read_one_infrared(1)
-                ir_value_2 = self.car.infrared.read_one_infrared(2)
-                ir_value_3 = self.car.infrared.read_one_infrared(3)
-                cmd = self.command.CMD_MODE + "#4#{:.2f}#{:.2f}#{:.2f}".format(ir_value_1, ir_value_2, ir_value_3) + "\n"
-                self.tcp_server.send_data_to_command_client(cmd)
-                #print(cmd)
-    def send_power_data(self):
-        if self.tcp_server.get_command_server_busy() == False:
-            power = self.car.adc.read_adc(2) * (3 if self.car.adc.pcb_version == 1 else 2)
-            cmd = self.command.CMD_POWER + "#" + str(power) + "\n"
-            self.tcp_server.send_data_to_command_client(cmd)
-            #print(cmd)
+            self.tcp_server = self.server_class()
+
+    def send_sonic_data(self, client_address=None):
+        distance = self.telemetry.read(self.command.CMD_SONIC)
+        cmd = self.command.CMD_MODE + "#3#{:.2f}".format(distance) + "\n"
+        self.send_reply(client_address, cmd, self.command.CMD_SONIC)
+
+    def send_light_data(self, client_address=None):
+        adc_light_1, adc_light_2 = self.telemetry.read(self.command.CMD_LIGHT)
+        cmd = self.command.CMD_MODE + "#2#{:.2f}#{:.2f}".format(adc_light_1, adc_light_2) + "\n"
+        self.send_reply(client_address, cmd, self.command.CMD_LIGHT)
+
+    def send_line_data(self, client_address=None):
+        ir_value_1, ir_value_2, ir_value_3 = self.telemetry.read(self.command.CMD_LINE)
+        cmd = self.command.CMD_MODE + "#4#{:.2f}#{:.2f}#{:.2f}".format(ir_value_1, ir_value_2, ir_value_3) + "\n"
+        self.send_reply(client_address, cmd, self.command.CMD_LINE)
+
+    def send_power_data(self, client_address=None):
+        power = self.telemetry.read(self.command.CMD_POWER)
+        cmd = self.command.CMD_POWER + "#" + str(power) + "\n"
+        self.send_reply(client_address, cmd)
+
+    def send_reply(self, client_address, cmd, key=None, to_all=True):
+        # The reply to a tagged request goes to the requester only, with the request id in front
+        request_id = getattr(self.request_context, 'request_id', None)
+        if request_id is not None:
+            self.send_to_client(client_address, tag_text(request_id, cmd))
+        elif is_local_address(client_address):
+            self.local_control.send(client_address, cmd)  # Local programs ask for themselves; remote apps keep their broadcast
+        elif key is not None:
+            self.tcp_server.send_telemetry_to_command_client(key, cmd)
+        else:
+            self.tcp_server.send_data_to_command_client(cmd, None if to_all else client_address)
+
+    def send_ack(self, client_address, request_id, status, service_time=0.0, queue_time=0.0):
+        cmd = COMMANDS[self.command.CMD_ACK].encode_text(request_id, status, int(service_time * 1000000), int(queue_time * 1000000))
+        self.send_to_client(client_address, cmd)
+
+    def send_to_client(self, client_address, data, key=None):
+        if is_local_address(client_address):
+            self.local_control.send(client_address, data)
+        elif key is not None:
+            self.tcp_server.send_telemetry_to_command_client(key, data, client_address)
+        else:
+            self.tcp_server.send_data_to_command_client(data, client_address)
+
+    def get_command_client_addresses(self):
+        return self.tcp_server.get_command_server_client_addresses() + self.local_control.get_client_addresses()
+
+    def acknowledge_dropped(self, client_address, command):
+        # A tagged setpoint superseded in the queue never runs; say so rather than leave the client waiting
+        if command.request_id is not None:
+            self.send_ack(client_address, command.request_id, ACK_DROPPED)
+
+    def subscribe_telemetry(self, client_address, args):
+        # Readings come from the telemetry cache, so subscribers and requests share hardware reads
+        name = self.command.COMMAND_NAME.get(args[0])
+        if name is not None:
+            self.telemetry.subscribe(client_address, name, args[1] / 1000.0)
+
+    def send_snapshot(self, client_address, args):
+        # Every sensor in one reply; local clients are answered by LocalControlServer without the queue
+        cmd = self.telemetry.snapshot(args[0] / 1000.0 if len(args) > 0 else None)
+        self.send_reply(client_address, cmd, to_all=False)
+
+    def send_protocol_version(self, client_address, args):
+        # Agree on the highest binary protocol version both sides support; old clients never ask and keep text
+        requested = args[0] if len(args) > 0 else 0
+        version = min(requested, self.command.PROTOCOL_VERSION)
+        if version >= WATCHDOG_VERSION:
+            self.heartbeat_clients.add(client_address)
+        else:
+            self.heartbeat_clients.discard(client_address)
+        if not is_local_address(client_address):
+            # Video viewers on this host get the timed frame header from the next frame on
+            self.video_timing.set_timed(client_address[0], version >= VIDEO_TIMING_VERSION)
+        if version >= WATCHDOG_VERSION:
+            cmd = COMMANDS[self.command.CMD_PROTOCOL].encode_text(version, self.heartbeat_ms)  # And how often to ping
+        else:
+            cmd = self.command.CMD_PROTOCOL + "#" + str(version) + "\n"
+        self.send_reply(client_address, cmd, to_all=False)
 
     def set_threading_cmd_receive(self, state, close_time=0.3):
         if self.cmd_thread is None:
@@ -133,127 +234,225 @@ class mywindow(QMainWindow, Ui_server_ui):
         if state != buf_state:
             if state:
                 self.cmd_thread_is_running = True
+                self.cmd_dispatcher = PriorityDispatcher(on_drop=self.acknowledge_dropped)
                 self.cmd_thread = threading.Thread(target=self.threading_cmd_receive)
                 self.cmd_thread.start()
+                self.dispatch_thread = threading.Thread(target=self.threading_cmd_dispatch)
+                self.dispatch_thread.start()
+                self.telemetry.start()
+                self.udp_control.start(self.tcp_server.ip_address)
+                self.local_control.start()
+                self.watchdog.start()
             else:
                 self.cmd_thread_is_running = False
+                self.cmd_dispatcher.close()
+                self.telemetry.stop()
+                self.udp_control.stop()
+                self.local_control.stop()
+                self.watchdog.stop()
                 if self.cmd_thread is not None:
                     self.cmd_thread.join(close_time)
                     self.cmd_thread = None
+                if self.dispatch_thread is not None:
+                    self.dispatch_thread.join(close_time)
+                    self.dispatch_thread = None
 
     def threading_cmd_receive(self):
         while self.cmd_thread_is_running:
-            cmd_queue = self.tcp_server.read_data_from_command_server()
-            if cmd_queue.qsize() > 0:
-                client_address, all_message = cmd_queue.get()
-                main_message = all_message.strip()
-                if "\n" in main_message:
-                    for msg in main_message.split("\n"):
-                        self.queue_cmd.put(msg)
-                else:
-                    self.queue_cmd.put(main_message)
-            while not self.queue_cmd.empty():
-                msg = self.queue_cmd.get()
-                self.cmd_parse.clear_parameters()
-                self.cmd_parse.parse(msg)
-                print("{}".format(self.cmd_parse.input_string))
-                if self.cmd_parse.command_string == self.command.CMD_LED:
-                    self.queue_led.put(msg)
-                elif self.cmd_parse.command_string == self.command.CMD_LED_MOD:
-                    self.queue_led.put(msg)
-                else:
-                    if self.cmd_parse.command_string == self.command.CMD_SONIC:
-                        self.send_sonic_data()
-                    elif self.cmd_parse.command_string == self.command.CMD_LIGHT:
-                        self.send_light_data()
-                    elif self.cmd_parse.command_string == self.command.CMD_LINE:
-                        self.send_line_data()
-                    elif self.cmd_parse.command_string == self.command.CMD_POWER:
-                        self.send_power_data()
-                    elif self.cmd_parse.command_string == self.command.CMD_BUZZER:
-                        self.buzzer.set_state(self.cmd_parse.int_parameter[0])
-                    elif self.cmd_parse.command_string == self.command.CMD_SERVO:
-                        try:
-                            print(len(self.cmd_parse.int_parameter))
-                            data1 = str(self.cmd_parse.int_parameter[0])
-                            data2 = int(self.cmd_parse.int_parameter[1])
-                            print(data1, data2)
-                            if data1 == None or data2 == None:
-                                continue
-                            self.car.servo.set_servo_pwm(data1, data2)
-                        except Exception as e:
-                            print(e)
-                    elif self.cmd_parse.command_string == self.command.CMD_MOTOR:
-                        self.car_mode = 1
-                        try:
-                            duty = [int(self.cmd_parse.int_parameter[i]) for i in range(4)]
-                            if duty[0] == None or duty[1]== None or duty[2] == None or duty[3] == None:
-                                continue
-                            self.car.motor.set_motor_model(duty[0], duty[1], duty[2], duty[3])
-                        except:
-                            pass
-                    elif self.cmd_parse.command_string == self.command.CMD_M_MOTOR:
-                        self.car_mode = 1
-                        duty = [int(self.cmd_parse.int_parameter[i]) for i in range(4)]
-                        LX = -int((duty[1] * math.sin(math.radians(duty[0]))))
-                        LY = int(duty[1] * math.cos(math.radians(duty[0])))
-                        RX = int(duty[3] * math.sin(math.radians(duty[2])))
-                        RY = int(duty[3] * math.cos(math.radians(duty[2])))
-                        FR = LY - LX + RX
-                        FL = LY + LX - RX
-                        BL = LY - LX - RX
-                        BR = LY + LX + RX
-                        if duty[0] == None or duty[1]== None or duty[2] == None or duty[3] == None:
-                            continue
-                        self.car.motor.set_motor_model(FL, BL, FR, BR)
-                    elif self.cmd_parse.command_string == self.command.CMD_CAR_ROTATE:
-                        try:
-                            self.car_mode = 1
-                            duty = [int(self.cmd_parse.int_parameter[i]) for i in range(4)]
-                            if duty[3] == 0:
-                                try:
-                                    stop_thread(Rotate_Mode)
-                                    self.rotation_flag = False
-                                except:
-                                    pass
-                                LX = -int((duty[1] * math.sin(math.radians(duty[0]))))
-                                LY = int(duty[1] * math.cos(math.radians(duty[0])))
-                                RX = int(duty[3] * math.sin(math.radians(duty[2])))
-                                RY = int(duty[3] * math.cos(math.radians(duty[2])))
-                                FR = LY - LX + RX
-                                FL = LY + LX - RX
-                                BL = LY - LX - RX
-                                BR = LY + LX + RX
-                                if duty[0] == None or duty[1]== None or duty[2] == None:
-                                    continue
-                                self.car.motor.set_motor_model(FL, BL, FR, BR)
-                            elif self.rotation_flag == False:
-                                try:
-                                    stop_thread(self.Rotate_Mode)
-                                except:
-                                    pass
-                                self.rotation_flag = True
-                                Rotate_Mode = Thread(target=self.car.mode_rotate, args=(duty[2],))
-                                Rotate_Mode.start()
-                        except Exception as e:
-                            print(e)
-                    elif self.cmd_parse.command_string == self.command.CMD_MODE:
-                        if self.cmd_parse.int_parameter[0] == 0:
-                            self.car_mode = 1
-                            self.car.motor.set_motor_model(0, 0, 0, 0)
-                            print("Car Mode: Manual Car")
-                        elif self.cmd_parse.int_parameter[0] == 1:
-                            self.car_mode = 2
-                            print("Car Mode: Light Car")
-                        elif self.cmd_parse.int_parameter[0] == 2:
-                            self.car_mode = 3
-                            print("Car Mode: Infrared Car")
-                        elif self.cmd_parse.int_parameter[0] == 3:
-                            self.car_mode = 4
-                            print("Car Mode: Ultrasonic Car")
-                    
-            if self.queue_cmd.empty():
-                time.sleep(0.001)
+            try:
+                client_address, msg = self.tcp_server.read_data_from_command_server().get(timeout=0.1)
+            except queue.Empty:
+                continue
+            received_us = now_us()
+            command = parse_command(msg)
+            if command is None:
+                self.cmd_dispatcher.invalid += 1
+                continue
+            self.watchdog.feed(client_address)  # Any valid command shows this client is alive
+            if command.command == self.command.CMD_PING:
+                # Answered here so the round trip time measures the link, not the dispatch queue
+                self.link_monitor.handle_ping(client_address, command.args, received_us)
+                if client_address in self.heartbeat_clients and not self.watchdog.is_armed(client_address):
+                    self.watchdog.arm(client_address)
+            else:
+                # The dispatcher drops superseded setpoints and serves stop and motor commands before LED and telemetry work
+                self.cmd_dispatcher.put_command(client_address, command)
+
+    def deliver_udp_command(self, client_address, command):
+        # No feed: datagrams say nothing about the command connection the heartbeats arrive on
+        self.cmd_dispatcher.put_command(client_address, command)
+
+    def deliver_local_command(self, client_address, command):
+        self.watchdog.feed(client_address)
+        if self.cmd_dispatcher.classify(command) in ('motion', 'stop'):
+            self.local_drivers.add(client_address)
+        self.cmd_dispatcher.put_command(client_address, command)
+
+    def local_vision(self, client_address, state):
+        # Feed the camera's grayscale frames to a local program through a shared memory ring it maps by name
+        with self.camera_lock:
+            if state:
+                self.vision_clients.add(client_address)
+                self.camera.start_stream()
+                self.vision_feed.start()
+            else:
+                self.vision_clients.discard(client_address)
+                if not self.vision_clients:
+                    self.vision_feed.stop()
+                    self.release_camera_stream()
+            return self.vision_feed.name if state else None
+
+    def release_camera_stream(self):
+        # The stream stops once neither a video viewer nor a local vision program needs it (camera_lock held)
+        if not self.vision_clients and not (self.tcp_server and self.tcp_server.is_video_server_connected()):
+            self.camera.stop_stream()
+
+    def on_local_client_disconnect(self, client_address):
+        if client_address in self.vision_clients:
+            self.local_vision(client_address, 0)
+        # Only a local program that was driving stops the car; snapshot readers and one-shot scripts come and go freely
+        if client_address in self.local_drivers:
+            self.local_drivers.discard(client_address)
+            self.on_command_client_disconnect(client_address)
+        else:
+            self.heartbeat_clients.discard(client_address)
+            self.link_monitor.forget(client_address)
+            self.telemetry.unsubscribe(client_address)
+
+    def on_command_client_disconnect(self, client_address):
+        # A closed or dead command connection stops the car at once, whatever the client supports
+        self.heartbeat_clients.discard(client_address)
+        self.deadman_stop()
+        self.link_monitor.forget(client_address)
+        self.telemetry.unsubscribe(client_address)
+        self.udp_control.forget(client_address[0])
+        if not is_local_address(client_address):
+            self.video_timing.set_timed(client_address[0], False)
+
+    def deadman_stop(self, silence=None):
+        # Control link lost: stop the wheels and any autonomous mode until the client commands again.
+        # Manual mode 0 is in the stop class, so it drops queued motion and runs next on the dispatch thread.
+        self.watchdog.disarm_all()  # Re-armed by each client's next ping
+        self.cmd_dispatcher.put_command(DEADMAN_ADDRESS, self.deadman_command)
+        if silence is not None:
+            print("Watchdog: no command for {:.0f} ms, motors stopped".format(silence * 1000))
+
+    def threading_cmd_dispatch(self):
+        while self.cmd_thread_is_running:
+            item = self.cmd_dispatcher.get()
+            if item is None:
+                break
+            client_address, command, class_name, enqueued_at = item
+            self.handle_command(client_address, command, enqueued_at)
+            self.cmd_dispatcher.done(class_name, enqueued_at)
+
+    def handle_command(self, client_address, command, enqueued_at=None):
+        if command.request_id is None:
+            self.cmd_registry.dispatch(command.command, command.args, client_address)
+            return
+        # Tagged request: replies carry its id, then a CMD_ACK reports the outcome, handler time and time queued
+        queue_time = 0.0 if enqueued_at is None else time.monotonic() - enqueued_at
+        self.request_context.request_id = command.request_id
+        try:
+            status, service_time = self.cmd_registry.dispatch_status(command.command, command.args, client_address)
+        finally:
+            self.request_context.request_id = None
+        self.send_ack(client_address, command.request_id, status, service_time, queue_time)
+
+    def register_handlers(self):
+        # Command port handlers, run on the dispatch thread; LED commands are forwarded to the LED process
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_PROTOCOL], self.send_protocol_version)
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_SONIC], lambda client_address, args: self.send_sonic_data(client_address))
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_LIGHT], lambda client_address, args: self.send_light_data(client_address))
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_LINE], lambda client_address, args: self.send_line_data(client_address))
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_POWER], lambda client_address, args: self.send_power_data(client_address))
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_BUZZER], self.handle_buzzer)
+        # Angles outside the schema range are clamped by handle_servo rather than rejected: the client's fine-tune
+        # sliders add up to +-10 degrees to a slider that already reaches 0 and 180
+        servo = COMMANDS[self.command.CMD_SERVO]
+        self.cmd_registry.register(servo.name, self.handle_servo, min_args=servo.min_args, max_args=servo.arg_count,
+                                   validate=lambda args: servo.ranges[0][0] <= args[0] <= servo.ranges[0][1])
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_MOTOR], self.handle_motor)
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_M_MOTOR], self.handle_m_motor)
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_CAR_ROTATE], self.handle_car_rotate)
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_MODE], self.handle_mode)
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_SUBSCRIBE], self.subscribe_telemetry)
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_SNAPSHOT], self.send_snapshot)
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_LED], lambda client_address, args: self.queue_led.put((self.command.CMD_LED, args)))
+        self.cmd_registry.register_command(COMMANDS[self.command.CMD_LED_MOD], lambda client_address, args: self.queue_led.put((self.command.CMD_LED_MOD, args)))
+        # LED process handlers
+        self.led_registry.register_command(COMMANDS[self.command.CMD_LED], self.handle_led)
+        self.led_registry.register_command(COMMANDS[self.command.CMD_LED_MOD], self.handle_led_mod)
+
+    def get_command_stats(self):
+        return {'dispatcher': self.cmd_dispatcher.get_stats(), 'handlers': self.cmd_registry.get_stats(), 'link': self.link_monitor.get_stats(), 'watchdog': self.watchdog.get_stats(), 'local': self.local_control.get_stats(), 'frames': self.camera.frame_bus.get_stats(), 'vision_feed': self.vision_feed.get_stats(), 'video_latency': self.video_timing.get_stats()}
+
+    def mecanum_duty(self, duty):
+        LX = -int((duty[1] * math.sin(math.radians(duty[0]))))
+        LY = int(duty[1] * math.cos(math.radians(duty[0])))
+        RX = int(duty[3] * math.sin(math.radians(duty[2])))
+        FR = LY - LX + RX
+        FL = LY + LX - RX
+        BL = LY - LX - RX
+        BR = LY + LX + RX
+        return FL, BL, FR, BR
+
+    def handle_buzzer(self, client_address, args):
+        self.buzzer.set_state(args[0])
+
+    def handle_servo(self, client_address, args):
+        low, high = COMMANDS[self.command.CMD_SERVO].ranges[1]
+        self.car.servo.set_servo_pwm(str(args[0]), max(low, min(high, int(args[1]))))
+
+    def handle_motor(self, client_address, args):
+        self.car_mode = 1
+        self.car.motor.set_motor_model(args[0], args[1], args[2], args[3])
+
+    def handle_m_motor(self, client_address, args):
+        self.car_mode = 1
+        self.car.motor.set_motor_model(*self.mecanum_duty(args))
+
+    def stop_rotation(self):
+        if self.Rotate_Mode is not None:
+            try:
+                stop_thread(self.Rotate_Mode)
+            except:
+                pass
+            self.Rotate_Mode = None
+        self.rotation_flag = False
+
+    def handle_car_rotate(self, client_address, args):
+        self.car_mode = 1
+        if args[3] == 0:
+            self.stop_rotation()
+            self.car.motor.set_motor_model(*self.mecanum_duty(args))
+        elif self.rotation_flag == False:
+            self.rotation_flag = True
+            self.Rotate_Mode = Thread(target=self.car.mode_rotate, args=(args[2],))
+            self.Rotate_Mode.start()
+
+    def handle_mode(self, client_address, args):
+        if args[0] == 0:
+            self.car_mode = 1
+            self.stop_rotation()
+            self.car.motor.set_motor_model(0, 0, 0, 0)
+            print("Car Mode: Manual Car")
+        elif args[0] == 1:
+            self.car_mode = 2
+            print("Car Mode: Light Car")
+        elif args[0] == 2:
+            self.car_mode = 3
+            print("Car Mode: Infrared Car")
+        elif args[0] == 3:
+            self.car_mode = 4
+            print("Car Mode: Ultrasonic Car")
+
+    def handle_led(self, client_address, args):
+        if self.led_mode == 1:
+            self.led.ledIndex(args[0], args[1], args[2], args[3])
+
+    def handle_led_mod(self, client_address, args):
+        self.led_mode = args[0] if 1 <= args[0] <= 5 else 0
 
     def set_threading_car_task(self, state, close_time=0.3):
         if self.car_thread is None:
@@ -277,12 +476,16 @@ class mywindow(QMainWindow, Ui_server_ui):
                 pass
             elif self.car_mode == 2:
                 self.car.mode_light()
-                self.send_light_data()
+                if time.time() - self.send_light_data_time > 0.3:
+                    self.send_light_data_time = time.time()
+                    self.send_light_data()
             elif self.car_mode == 3:
                 self.car.mode_infrared()
             elif self.car_mode == 4:
                 self.car.mode_ultrasonic()
-                self.send_sonic_data()
+                if time.time() - self.send_sonic_data_time > 0.5:
+                    self.send_sonic_data_time = time.time()
+                    self.send_sonic_data()
             time.sleep(0.01)
 
 
@@ -305,17 +508,20 @@ class mywindow(QMainWindow, Ui_server_ui):
     def threading_video_send(self):
         while self.video_thread_is_running:
             if self.tcp_server.is_video_server_connected():
-                self.camera.start_stream()
+                with self.camera_lock:
+                    self.camera.start_stream()
+                video = self.camera.get_consumer('video')  # Newest frame each time; vision reads the same bus at its own pace
                 while self.tcp_server.is_video_server_connected():
-                    frame = self.camera.get_frame()
-                    lenFrame = len(frame)
-                    lengthBin = struct.pack('<I', lenFrame)
+                    frame = video.newest(timeout=1.0)
+                    if frame is None:
+                        continue
                     try:
-                        self.tcp_server.send_data_to_video_client(lengthBin)
-                        self.tcp_server.send_data_to_video_client(frame)
+                        # Every viewer gets its own bounded queue, so a slow one never holds back the others
+                        self.tcp_server.broadcast_video_frame(frame.data, self.video_timing.frame(frame))
                     except:
                         break
-                self.camera.stop_stream()
+                with self.camera_lock:
+                    self.release_camera_stream()
             else:
                 time.sleep(0.1)
 
@@ -342,36 +548,6 @@ class mywindow(QMainWindow, Ui_server_ui):
     def process_led_running(self, queue_led):
         try:
             while self.led_process_is_running:
-                if not queue_led.empty():
-                    queue_buf_cmd = queue_led.get()
-                    self.led_parse.clear_parameters()
-                    self.led_parse.parse(queue_buf_cmd)
-                    print("LED: {}".format(queue_buf_cmd))
-
-                    if self.led_parse.command_string == "CMD_LED" and self.led_mode == 1:
-                        try:
-                            data1 = int(self.led_parse.int_parameter[0])
-                            data2 = int(self.led_parse.int_parameter[1])
-                            data3 = int(self.led_parse.int_parameter[2])
-                            data4 = int(self.led_parse.int_parameter[3])
-                            if data1==None or data2==None or data3==None or data4==None:
-                                continue
-                            self.led.ledIndex(data1,data2,data3,data4)
-                        except:
-                            pass
-                    if self.led_parse.command_string == "CMD_LED_MOD":
-                        if self.led_parse.int_parameter[0] == 1:
-                            self.led_mode = 1
-                        elif self.led_parse.int_parameter[0] == 2:
-                            self.led_mode = 2
-                        elif self.led_parse.int_parameter[0] == 3:
-                            self.led_mode = 3
-                        elif self.led_parse.int_parameter[0] == 4:
-                            self.led_mode = 4
-                        elif self.led_parse.int_parameter[0] == 5:
-                            self.led_mode = 5
-                        else:
-                            self.led_mode = 0
                 if self.led_mode == 1:
                     pass
                 elif self.led_mode == 2:
@@ -384,7 +560,12 @@ class mywindow(QMainWindow, Ui_server_ui):
                     self.led.rainbowCycle()
                 elif self.led_mode == 0:
                     self.led.colorBlink(0)
-                        
+                # Static modes only change on a command, so block for one; animations wake up for their next step
+                try:
+                    command_string, args = queue_led.get(timeout=None if self.led_mode in (0, 1) else self.led_animation_step)
+                except queue.Empty:
+                    continue
+                self.led_registry.dispatch(command_string, args)
 
         except KeyboardInterrupt:
             print("LED process interrupted, cleaning up...")
@@ -402,6 +583,8 @@ class mywindow(QMainWindow, Ui_server_ui):
         self.stop_car()
         if self.cmd_thread and self.cmd_thread.is_alive():
             self.cmd_thread.join(0.1)
+        if self.dispatch_thread and self.dispatch_thread.is_alive():
+            self.dispatch_thread.join(0.1)
         if self.video_thread and self.video_thread.is_alive():
             self.video_thread.join(0.1)
         if self.car_thread and self.car_thread.is_alive():
@@ -423,6 +606,6 @@ class mywindow(QMainWindow, Ui_server_ui):
             self.app.quit()
 
 if __name__ == '__main__':
-    myshow = mywindow()
+    myshow = mywindow(use_asyncio='--asyncio' in sys.argv)
     myshow.show()
     sys.exit(myshow.app.exec_())
\ No newline at end of file
@@ -1,4 +1,184 @@
+import operator
 import queue
+import sys
+import time
+from command import Command
+
+# The binary frame layout and the per command codecs come from the shared schema
+from command_schema import BINARY_MAGIC, BINARY_HEADER, BINARY_ARG_SIZES, binary_arg_struct, COMMANDS, COMMANDS_BY_ID
+from command_schema import TEXT_TAG, BINARY_TAG_MAGIC, BINARY_TAG
+
+def encode_binary(command_id: int, args: list) -> bytes:
+    """Encode a command as a binary frame, using the narrowest argument format they all fit."""
+    if all(-32768 <= x <= 32767 for x in args):
+        arg_format = 0
+    elif all(-2147483648 <= x <= 2147483647 for x in args):
+        arg_format = 1
+    else:
+        arg_format = 2
+    header = BINARY_HEADER.pack(BINARY_MAGIC, command_id, arg_format, len(args))
+    return header + binary_arg_struct(arg_format, len(args)).pack(*args)
+
+# Words some clients send instead of numbers, as the legacy parser maps them
+WORD_ARGS = {b'one': 0, b'two': 1, b'three': 3, b'four': 2}
+# Command names already decoded, keyed by the raw name token
+_command_names = {}
+_COMMAND_NAME_CACHE_SIZE = 256
+# Parsed text frames keyed by the raw frame; ParsedCommand is immutable so repeated frames share one result
+_parsed_frames = {}
+_PARSED_FRAME_CACHE_SIZE = 1024
+_PARSED_FRAME_MAX_SIZE = 64
+
+class ParsedCommand(tuple):
+    # A tuple with no instance dict, so it is immutable and cheap to create
+    __slots__ = ()
+
+    def __new__(cls, command: str, args: tuple, request_id: int = None):
+        """Create a ParsedCommand, an immutable command name, its integer arguments and the optional request id."""
+        return tuple.__new__(cls, (command, args, request_id))
+
+    command = property(operator.itemgetter(0), doc="The command name")
+    args = property(operator.itemgetter(1), doc="The integer arguments")
+    request_id = property(operator.itemgetter(2), doc="The correlation id of a tagged request, or None")
+
+    def __repr__(self):
+        if self[2] is not None:
+            return "ParsedCommand({!r}, {!r}, {!r})".format(self[0], self[1], self[2])
+        return "ParsedCommand({!r}, {!r})".format(self[0], self[1])
+
+_BINARY_PREFIX = bytes([BINARY_MAGIC])
+_BINARY_TAG_PREFIX = bytes([BINARY_TAG_MAGIC])
+_TEXT_TAG_PREFIX = TEXT_TAG.encode('utf-8')
+_new_parsed = tuple.__new__  # Builds a ParsedCommand without going through __new__
+
+def command_name(token: bytes) -> str:
+    """Get the command name of a raw name token, decoding each distinct token once."""
+    name = _command_names.get(token)
+    if name is None:
+        name = sys.intern(token.strip().decode('utf-8', errors='replace'))
+        if len(_command_names) < _COMMAND_NAME_CACHE_SIZE:
+            _command_names[token] = name
+    return name
+
+def parse_arg(token: bytes) -> int:
+    """Convert one text argument to an int the way the legacy parser does."""
+    value = WORD_ARGS.get(token.strip())
+    if value is not None:
+        return value
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return round(float(token))
+    except ValueError:
+        return 0
+
+def parse_command(frame) -> ParsedCommand:
+    """
+    Parse one text or binary command frame; safe from any thread.
+    Text frames read and fill the module caches _parsed_frames and _command_names; each access is a single dict
+    operation, atomic under the GIL, so a race between threads costs at most a repeated parse.
+    Parameters:
+    frame (bytes or str): A frame as returned by CommandFramer.
+    Returns:
+    ParsedCommand: The command, or None if a binary frame or a request tag is malformed.
+    """
+    if isinstance(frame, str):
+        frame = frame.encode('utf-8')
+    elif not isinstance(frame, bytes):
+        frame = bytes(frame)
+    if frame[:1] == _BINARY_PREFIX:
+        try:
+            spec = COMMANDS_BY_ID[frame[1]]
+            return _new_parsed(ParsedCommand, (spec.name, spec.decode_binary(frame), None))
+        except Exception:
+            return None
+    parsed = _parsed_frames.get(frame)
+    if parsed is not None:
+        return parsed  # Joystick and polling traffic repeats the same frames over and over
+    if frame[:1] == _TEXT_TAG_PREFIX or frame[:1] == _BINARY_TAG_PREFIX:
+        return parse_tagged(frame)
+    tokens = frame.split(b'#')  # int() ignores surrounding whitespace, command_name() strips the name
+    name = command_name(tokens[0])
+    del tokens[0]
+    spec = COMMANDS.get(name)
+    if spec is not None:
+        args = spec.decode_text(tokens)
+    else:
+        try:
+            args = tuple(map(int, tokens))  # Fast path, nearly every command is plain integers
+        except ValueError:
+            args = tuple([parse_arg(x) for x in tokens if x.strip()])
+    parsed = _new_parsed(ParsedCommand, (name, args, None))
+    if len(frame) <= _PARSED_FRAME_MAX_SIZE:
+        if len(_parsed_frames) >= _PARSED_FRAME_CACHE_SIZE:
+            _parsed_frames.clear()
+        _parsed_frames[frame] = parsed
+    return parsed
+
+def parse_tagged(frame: bytes) -> ParsedCommand:
+    """Parse a request tagged with a correlation id; the untagged command underneath still hits the frame cache."""
+    if frame[:1] == _BINARY_TAG_PREFIX:
+        if len(frame) <= BINARY_TAG.size:
+            return None
+        request_id = BINARY_TAG.unpack_from(frame)[1]
+        command = parse_command(frame[BINARY_TAG.size:])
+    else:
+        tag, _, rest = frame.partition(b'#')
+        try:
+            request_id = int(tag[1:])
+        except ValueError:
+            return None
+        command = parse_command(rest)
+    if command is None:
+        return None
+    return _new_parsed(ParsedCommand, (command[0], command[1], request_id))
+
+def parse_buffer(buffer, end: int = None) -> tuple:
+    """
+    Parse every complete command at the front of a receive buffer.
+    Returns (parsed commands, consumed bytes); malformed binary frames are skipped.
+    """
+    frames, consumed = _framer.split(buffer, len(buffer) if end is None else end)
+    commands = []
+    for frame in frames:
+        command = parse_command(frame)
+        if command is not None:
+            commands.append(command)
+    return commands, consumed
+
+class CommandFramer:
+    def split(self, buffer, end: int) -> tuple:
+        """
+        Split complete commands off the front of a receive buffer.
+        Text commands end with a newline and are returned without it, binary frames are returned whole.
+        Returns (frames, consumed bytes).
+        """
+        frames = []
+        pos = 0
+        while pos < end:
+            if buffer[pos] == BINARY_MAGIC or buffer[pos] == BINARY_TAG_MAGIC:
+                start = pos + BINARY_TAG.size if buffer[pos] == BINARY_TAG_MAGIC else pos  # A tagged frame has a normal frame behind the tag
+                if end - start < BINARY_HEADER.size:
+                    break
+                _, _, arg_format, arg_count = BINARY_HEADER.unpack_from(buffer, start)
+                size = start - pos + BINARY_HEADER.size + BINARY_ARG_SIZES.get(arg_format, 2) * arg_count
+                if end - pos < size:
+                    break
+                frames.append(bytes(buffer[pos:pos + size]))
+                pos += size
+            else:
+                newline = buffer.find(b'\n', pos, end)
+                if newline < 0:
+                    break
+                line = bytes(buffer[pos:newline]).strip()
+                pos = newline + 1
+                if line:
+                    frames.append(line)
+        return frames, pos
+
+_framer = CommandFramer()
 
 class Message_Parse:
     def __init__(self):
@@ -7,6 +187,7 @@ class Message_Parse:
         self.string_parameter = []  # List to store string parameters
         self.int_parameter = []     # List to store integer parameters
         self.command_string = None  # The command string extracted from the input
+        self.command = Command()    # Command names and binary command ids
 
     def clear_parameters(self):
         """Clear all parsed parameters."""
@@ -53,6 +234,40 @@ class Message_Parse:
             print("Error:", e)                                  # Print the exception details
             return False
 
+    def parse_binary(self, frame: bytes) -> bool:
+        """
+        Parse a binary frame and extract command and parameters.
+        Parameters:
+        frame (bytes): A complete binary frame as returned by CommandFramer.
+        Returns:
+        bool: True if parsing is successful, False otherwise.
+        """
+        self.clear_parameters()
+        try:
+            magic, command_id, arg_format, arg_count = BINARY_HEADER.unpack_from(frame)
+            if magic != BINARY_MAGIC:
+                raise ValueError("bad magic byte 0x{:02X}".format(magic))
+            spec = COMMANDS_BY_ID[command_id]
+            self.command_string = spec.name
+            self.int_parameter = list(spec.decode_binary(frame))
+            self.string_parameter = [self.command_string]
+            self.input_string = self.command_string
+            return True
+        except Exception as e:
+            print("Error: Invalid binary command.")
+            print("frame:{}".format(bytes(frame).hex()))
+            self.clear_parameters()
+            print("Error:", e)
+            return False
+
+    def parse_frame(self, frame) -> bool:
+        """Parse a frame from CommandFramer, binary or text."""
+        if isinstance(frame, str):
+            return self.parse(frame)
+        if len(frame) > 0 and frame[0] == BINARY_MAGIC:
+            return self.parse_binary(frame)
+        return self.parse(frame.decode('utf-8', errors='replace'))
+
 if __name__ == '__main__':
     print('Program is starting ... ')  # Print a message indicating the start of the program
     msg_parse = Message_Parse()       # Create an instance of the Message_Parse class
@@ -61,11 +276,12 @@ if __name__ == '__main__':
     print("Message Parse Test")        # Print a test start message
     print("Put message to queue")      # Indicate that a message is being added to the queue
     my_queue.put("CMD_LED#0#255#0#0#15#")  # Add a test message to the queue
+    my_queue.put(encode_binary(msg_parse.command.COMMAND_ID["CMD_M_MOTOR"], [0, 1500, 0, 0]))  # Add a binary test message
 
     print("Get message from queue\n")  # Indicate that messages are being processed from the queue
     while not my_queue.empty():        # Process messages until the queue is empty
         print("Queue size: " + str(my_queue.qsize()))  # Print the current size of the queue
-        if msg_parse.parse(my_queue.get()):  # Parse the message from the queue
+        if msg_parse.parse_frame(my_queue.get()):  # Parse the message from the queue
             if len(msg_parse.int_parameter) > 0 and len(msg_parse.string_parameter) > 0:
                 print("msg.input_string: {}".format(msg_parse.input_string))          # Print the raw input string
                 print("msg.string_parameter: {}".format(msg_parse.string_parameter))  # Print the list of string parameters
@@ -77,4 +293,28 @@ if __name__ == '__main__':
             else:
                 print("msg.input_string: {}".format(msg_parse.input_string))          # Print the raw input string
 
+    # Microbenchmark: the legacy parser against parse_command and parse_buffer
+    rounds = 20000
+    repeated = [b"CMD_M_MOTOR#0#1500#0#0", b"CMD_SERVO#0#90", b"CMD_LED#0#255#0#0", b"CMD_BUZZER#1", b"CMD_POWER"]
+    distinct = [("CMD_M_MOTOR#0#{}#0#{}".format(i, -i)).encode('utf-8') for i in range(len(repeated) * rounds)]
+    def rate(parse, frames, repeat):
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for x in frames:
+                    parse(x)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return len(frames) * repeat / best
+    print("Repeated frames:")
+    print("  Message_Parse.parse_frame: {:.0f} commands/s".format(rate(msg_parse.parse_frame, repeated, rounds)))
+    print("  parse_command:             {:.0f} commands/s".format(rate(parse_command, repeated, rounds)))
+    print("Distinct frames:")
+    print("  Message_Parse.parse_frame: {:.0f} commands/s".format(rate(msg_parse.parse_frame, distinct, 1)))
+    print("  parse_command:             {:.0f} commands/s".format(rate(parse_command, distinct, 1)))
+    buffer = b''.join(x + b'\n' for x in distinct)
+    start = time.perf_counter()
+    commands, consumed = parse_buffer(buffer)
+    print("  parse_buffer:              {:.0f} commands/s (framing included)".format(len(commands) / (time.perf_counter() - start)))
     print("Test end")  # Indicate the end of the test
\ No newline at end of file
@@ -1,26 +1,18 @@
-from ultrasonic import Ultrasonic
-from motor import Ordinary_Car
-from servo import Servo
-from infrared import Infrared
-from camera import Camera
-from adc import ADC
+from local_control import LocalCar
 import cv2
-import numpy as np
 import time
-import math
-import utils2 as utils
 import cam_utils
+from vision_process import VisionProcess
 
 import curses
 
 class Car:
     def __init__(self):
-        self.servo = None
-        self.sonic = None
+        # Motors, servos and sensors belong to the server (main.py); a second PCA9685 here would fight it for the I2C bus,
+        # so they are driven through its local control socket. LocalCar has the set_motor_model / set_servo_pwm calls.
+        self.link = None
         self.motor = None
-        self.infrared = None
-        self.adc = None
-        self.camera = None
+        self.servo = None
         self.car_record_time = time.time()
         self.car_sonic_servo_angle = 30
         self.car_sonic_servo_dir = 1
@@ -29,31 +21,22 @@ class Car:
         self.start()
 
     def start(self):  
-        if self.servo is None:
-            self.servo = Servo()
-        if self.sonic is None:
-            self.sonic = Ultrasonic()
-        if self.motor is None:
-            self.motor = Ordinary_Car()
-        if self.infrared is None:
-            self.infrared = Infrared()
-        if self.adc is None:
-            self.adc = ADC() 
-        if self.camera is None:
-            self.camera = Camera()
+        if self.link is None:
+            self.link = LocalCar()  # Needs main.py running on the car
+            self.motor = self.link
+            self.servo = self.link
         self.speed = 1500
 
+    def get_distance(self):
+        # Latest ultrasonic reading from the server's sensor cache, None if it has none yet
+        reading = self.link.snapshot().get('CMD_SONIC')
+        return reading[0] if reading else None
+
     def close(self):
-        self.motor.set_motor_model(0,0,0,0)
-        self.sonic.close()
-        self.motor.close()
-        self.infrared.close()
-        self.adc.close_i2c()
-        self.servo = None
-        self.sonic = None
+        self.link.close()  # Stops the motors first
+        self.link = None
         self.motor = None
-        self.infrared = None
-        self.adc = None
+        self.servo = None
 
 
     def forward(self, speed=1500):
@@ -85,9 +68,9 @@ def control_car(car, stdscr):
         while True:
             key = stdscr.getch()
 
-            if car.sonic is not None:
+            if car.link is not None:
                 # Get distance from ultrasonic sensor
-                distance = car.sonic.get_distance()
+                distance = car.get_distance()
                 if distance is not None:
                     if distance < 45:
                         #stdscr.addstr("Obstacle detected! Stopping car.\n")
@@ -179,87 +162,40 @@ def test_car_rotate():
         car.close()
 
 count = 0
+VISION_ROI = (0.0, 0.3, 1.0, 0.7)  # x, y, width, height as fractions: the floor ahead, without the top 30%
+MIN_CONFIDENCE = 0.1  # Vision results with less edge than this (as a fraction of a full lane) are not steered on
+DEBUG_VISION = False  # Save every frame get_direction() analyses and its result to the working directory
 def get_direction(camera):
-    """Determine the direction based on the image.
+    """Determine the direction from the next camera frame.
     Args:
-        image: The image captured from the camera.
+        camera: A camera backend that is streaming, e.g. camera_opencv.ReplayCamera off the car.
     Returns:
-        An angle between 45 and 135 degrees"""
-    frame = camera.get_frame()  # Get the current frame from the camera
-    img = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
-    img = utils.prep_image(img, 1, 1, trimFromTop = 0.3)
-
-    global count
-    count += 1
-    if count % 10 == 0:
-        print("Processing frame number: ", count)
-    if img is None:
-        print("Failed to decode image from camera stream.")
-        return 90
-
-
-    cv2.imwrite(f"frame-{count}.jpg", img)  # Save the image to a file for debugging
-
-    #warped = cam_utils.birdseye(img)
-    # cv2.imshow("Frame", img)  # Display the frame using OpenCV
-    # cv2.waitKey(1)  # Wait for a short time to allow OpenCV to update the display
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-
-    # # Apply Gaussian blur - doens't work well
-    # #blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    blurred = gray.copy()
-    
-
-    # # Apply Canny edge detection
-    edges = cv2.Canny(blurred, 50, 150)
-    
+        The lane angle from cam_utils.lane_direction (90 is straight ahead), or 90 without a frame"""
+    # Grayscale pixels of the bottom 70% straight from the camera's raw lores stream: no JPEG decode, no copy
+    with camera.vision_frame(VISION_ROI) as gray:
+        if gray is None:
+            print("No frame from camera stream.")
+            return 90
 
-    # # Dilate and erode the image
-    # dilated = cv2.dilate(edges, None, iterations=1)
-    # eroded = cv2.erode(dilated, None)
+        global count
+        count += 1
+        if count % 10 == 0:
+            print("Processing frame number: ", count)
 
-    contours = cam_utils.find_contours(edges)
+        if DEBUG_VISION:
+            cv2.imwrite(f"frame-{count}.jpg", gray)  # Save the image to a file for debugging
 
-    print("Number of contours: ", len(contours))
-    contours = utils.reduce_contours(contours)
-    print("Number of contours after reduction: ", len(contours))
-    contours = cam_utils.warped_contours(contours)
-
-    average_angle = 0
-    total_length = 0
-
-    for contour in contours:
-            
-        #cv2.drawContours(result_image, [contour], -1, (0, 255, 0), 3)
-        segment_points = cam_utils.get_segments(contour)
-        
-        for i, segment in enumerate(segment_points):
-            #cv2.drawContours(result_image, [[segment]], -1, (0, 255, 0), 3)
-            #cv2.line(result_image, segment[0], segment[1], (0, 255, 0), 2)
-            angle = cam_utils.get_angle_segment(segment[0], segment[1])   
-            angle = cam_utils.convert_angle(angle)
-            if angle > 135 or angle < 45:
-                print("*********Bad angle for segment******* ", angle)
-            
-
-            length = cam_utils.get_length_segment(segment[0], segment[1])
-            total_length += length
-            average_angle += angle*length
-            #print(f"Segment {i}: Start: {segment[0]}, End: {segment[1]}, Angle: {angle:.2f} degrees, Length: {length:.2f} pixels")
-            # cv2.imshow('Contours', result_image)
-            # cv2.waitKey(0)
-        
-    if total_length > 0:
-        average_angle /= total_length
+        # Canny, contours and the length-weighted segment angle; the vision process runs the same function
+        average_angle, confidence, total_length = cam_utils.lane_direction(gray)
 
     print(f"Average angle: {average_angle:.2f} degrees")
 
-    #write the average angle to a file for debugging
-    with open(f"average_angle-{count}.txt", "w") as f:
-        f.write(f"Average angle for frame {count}: {average_angle:.2f} degrees\n")
-        f.write(f"Total length: {total_length:.2f} pixels\n")
-        f.write(f"Number of contours: {len(contours)}\n")
+    if DEBUG_VISION:
+        # Write the average angle to a file for debugging
+        with open(f"average_angle-{count}.txt", "w") as f:
+            f.write(f"Average angle for frame {count}: {average_angle:.2f} degrees\n")
+            f.write(f"Total length: {total_length:.2f} pixels\n")
+            f.write(f"Confidence: {confidence:.2f}\n")
 
     return average_angle 
 
@@ -272,7 +208,13 @@ def test_cam_nav():
     # initscr.refresh()
     try:
         print("Press Ctrl+C to stop the program...")
-        car.camera.start_stream()  # Start the camera
+        # The camera belongs to the server: it feeds grayscale frames into a shared memory ring, and lane vision runs
+        # on them in its own process on another core; this loop only reads its newest result
+        ring = car.link.vision_ring()
+        if ring is None:
+            raise RuntimeError("The server feeds no camera frames")
+        vision = VisionProcess(ring, cam_utils.lane_direction, VISION_ROI)
+        vision.start()
         speed = 1000
         left_speed = speed
         right_speed = speed - 100
@@ -285,8 +227,19 @@ def test_cam_nav():
             left_speed = speed
             right_speed = speed - 100
 
-            # careful as this may take a long time
-            angle = get_direction(car.camera)  # Get the direction from the camera
+            result = vision.latest()  # Newest direction from the vision process, without waiting for it
+            if result is None or time.monotonic() - result.captured > 1.0:
+                print("No recent direction from the vision process, stopping")
+                car.motor.set_motor_model(0, 0, 0, 0)
+                time.sleep(0.1)
+                continue
+            if result.confidence < MIN_CONFIDENCE:
+                # Too little edge to trust the angle (no edges at all gives angle 0), so stop rather than steer on it
+                print("Lane not found (confidence {:.2f}), stopping".format(result.confidence))
+                car.motor.set_motor_model(0, 0, 0, 0)
+                time.sleep(0.1)
+                continue
+            angle = result.angle
 
             # readjust to 90 by turning left or right
 
@@ -317,8 +270,9 @@ def test_cam_nav():
     except KeyboardInterrupt:
         print("\nEnd of program")
         car.motor.set_motor_model(0,0,0,0)
-        car.camera.stop_stream()
-        car.camera.close()  # Close the camera
+        vision.stop()
+        car.link.vision_ring(0)  # The server stops feeding frames
+        car.close()
 
 
 if __name__ == '__main__':
@@ -137,6 +137,21 @@ class ParameterManager:
         """Get the Raspberry Pi version from the parameter file."""
         return self.get_param('Pi_Version')
 
+    def get_seconds(self, param_name: str, default: float) -> float:
+        """Get an optional parameter given in milliseconds as seconds, or default if it is not set or not a positive number."""
+        value = self.get_param(param_name)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+            return value / 1000.0
+        return default
+
+    def get_watchdog_timeout(self, default: float) -> float:
+        """Get the motor watchdog timeout in seconds (optional Watchdog_Timeout_Ms)."""
+        return self.get_seconds('Watchdog_Timeout_Ms', default)
+
+    def get_heartbeat_interval(self, default: float) -> float:
+        """Get the heartbeat interval asked of clients in seconds (optional Heartbeat_Interval_Ms)."""
+        return self.get_seconds('Heartbeat_Interval_Ms', default)
+
 if __name__ == '__main__':
     # Entry point of the script
     manager = ParameterManager()
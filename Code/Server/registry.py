@@ -0,0 +1,104 @@
+import time  # Import time to measure handler latency
+from stats import LatencyHistogram  # Import the latency histogram kept per handler
+from command_schema import ACK_OK, ACK_UNKNOWN, ACK_REJECTED, ACK_FAILED  # Import the outcome codes reported in CMD_ACK
+
+class CommandRegistry:
+    def __init__(self):
+        """Initialize the CommandRegistry class, which maps command names to handler callables."""
+        self.handlers = {}  # Handler entry of each command name
+        self.unknown = 0    # Commands with no registered handler
+
+    def register(self, name: str, handler, min_args: int = 0, max_args: int = None, validate=None) -> None:
+        """
+        Register the handler of a command, replacing any earlier one.
+        Parameters:
+        name (str): The command name, a Command constant.
+        handler (callable): Called as handler(client_address, args) with the integer arguments.
+        min_args (int): Fewest arguments the command needs; shorter commands are rejected.
+        max_args (int): Arguments passed to the handler, extra ones are ignored; None passes them all.
+        validate (callable): Optional check called as validate(args), a false result rejects the command.
+        """
+        self.handlers[name] = {'handler': handler,
+                               'min_args': min_args,
+                               'max_args': max_args,
+                               'validate': validate,
+                               'calls': 0,
+                               'rejected': 0,
+                               'errors': 0,
+                               'latency': LatencyHistogram()}
+
+    def register_command(self, spec, handler) -> None:
+        """Register the handler of a command described by a command_schema.CommandSpec, taking its arity and ranges from the schema."""
+        self.register(spec.name, handler, min_args=spec.min_args, max_args=spec.arg_count, validate=spec.validate)
+
+    def unregister(self, name: str) -> None:
+        """Remove the handler of a command."""
+        self.handlers.pop(name, None)
+
+    def dispatch(self, name: str, args: list, client_address=None) -> bool:
+        """
+        Run the handler of a command.
+        Returns:
+        bool: True if the handler ran without raising, False if the command is unknown, rejected or failed.
+        """
+        return self.dispatch_status(name, args, client_address)[0] == ACK_OK
+
+    def dispatch_status(self, name: str, args: list, client_address=None) -> tuple:
+        """
+        Run the handler of a command and report the outcome.
+        Returns:
+        tuple: (status, seconds in the handler); status is one of the command_schema ACK codes.
+        """
+        entry = self.handlers.get(name)
+        if entry is None:
+            self.unknown += 1
+            return ACK_UNKNOWN, 0.0
+        if len(args) < entry['min_args']:
+            entry['rejected'] += 1
+            return ACK_REJECTED, 0.0
+        if entry['max_args'] is not None:
+            args = args[:entry['max_args']]
+        if entry['validate'] is not None and not entry['validate'](args):
+            entry['rejected'] += 1
+            return ACK_REJECTED, 0.0
+        entry['calls'] += 1
+        start = time.perf_counter()
+        try:
+            entry['handler'](client_address, args)
+            status = ACK_OK
+        except Exception as e:
+            entry['errors'] += 1
+            print("Error handling {}: {}".format(name, e))
+            status = ACK_FAILED
+        elapsed = time.perf_counter() - start
+        entry['latency'].record(elapsed)
+        return status, elapsed
+
+    def benchmark(self, name: str, args: list, count: int = 1000) -> dict:
+        """Dispatch a command count times and return the handler statistics."""
+        for _ in range(count):
+            self.dispatch(name, args)
+        return self.get_stats()[name]
+
+    def get_stats(self) -> dict:
+        """Get the call, rejection and error counts and the latency percentiles of each handler."""
+        stats = {}
+        for name, entry in self.handlers.items():
+            stats[name] = {'calls': entry['calls'],
+                           'rejected': entry['rejected'],
+                           'errors': entry['errors']}
+            stats[name].update(entry['latency'].get_stats())
+        return stats
+
+if __name__ == '__main__':
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    registry = CommandRegistry()       # Create an instance of the CommandRegistry class
+    registry.register("CMD_BUZZER", lambda address, args: None, min_args=1, max_args=1)
+    registry.register("CMD_SERVO", lambda address, args: None, min_args=2, max_args=2, validate=lambda args: 0 <= args[1] <= 180)
+    print(registry.dispatch("CMD_SERVO", [0, 90]))   # True
+    print(registry.dispatch("CMD_SERVO", [0, 200]))  # False, out of range
+    print(registry.dispatch("CMD_SERVO", [0]))       # False, too few arguments
+    print(registry.dispatch("CMD_UNKNOWN", []))      # False, no handler
+    stats = registry.benchmark("CMD_BUZZER", [1], 100000)
+    print("CMD_BUZZER: {} calls, p50 {:.4f} ms, p99 {:.4f} ms".format(stats['calls'], stats['p50_ms'], stats['p99_ms']))
+    print(registry.get_stats()["CMD_SERVO"])
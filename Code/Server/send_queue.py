@@ -0,0 +1,95 @@
+import collections  # Import collections for the reply deque and the ordered telemetry slots
+import threading    # Import threading for the condition shared by senders and the writer
+
+class SendQueue:
+    # Priorities, lowest value first: replies to commands go out before telemetry
+    PRIORITY_REPLY = 0
+    PRIORITY_TELEMETRY = 1
+
+    def __init__(self):
+        """Initialize the SendQueue class, an outbound queue for one port drained by a single writer."""
+        self.condition = threading.Condition()       # Signals the writer when items arrive or the queue closes
+        self.replies = collections.deque()           # Replies as (data, address), in order
+        self.telemetry = collections.OrderedDict()   # Latest telemetry per (key, address), oldest key first
+        self.closed = False                          # Set by close() to release the writer
+        self.enqueued = 0                            # Items accepted by put()
+        self.sent = 0                                # Items handed to the writer
+        self.coalesced = 0                           # Telemetry items replaced by a newer value before being sent
+        self.max_depth = 0                           # Deepest the queue has been
+
+    def put(self, data, address=None, priority: int = PRIORITY_REPLY, key: str = None) -> None:
+        """Queue data for one client address, or for all clients when address is None.
+        Telemetry with a key replaces any queued telemetry with the same key and address."""
+        with self.condition:
+            if self.closed:
+                return
+            self.enqueued += 1
+            if priority == self.PRIORITY_TELEMETRY and key is not None:
+                slot = (key, address)
+                if slot in self.telemetry:
+                    self.coalesced += 1
+                self.telemetry[slot] = (data, address)
+            else:
+                self.replies.append((data, address))
+            self.max_depth = max(self.max_depth, len(self.replies) + len(self.telemetry))
+            self.condition.notify()
+
+    def take(self):
+        """Remove and return the highest priority item, or None if the queue is empty (condition held)."""
+        if self.replies:
+            item = self.replies.popleft()
+        elif self.telemetry:
+            _, item = self.telemetry.popitem(last=False)
+        else:
+            return None
+        self.sent += 1
+        return item
+
+    def get(self, timeout: float = None):
+        """Wait for the next item as (data, address). Returns None once the queue is closed or on timeout."""
+        with self.condition:
+            while not self.closed and not self.replies and not self.telemetry:
+                if not self.condition.wait(timeout):
+                    return None
+            if self.closed:
+                return None
+            return self.take()
+
+    def get_nowait(self):
+        """Return the next item as (data, address) without waiting, or None if the queue is empty."""
+        with self.condition:
+            return self.take()
+
+    def close(self) -> None:
+        """Close the queue and release the writer."""
+        with self.condition:
+            self.closed = True
+            self.replies.clear()
+            self.telemetry.clear()
+            self.condition.notify_all()
+
+    def depth(self) -> int:
+        """Get the number of items waiting to be sent."""
+        with self.condition:
+            return len(self.replies) + len(self.telemetry)
+
+    def get_stats(self) -> dict:
+        """Get the queue depth and counters."""
+        with self.condition:
+            return {'depth': len(self.replies) + len(self.telemetry),
+                    'replies': len(self.replies),
+                    'telemetry': len(self.telemetry),
+                    'max_depth': self.max_depth,
+                    'enqueued': self.enqueued,
+                    'sent': self.sent,
+                    'coalesced': self.coalesced}
+
+if __name__ == '__main__':
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    send_queue = SendQueue()           # Create an instance of the SendQueue class
+    send_queue.put("CMD_MODE#3#20.00\n", priority=SendQueue.PRIORITY_TELEMETRY, key="sonic")
+    send_queue.put("CMD_MODE#3#18.50\n", priority=SendQueue.PRIORITY_TELEMETRY, key="sonic")
+    send_queue.put("CMD_POWER#7.80\n")
+    while send_queue.depth() > 0:
+        print(send_queue.get_nowait())  # The reply comes first, then only the newest sonic value
+    print(send_queue.get_stats())
@@ -1,16 +1,21 @@
 import socket  # Import the socket module for network communication
 import fcntl   # Import the fcntl module for I/O control
 import struct  # Import the struct module for packing and unpacking data
-from tcp_server import TCPServer  # Import the TCPServer class from the tcp_server module
+import threading  # Import the threading module for the writer threads
+from tcp_server import TCPServer, COMMAND_DEAD_PEER_TIMEOUT, VIDEO_MAX_UNSENT_BYTES  # Import the TCPServer class, the command port's dead peer timeout and the video send budget from the tcp_server module
+from send_queue import SendQueue  # Import the outbound queue drained by each writer thread
+from message import CommandFramer  # Import the framer that splits text and binary commands
 
 class Server:
     def __init__(self):
         """Initialize the TankServer class."""
         self.ip_address = self.get_interface_ip()  # Get the IP address of the network interface
-        self.command_server = TCPServer()          # Initialize the command server
-        self.video_server = TCPServer()            # Initialize the video server
-        self.command_server_is_busy = False        # Flag to indicate whether the command server is busy
-        self.video_server_is_busy = False          # Flag to indicate whether the video server is busy
+        self.command_server = TCPServer(framer=CommandFramer(), max_frame_size=4096, dead_peer_timeout=COMMAND_DEAD_PEER_TIMEOUT)  # Initialize the command server, which queues whole commands and drops vanished peers quickly
+        self.video_server = TCPServer(frame_queue_size=1, max_unsent_bytes=VIDEO_MAX_UNSENT_BYTES)  # Initialize the video server, each viewer only gets the newest frame once the previous one has nearly been sent
+        self.command_send_queue = SendQueue()      # Outbound queue of the command server
+        self.video_send_queue = SendQueue()        # Outbound queue of the video server
+        self.command_writer_thread = None          # Thread draining the command server's outbound queue
+        self.video_writer_thread = None            # Thread draining the video server's outbound queue
 
     def get_interface_ip(self) -> str:
         """Get the IP address of the wlan0 interface."""
@@ -26,61 +31,74 @@ class Server:
             print(f"Error getting IP address: {e}")
             return "127.0.0.1"  # Default to localhost if an error occurs
 
-    def start_tcp_servers(self, command_port: int = 5000, video_port: int = 8000, max_clients: int = 1, listen_count: int = 1) -> None:
+    def start_tcp_servers(self, command_port: int = 5000, video_port: int = 8000, max_clients: int = 1, listen_count: int = 1, max_video_clients: int = 4) -> None:
         """Start the TCP servers on specified ports."""
         try:
             self.command_server.start(self.ip_address, command_port, max_clients, listen_count)  # Start the command server
-            self.video_server.start(self.ip_address, video_port, max_clients, listen_count)      # Start the video server
+            self.video_server.start(self.ip_address, video_port, max_video_clients, max(listen_count, max_video_clients))  # Start the video server, which accepts several viewers
         except Exception as e:
             print(f"Error starting TCP servers: {e}")
+        self.command_writer_thread = threading.Thread(target=self.run_writer, args=(self.command_send_queue, self.command_server), daemon=True)
+        self.command_writer_thread.start()
+        self.video_writer_thread = threading.Thread(target=self.run_writer, args=(self.video_send_queue, self.video_server), daemon=True)
+        self.video_writer_thread.start()
 
     def stop_tcp_servers(self) -> None:
         """Stop the TCP servers."""
+        self.command_send_queue.close()  # Release the command writer
+        self.video_send_queue.close()    # Release the video writer
+        for writer_thread in (self.command_writer_thread, self.video_writer_thread):
+            if writer_thread is not None:
+                writer_thread.join()
         try:
             self.command_server.close()  # Close the command server
             self.video_server.close()    # Close the video server
         except Exception as e:
             print(f"Error stopping TCP servers: {e}")
 
-    def set_command_server_busy(self, state: bool) -> None:
-        """Set the busy state of the command server."""
-        self.command_server_is_busy = state
+    def run_writer(self, send_queue: SendQueue, tcp_server: TCPServer) -> None:
+        """Hand queued messages to a TCP server until the queue is closed."""
+        while True:
+            item = send_queue.get()
+            if item is None:
+                break
+            data, ip_address = item
+            try:
+                if ip_address is not None:
+                    tcp_server.send_to_client(ip_address, data)  # Send data to a specific client
+                else:
+                    tcp_server.send_to_all_client(data)         # Send data to all connected clients
+            except Exception as e:
+                print(e)
 
-    def set_video_server_busy(self, state: bool) -> None:
-        """Set the busy state of the video server."""
-        self.video_server_is_busy = state
+    def send_data_to_command_client(self, data: bytes, ip_address: str = None) -> None:
+        """Queue a reply to the command server client(s); replies are sent before telemetry."""
+        self.command_send_queue.put(data, ip_address)
 
-    def get_command_server_busy(self) -> bool:
-        """Get the busy state of the command server."""
-        return self.command_server_is_busy
+    def send_telemetry_to_command_client(self, key: str, data: bytes, ip_address: str = None) -> None:
+        """Queue telemetry to the command server client(s); a newer value with the same key replaces one not yet sent."""
+        self.command_send_queue.put(data, ip_address, SendQueue.PRIORITY_TELEMETRY, key)
 
-    def get_video_server_busy(self) -> bool:
-        """Get the busy state of the video server."""
-        return self.video_server_is_busy
+    def send_data_to_video_client(self, data: bytes, ip_address: str = None) -> None:
+        """Queue data to the video server client(s). A tuple of parts is queued as one message."""
+        self.video_send_queue.put(data, ip_address)
 
-    def send_data_to_command_client(self, data: bytes, ip_address: str = None) -> None:
-        """Send data to the command server client(s)."""
-        self.set_command_server_busy(True)
-        try:
-            if ip_address is not None:
-                self.command_server.send_to_client(ip_address, data)  # Send data to a specific client
-            else:
-                self.command_server.send_to_all_client(data)         # Send data to all connected clients of the command server
-        except Exception as e:
-            print(e)
-        finally:
-            self.set_command_server_busy(False)
+    def get_send_queue_stats(self) -> dict:
+        """Get the depth and counters of both outbound queues."""
+        return {'command': self.command_send_queue.get_stats(), 'video': self.video_send_queue.get_stats()}
 
-    def send_data_to_video_client(self, data: bytes, ip_address: str = None) -> None:
-        """Send data to the video server client(s)."""
-        self.set_video_server_busy(True)
-        try:
-            if ip_address is not None:
-                self.video_server.send_to_client(ip_address, data)  # Send data to a specific client
-            else:
-                self.video_server.send_to_all_client(data)         # Send data to all connected clients of the video server
-        finally:
-            self.set_video_server_busy(False)
+    def broadcast_video_frame(self, frame: bytes, timing=None) -> None:
+        """Queue a frame for every video client; slow viewers drop their oldest frames instead of slowing the others.
+        timing (video_timing.FrameSend) builds each viewer's header and records the send times."""
+        self.video_server.broadcast_frame(frame, timing)
+
+    def get_video_client_stats(self) -> dict:
+        """Get the frame rate and sent/dropped frame counters of each video client."""
+        return self.video_server.get_frame_stats()
+
+    def get_video_throughput(self) -> dict:
+        """Get bytes and frames per second sent to all video clients since the previous call."""
+        return self.video_server.get_throughput()
 
     def read_data_from_command_server(self) -> 'queue.Queue':
         """Read data from the command server's message queue."""
@@ -90,6 +108,10 @@ class Server:
         """Read data from the video server's message queue."""
         return self.video_server.message_queue
 
+    def set_command_disconnect_handler(self, handler) -> None:
+        """Call handler(address) when a command client disconnects or is dropped as dead."""
+        self.command_server.on_disconnect = handler
+
     def is_command_server_connected(self) -> bool:
         """Check if the command server has any active connections."""
         return self.command_server.active_connections > 0
@@ -102,6 +124,10 @@ class Server:
         """Get the list of client IP addresses connected to the command server."""
         return self.command_server.get_client_ips()
 
+    def get_command_server_client_addresses(self) -> list:
+        """Get the (ip, port) addresses of the clients connected to the command server."""
+        return self.command_server.get_client_addresses()
+
     def get_video_server_client_ips(self) -> list:
         """Get the list of client IP addresses connected to the video server."""
         return self.video_server.get_client_ips()
@@ -117,7 +143,7 @@ if __name__ == '__main__':
             if cmd_queue.qsize() > 0:  # Check if there are messages in the queue
                 client_address, message = cmd_queue.get()  # Get a message from the queue
                 print(client_address, message)  # Print the client address and message
-                server.send_data_to_command_client(message, client_address)  # Send the message back to the client
+                server.send_data_to_command_client(message + b'\n', client_address)  # Send the message back to the client
 
             video_queue = server.read_data_from_video_server()  # Get the video server's message queue
             if video_queue.qsize() > 0:  # Check if there are messages in the queue
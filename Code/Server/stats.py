@@ -0,0 +1,68 @@
+import bisect     # Import bisect to find the bucket of a sample
+import threading  # Import threading for the lock shared by recorders and readers
+
+class LatencyHistogram:
+    # Bucket upper bounds in seconds, roughly log spaced from 1 us to 1 s; slower samples go in the last bucket
+    BOUNDS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, bounds: tuple = BOUNDS):
+        """Initialize the LatencyHistogram class, a fixed bucket histogram of durations in seconds."""
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # One count per bucket plus the overflow bucket
+        self.count = 0                         # Samples recorded
+        self.total = 0.0                       # Sum of the samples, for the mean
+        self.max = 0.0                         # Slowest sample
+
+    def record(self, seconds: float) -> None:
+        """Add one duration to the histogram."""
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, percent: float) -> float:
+        """Get the bucket upper bound below which the given percent of the samples fall (the max for the overflow bucket)."""
+        with self.lock:
+            return self.percentile_locked(percent)
+
+    def percentile_locked(self, percent: float) -> float:
+        """Get a percentile while the lock is held."""
+        if self.count == 0:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def reset(self) -> None:
+        """Forget all samples."""
+        with self.lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def get_stats(self) -> dict:
+        """Get the sample count, mean, max and percentiles in milliseconds, plus the raw bucket counts."""
+        with self.lock:
+            return {'count': self.count,
+                    'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+                    'max_ms': self.max * 1000,
+                    'p50_ms': self.percentile_locked(50) * 1000,
+                    'p90_ms': self.percentile_locked(90) * 1000,
+                    'p99_ms': self.percentile_locked(99) * 1000,
+                    'buckets': list(self.counts)}
+
+if __name__ == '__main__':
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    histogram = LatencyHistogram()     # Create an instance of the LatencyHistogram class
+    for i in range(1, 101):
+        histogram.record(i / 10000.0)  # 0.1 ms to 10 ms
+    print(histogram.get_stats())
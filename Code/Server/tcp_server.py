@@ -1,26 +1,247 @@
 import socket
-import select
+import selectors
 import threading
 import fcntl
+import termios
 import struct
 import queue
+import collections
+import itertools
+import time
+
+# Most buffers handed to a single sendmsg call, well below the kernel's IOV_MAX
+SENDMSG_MAX_BUFFERS = 64
+# How often the selector thread re-checks clients waiting for their kernel send queue to drain
+DRAIN_POLL_INTERVAL = 0.005
+# Linux ioctl for the bytes of a socket's send queue not sent yet; TIOCOUTQ also counts bytes sent but not yet
+# acknowledged, so waiting on it would hold every frame back for a full round trip over Wi-Fi
+SIOCOUTQNSD = 0x894B
+# Unsent bytes a video viewer may still have in the kernel before its next frame is held back: a fraction of a
+# 400x300 JPEG, so the link never idles between frames and a stale frame never queues behind a whole fresh one
+VIDEO_MAX_UNSENT_BYTES = 8 * 1024
+# Keepalive probes sent before an idle peer is declared dead
+KEEPALIVE_PROBES = 3
+# Seconds before the command port drops a peer that stopped acknowledging; the motor watchdog reacts much sooner
+COMMAND_DEAD_PEER_TIMEOUT = 2.0
+
+class RawFramer:
+    def split(self, buffer, end):
+        """Return every received chunk as one frame."""
+        return [bytes(buffer[:end])], end
+
+class DelimiterFramer:
+    def __init__(self, delimiter=b'\n'):
+        # Bytes that terminate each frame; they are not included in the emitted frames
+        self.delimiter = delimiter
+
+    def split(self, buffer, end):
+        """Split complete delimited frames off the front of the buffer. Returns (frames, consumed bytes)."""
+        frames = []
+        pos = 0
+        while True:
+            found = buffer.find(self.delimiter, pos, end)
+            if found < 0:
+                return frames, pos
+            if found > pos:
+                frames.append(bytes(buffer[pos:found]))
+            pos = found + len(self.delimiter)
+
+class LengthPrefixFramer:
+    def __init__(self, header_format='<I'):
+        # Each frame is preceded by its payload length packed with this format
+        self.header = struct.Struct(header_format)
+
+    def split(self, buffer, end):
+        """Split complete length-prefixed frames off the front of the buffer. Returns (frames, consumed bytes)."""
+        frames = []
+        pos = 0
+        while end - pos >= self.header.size:
+            length, = self.header.unpack_from(buffer, pos)
+            start = pos + self.header.size
+            if end - start < length:
+                break
+            frames.append(bytes(buffer[start:start + length]))
+            pos = start + length
+        return frames, pos
+
+def kernel_unsent_bytes(sock) -> int:
+    """Get the bytes in a socket's kernel send queue that have not been sent yet."""
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), SIOCOUTQNSD, b'\0\0\0\0'))[0]
+    except OSError:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0\0\0\0'))[0]  # Kernels without SIOCOUTQNSD
+
+class ClientConnection:
+    def __init__(self, client_socket, client_address, max_buffer_size, max_frame_size, frame_queue_size, max_unsent_bytes):
+        # Socket and address of the connected client
+        self.socket = client_socket
+        self.address = client_address
+        # Receive buffer holding at most one partial frame plus newly received bytes
+        self.in_buffer = bytearray(max_frame_size)
+        self.in_view = memoryview(self.in_buffer)
+        self.in_length = 0
+        # Outgoing data waiting for the socket to become writable
+        self.out_chunks = collections.deque()
+        self.out_bytes = 0
+        # Upper bound on queued outgoing bytes before messages are dropped
+        self.max_buffer_size = max_buffer_size
+        # Number of messages dropped because the buffer was full
+        self.dropped_messages = 0
+        # True while there is data the reactor has to send when the socket becomes writable
+        self.want_write = False
+        # Whether the selector currently watches this socket for writability (selector thread only)
+        self.write_registered = False
+        # True once the client has been scheduled for removal
+        self.closed = False
+        # Broadcast frames waiting for the previous frame to drain; the oldest is dropped when full
+        self.frame_queue = collections.deque()
+        self.frame_queue_size = frame_queue_size
+        # Kernel send queue bytes allowed before the next frame is held back, None to disable
+        self.max_unsent_bytes = max_unsent_bytes
+        # True while a frame is held back until the kernel send queue drains
+        self.waiting_for_drain = False
+        # Timing of the frame being sent, told when its last byte is handed to the kernel
+        self.sending_frame = None
+        # Frame delivery counters for this client
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.dropped_frames = 0
+        self.fps = 0.0
+        self.fps_frames = 0
+        self.fps_time = time.monotonic()
+        # Protects the outgoing buffer, which is filled by sender threads and drained by the reactor
+        self.lock = threading.Lock()
+
+    def enqueue(self, parts) -> bool:
+        """Queue all parts of one message, or none of them if the buffer would overflow."""
+        size = sum(len(part) for part in parts)
+        if self.out_bytes + size > self.max_buffer_size:
+            self.dropped_messages += 1
+            return False
+        for part in parts:
+            if len(part) > 0:
+                self.out_chunks.append(memoryview(part))
+        self.out_bytes += size
+        return True
+
+    def current_fps(self) -> float:
+        """Get the frame rate, falling back to the open window when the client has stalled."""
+        elapsed = time.monotonic() - self.fps_time
+        return self.fps if elapsed < 2.0 else self.fps_frames / elapsed
+
+    def push_frame(self, parts, timing=None) -> None:
+        """Queue a broadcast frame, dropping the oldest queued frame if the queue is full."""
+        if len(self.frame_queue) >= self.frame_queue_size:
+            self.frame_queue.popleft()
+            self.dropped_frames += 1
+        self.frame_queue.append((parts, timing))
+
+    def kernel_unsent_bytes(self) -> int:
+        """Get the bytes in the kernel send queue not sent yet."""
+        return kernel_unsent_bytes(self.socket)
+
+    def unsent_bytes(self) -> int:
+        """Get the bytes queued for this client in user space and in the kernel."""
+        return self.out_bytes + self.kernel_unsent_bytes()
+
+    def next_frame(self) -> bool:
+        """Move the next queued frame into the outgoing buffer once everything before it has been sent."""
+        if self.out_chunks or not self.frame_queue:
+            self.waiting_for_drain = False
+            return False
+        # Hold the frame back while the previous one is still waiting to be sent, so newer frames can replace it
+        self.waiting_for_drain = self.max_unsent_bytes is not None and self.kernel_unsent_bytes() > self.max_unsent_bytes
+        if self.waiting_for_drain:
+            return False
+        parts, timing = self.frame_queue.popleft()
+        if timing is not None:
+            # The header is built as the frame starts to leave, so it can carry the send time
+            parts = (timing.header(self.address),) + tuple(parts)
+            self.sending_frame = timing
+        for part in parts:
+            self.out_chunks.append(memoryview(part))
+            self.out_bytes += len(part)
+        self.frames_sent += 1
+        self.fps_frames += 1
+        now = time.monotonic()
+        if now - self.fps_time >= 1.0:
+            self.fps = self.fps_frames / (now - self.fps_time)
+            self.fps_frames = 0
+            self.fps_time = now
+        return True
+
+    def flush(self) -> bool:
+        """Send as much queued data as the socket accepts. Returns True when the buffer and frame queue are empty."""
+        while self.out_chunks or self.next_frame():
+            buffers = list(itertools.islice(self.out_chunks, SENDMSG_MAX_BUFFERS))
+            try:
+                # Gather header and payload into one syscall so they leave in the same segments
+                sent = self.socket.sendmsg(buffers)
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.out_bytes -= sent
+            self.bytes_sent += sent
+            partial = sent < sum(len(buffer) for buffer in buffers)
+            while sent > 0:
+                chunk = self.out_chunks[0]
+                if sent < len(chunk):
+                    self.out_chunks[0] = chunk[sent:]
+                    break
+                sent -= len(chunk)
+                self.out_chunks.popleft()
+            if self.sending_frame is not None and not self.out_chunks:
+                self.sending_frame.sent(self.address)
+                self.sending_frame = None
+            if partial:
+                return False
+        return True
 
 class TCPServer:
-    def __init__(self):
+    def __init__(self, max_buffer_size=256 * 1024, framer=None, max_frame_size=64 * 1024, frame_queue_size=2, max_unsent_bytes=None, dead_peer_timeout=None):
         # Initialize server and client sockets
         self.server_socket = None
-        self.client_sockets = {}
-        # Message queue for incoming messages
+        # Seconds after which a peer that stopped acknowledging is dropped (keepalive and TCP_USER_TIMEOUT), None for the kernel defaults
+        self.dead_peer_timeout = dead_peer_timeout
+        # Called as on_disconnect(address) from the selector thread when a client goes away
+        self.on_disconnect = None
+        # Connected clients, keyed by socket
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        # Maximum number of bytes queued per client before new messages are dropped
+        self.max_buffer_size = max_buffer_size
+        # Splits each client's byte stream into frames (raw chunks, delimited lines or length-prefixed)
+        self.framer = framer if framer is not None else RawFramer()
+        # Largest frame a client may send before it is disconnected
+        self.max_frame_size = max_frame_size
+        # Number of broadcast frames each client may have waiting before the oldest is dropped
+        self.frame_queue_size = frame_queue_size
+        # Kernel send queue bytes a client may have in flight before its next frame is held back
+        self.max_unsent_bytes = max_unsent_bytes
+        # Clients holding a frame back until their kernel send queue drains (selector thread only)
+        self.draining_clients = set()
+        # Bytes and frames sent to clients that have since disconnected
+        self.retired_bytes_sent = 0
+        self.retired_frames_sent = 0
+        # Totals at the previous throughput reading
+        self.throughput_time = time.monotonic()
+        self.throughput_bytes = 0
+        self.throughput_frames = 0
+        # Message queue for incoming frames, as (client address, bytes)
         self.message_queue = queue.Queue()
         # Maximum number of clients allowed
         self.max_clients = 1
         # Current number of active connections
         self.active_connections = 0
-        # Thread for accepting new connections
+        # Thread running the selector loop
         self.accept_thread = None
+        # Selector watching the server socket, the wakeup pipe and all clients
+        self.selector = selectors.DefaultSelector()
+        # Clients whose write interest or removal must be applied by the selector thread
+        self.pending_clients = set()
+        self.pending_lock = threading.Lock()
         # Event to signal the server to stop
         self.stop_event = threading.Event()
-        # Pipe for stopping the server
+        # Pipe for waking up the selector thread
         self.stop_pipe_r, self.stop_pipe_w = socket.socketpair()
         self.stop_pipe_r.setblocking(0)
         self.stop_pipe_w.setblocking(0)
@@ -36,98 +257,235 @@ class TCPServer:
         self.server_socket.setblocking(0)
         print(f"Server started, listening on {ip}:{port}")
 
-        # Start the thread for accepting connections
+        # Register the listening socket and the wakeup pipe with the selector
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.selector.register(self.stop_pipe_r, selectors.EVENT_READ)
+        # Start the selector thread
         self.accept_thread = threading.Thread(target=self.accept_connections, daemon=True)
         self.accept_thread.start()
 
     def accept_connections(self):
-        # Accept new connections until the server is stopped
+        # Serve accepts, reads and writes until the server is stopped
         while not self.stop_event.is_set():
-            # Use select to monitor the server socket and the stop pipe
-            readable, writable, exceptional = select.select([self.server_socket, self.stop_pipe_r] + list(self.client_sockets.keys()), [], [])
-            for s in readable:
-                if s == self.server_socket and self.active_connections < self.max_clients:
-                    # Accept a new connection if the maximum number of clients is not reached
-                    client_socket, client_address = s.accept()
-                    client_socket.setblocking(0)
-                    self.client_sockets[client_socket] = client_address
-                    self.active_connections += 1
-                    print(f"New connection from {client_address}, {self.active_connections} active connections.")
-                elif s == self.server_socket and self.active_connections >= self.max_clients:
-                    # Reject new connections if the maximum number of clients is reached
-                    client_socket, client_address = s.accept()
-                    client_socket.close()
-                    print(f"Rejected connection from {client_address}, max connections ({self.max_clients}) reached.")
-                elif s == self.stop_pipe_r:
-                    # Stop the server if the stop pipe is read
-                    self.stop_event.set()
-                    break
+            # Poll periodically while any client waits for its send queue to drain; writability does not signal that
+            timeout = DRAIN_POLL_INTERVAL if self.draining_clients else None
+            for key, mask in self.selector.select(timeout):
+                if key.fileobj is self.server_socket:
+                    self.accept_client()
+                elif key.fileobj is self.stop_pipe_r:
+                    self.drain_stop_pipe()
                 else:
-                    try:
-                        # Receive data from the client
-                        data = s.recv(1024)
-                        if data:
-                            client_address = self.client_sockets[s]
-                            self.message_queue.put((client_address, data.decode('utf-8')))
-                        else:
-                            # Remove the client if no data is received
-                            client_address = self.client_sockets[s]
-                            print(client_address, "disconnected")
-                            self.remove_client(s)
-                    except OSError as e:
-                        if e.errno == 9 or e.errno == 32:
-                            # Handle broken pipe errors
-                            client_address = self.client_sockets[s]
-                            print(client_address, "disconnected")
-                            self.remove_client(s)
-                        else:
-                            print(f"Unexpected error: {e}")
-            for s in exceptional:
-                # Handle exceptional conditions
-                client_address = self.client_sockets[s]
-                print(client_address, "disconnected")
-                self.remove_client(s)
+                    client = key.data
+                    if mask & selectors.EVENT_READ:
+                        self.read_client(client)
+                    if mask & selectors.EVENT_WRITE and not client.closed:
+                        self.write_client(client)
+            self.apply_pending_clients()
+            for client in list(self.draining_clients):
+                self.write_client(client)
         print("Closing accept_connections...")
 
+    def accept_client(self):
+        # Accept a new connection, or reject it if the maximum number of clients is reached
+        try:
+            client_socket, client_address = self.server_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        if self.active_connections >= self.max_clients:
+            client_socket.close()
+            print(f"Rejected connection from {client_address}, max connections ({self.max_clients}) reached.")
+            return
+        client_socket.setblocking(0)
+        if self.dead_peer_timeout is not None:
+            set_dead_peer_timeout(client_socket, self.dead_peer_timeout)
+        client = ClientConnection(client_socket, client_address, self.max_buffer_size, self.max_frame_size, self.frame_queue_size, self.max_unsent_bytes)
+        with self.clients_lock:
+            self.clients[client_socket] = client
+            self.active_connections = len(self.clients)
+        self.selector.register(client_socket, selectors.EVENT_READ, client)
+        print(f"New connection from {client_address}, {self.active_connections} active connections.")
+
+    def read_client(self, client):
+        try:
+            # Receive data from the client straight into the free end of its buffer
+            count = client.socket.recv_into(client.in_view[client.in_length:])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print(client.address, "disconnected:", e)
+            self.close_client(client)
+            return
+        if count == 0:
+            # Remove the client if no data is received
+            print(client.address, "disconnected")
+            self.close_client(client)
+            return
+        client.in_length += count
+        # Queue only complete frames and keep the partial tail for the next read
+        frames, consumed = self.framer.split(client.in_buffer, client.in_length)
+        for frame in frames:
+            self.message_queue.put((client.address, frame))
+        if consumed > 0:
+            remaining = client.in_length - consumed
+            client.in_view[:remaining] = client.in_view[consumed:client.in_length]
+            client.in_length = remaining
+        elif client.in_length == len(client.in_buffer):
+            print(f"Frame from {client.address} exceeds {self.max_frame_size} bytes, disconnecting.")
+            self.close_client(client)
+
+    def write_client(self, client):
+        # Drain the outgoing buffer now that the socket is writable
+        try:
+            with client.lock:
+                client.want_write = not client.flush()
+        except OSError as e:
+            print(f"Error sending data to {client.address}: {e}")
+            self.close_client(client)
+            return
+        self.update_interest(client)
+
+    def update_interest(self, client):
+        # Watch for writability only while data is pending, and poll clients waiting for a drain
+        if client.want_write != client.write_registered:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if client.want_write else selectors.EVENT_READ
+            self.selector.modify(client.socket, events, client)
+            client.write_registered = client.want_write
+        if client.waiting_for_drain:
+            self.draining_clients.add(client)
+        else:
+            self.draining_clients.discard(client)
+
+    def drain_stop_pipe(self):
+        # Discard the wakeup bytes; pending work is applied after the select loop
+        try:
+            while self.stop_pipe_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def apply_pending_clients(self):
+        # Apply write interest and removals requested by other threads
+        with self.pending_lock:
+            pending = self.pending_clients
+            self.pending_clients = set()
+        for client in pending:
+            if client.closed:
+                self.close_client(client)
+            elif client.socket in self.clients:
+                self.update_interest(client)
+
+    def schedule_client(self, client):
+        # Ask the selector thread to update a client and wake it up
+        with self.pending_lock:
+            self.pending_clients.add(client)
+        self.wake_up()
+
+    def wake_up(self):
+        try:
+            self.stop_pipe_w.send(b'\x01')
+        except (BlockingIOError, InterruptedError):
+            # The pipe is already full of wakeups, the selector thread will run anyway
+            pass
+
     def stop_pipe(self):
-        # Send a byte to the stop pipe to signal the server to stop
-        self.stop_pipe_w.send(b'\x00')
+        # Signal the server to stop and wake up the selector thread
+        self.stop_event.set()
+        self.wake_up()
 
-    def send_to_all_client(self, message):
-        # Send a message to all connected clients
-        for client_socket in list(self.client_sockets.keys()):
+    def queue_message(self, client, message) -> bool:
+        # Queue a message (bytes, str, or a sequence of parts sent back to back) for one client
+        if isinstance(message, str):
+            parts = (message.encode('utf-8'),)
+        elif isinstance(message, (list, tuple)):
+            parts = message
+        else:
+            parts = (message,)
+        try:
+            with client.lock:
+                if not client.enqueue(parts):
+                    return False
+                # The reactor is already sending for this client, it will pick the message up
+                if client.want_write:
+                    return True
+                # Try to send right away; the reactor takes over whatever is left
+                client.want_write = not client.flush()
+                if not client.want_write and not client.waiting_for_drain:
+                    return True
+        except OSError as e:
+            print(f"Error sending data to {client.address}: {e}")
+            self.remove_client(client.socket)
+            return False
+        self.schedule_client(client)
+        return True
+
+    def broadcast_frame(self, frame, timing=None):
+        # Queue a length-prefixed frame for every client; each client drains its own queue at its own pace.
+        # With timing, the header comes from timing.header(address) as the send starts and timing.sent(address) follows the last byte.
+        parts = (struct.pack('<I', len(frame)), frame) if timing is None else (frame,)
+        with self.clients_lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            if client.closed:
+                continue
             try:
-                if isinstance(message, str):
-                    encoded_message = message.encode('utf-8')
-                else:
-                    encoded_message = message
-                client_socket.sendall(encoded_message)
-            except socket.error as e:
-                print(f"Error sending data to {self.client_sockets[client_socket]}: {e}")
-                self.remove_client(client_socket)
+                with client.lock:
+                    client.push_frame(parts, timing)
+                    # The reactor is already sending or polling for this client, it will pick the frame up
+                    if client.want_write or client.waiting_for_drain:
+                        continue
+                    client.want_write = not client.flush()
+                    if not client.want_write and not client.waiting_for_drain:
+                        continue
+            except OSError as e:
+                print(f"Error sending data to {client.address}: {e}")
+                self.remove_client(client.socket)
+                continue
+            self.schedule_client(client)
 
-    def send_to_client(self, client_address, message):
+    def send_to_all_client(self, message):
+        # Send a message to all connected clients without blocking on slow ones
+        with self.clients_lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            if not client.closed:
+                self.queue_message(client, message)
+
+    def send_to_client(self, client_address, message) -> bool:
         # Send a message to a specific client
-        for client_socket, addr in self.client_sockets.items():
-            if addr == client_address:
-                try:
-                    if isinstance(message, str):
-                        encoded_message = message.encode('utf-8')
-                    else:
-                        encoded_message = message
-                    client_socket.sendall(encoded_message)
-                except socket.error as e:
-                    print(f"Error sending data to {client_address}: {e}")
-                    self.remove_client(client_socket)
-                return
+        with self.clients_lock:
+            clients = list(self.clients.values())
+        for client in clients:
+            if client.address == client_address:
+                if client.closed:
+                    return False
+                return self.queue_message(client, message)
         print(f"Client at {client_address} not found.")
+        return False
 
     def remove_client(self, client_socket):
-        # Remove a client from the server
-        if client_socket in self.client_sockets:
-            del self.client_sockets[client_socket]
-            client_socket.close()
-            self.active_connections -= 1
+        # Schedule a client for removal by the selector thread
+        client = self.clients.get(client_socket)
+        if client is not None and not client.closed:
+            client.closed = True
+            self.schedule_client(client)
+
+    def close_client(self, client):
+        # Remove a client from the server (selector thread only)
+        client.closed = True
+        self.draining_clients.discard(client)
+        with self.clients_lock:
+            if self.clients.pop(client.socket, None) is None:
+                return
+            self.active_connections = len(self.clients)
+            self.retired_bytes_sent += client.bytes_sent
+            self.retired_frames_sent += client.frames_sent
+        try:
+            self.selector.unregister(client.socket)
+        except (KeyError, ValueError):
+            pass
+        client.socket.close()
+        if self.on_disconnect is not None:
+            self.on_disconnect(client.address)
 
     def close(self):
         # Close the server and all client connections
@@ -136,14 +494,70 @@ class TCPServer:
             self.accept_thread.join()
         if self.server_socket is not None:
             self.server_socket.close()
-        for s in list(self.client_sockets):
-            s.close()
-        self.client_sockets.clear()
+        with self.clients_lock:
+            for client in self.clients.values():
+                client.closed = True
+                client.socket.close()
+            self.clients.clear()
+            self.active_connections = 0
+        self.selector.close()
+        self.stop_pipe_r.close()
+        self.stop_pipe_w.close()
         print("Server stopped.")
 
     def get_client_ips(self):
         # Get a list of IP addresses of connected clients
-        return [addr[0] for addr in self.client_sockets.values()]
+        with self.clients_lock:
+            return [client.address[0] for client in self.clients.values()]
+
+    def get_client_addresses(self):
+        # Get the (ip, port) addresses of connected clients
+        with self.clients_lock:
+            return [client.address for client in self.clients.values()]
+
+    def get_frame_stats(self):
+        # Get the frame rate and frame counters of every client
+        with self.clients_lock:
+            return {client.address: {'fps': round(client.current_fps(), 1),
+                                     'bytes_sent': client.bytes_sent,
+                                     'frames_sent': client.frames_sent,
+                                     'dropped_frames': client.dropped_frames,
+                                     'queued_frames': len(client.frame_queue),
+                                     'unsent_bytes': client.unsent_bytes()}
+                    for client in self.clients.values()}
+
+    def get_throughput(self):
+        # Get bytes and frames per second sent to all clients since the previous reading
+        with self.clients_lock:
+            bytes_sent = self.retired_bytes_sent + sum(client.bytes_sent for client in self.clients.values())
+            frames_sent = self.retired_frames_sent + sum(client.frames_sent for client in self.clients.values())
+        now = time.monotonic()
+        elapsed = max(now - self.throughput_time, 1e-6)
+        throughput = {'bytes_per_second': round((bytes_sent - self.throughput_bytes) / elapsed),
+                      'frames_per_second': round((frames_sent - self.throughput_frames) / elapsed, 1),
+                      'bytes_sent': bytes_sent,
+                      'frames_sent': frames_sent}
+        self.throughput_time, self.throughput_bytes, self.throughput_frames = now, bytes_sent, frames_sent
+        return throughput
+
+    def get_dropped_messages(self):
+        # Get the number of messages dropped per client because its buffer was full
+        with self.clients_lock:
+            return {client.address: client.dropped_messages for client in self.clients.values()}
+
+def set_dead_peer_timeout(sock, timeout):
+    # Detect a peer that vanished (Wi-Fi drop, frozen host) within about timeout seconds instead of the kernel's
+    # minutes: keepalive probes an idle connection and TCP_USER_TIMEOUT bounds how long sent data may stay unacknowledged
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    interval = max(1, int(timeout / (KEEPALIVE_PROBES + 1)))  # Keepalive times are whole seconds
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, interval)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_PROBES)
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(timeout * 1000))
 
 def get_interface_ip():
     # Get the IP address of the specified network interface
@@ -159,11 +573,10 @@ if __name__ == "__main__":
     try:
         while True:
             # Process incoming messages
-            while not server.message_queue.empty():
-                client_address, message = server.message_queue.get()
-                print(f"Received message from {client_address}: {message}")
-                server.send_to_client(client_address, message)
+            client_address, message = server.message_queue.get()
+            print(f"Received message from {client_address}: {message}")
+            server.send_to_client(client_address, message)
     except KeyboardInterrupt:
         print("Server interrupted by user.")
     finally:
-        server.close()
\ No newline at end of file
+        server.close()
@@ -0,0 +1,166 @@
+import threading  # Import threading for the push thread and its condition
+import time       # Import time for the cache ages and the push schedule
+
+class TelemetryHub:
+    def __init__(self, send, connected=None, tick: float = 0.02):
+        """
+        Initialize the TelemetryHub class, which caches sensor readings and pushes them to subscribed clients.
+        Parameters:
+        send (callable): Called as send(address, frame) to push one telemetry frame to a client.
+        connected (callable): Returns the addresses still connected; subscriptions of other clients are dropped.
+        tick (float): Channels due within one tick of each other go out in the same frame.
+        """
+        self.send = send
+        self.connected = connected
+        self.tick = tick
+        self.channels = {}           # Channel name -> reader, minimum period and cached reading
+        self.read_lock = threading.Lock()       # One hardware read at a time, shared by the push thread and requests
+        self.condition = threading.Condition()  # Signals the push thread when subscriptions change or it stops
+        self.subscriptions = {}      # Client address -> {channel name: [period, next due time]}
+        self.running = False
+        self.thread = None
+        self.frames_sent = 0         # Telemetry frames pushed
+
+    def add_channel(self, name: str, read, min_period: float = 0.0) -> None:
+        """Add a sensor channel. read() returns a number or a tuple of numbers; the hardware is read at most once per min_period."""
+        self.channels[name] = {'read': read, 'min_period': min_period, 'value': None, 'time': 0.0, 'reads': 0, 'cache_hits': 0}
+
+    def read(self, name: str, max_age: float = 0.0):
+        """Get the reading of a channel, from the cache when it is younger than max_age or the channel's minimum period."""
+        channel = self.channels[name]
+        with self.read_lock:
+            now = time.monotonic()
+            if channel['value'] is not None and now - channel['time'] < max(max_age, channel['min_period']):
+                channel['cache_hits'] += 1
+                return channel['value']
+            value = channel['read']()
+            channel['value'] = value
+            channel['time'] = time.monotonic()
+            channel['reads'] += 1
+            return value
+
+    def snapshot(self, max_age: float = None) -> str:
+        """Get one frame with every channel: readings older than max_age are refreshed, None only reads channels never read."""
+        values = []
+        for name, channel in self.channels.items():
+            try:
+                if max_age is None and channel['value'] is not None:
+                    values.append((name, channel['value']))
+                else:
+                    values.append((name, self.read(name, max_age or 0.0)))
+            except Exception as e:
+                print("Telemetry read of {} failed: {}".format(name, e))
+        return self.format_frame(values)
+
+    def subscribe(self, address, name: str, period: float) -> bool:
+        """Push a channel to a client every period seconds; a period of 0 cancels the subscription."""
+        if name not in self.channels:
+            return False
+        with self.condition:
+            channels = self.subscriptions.setdefault(address, {})
+            if period <= 0:
+                channels.pop(name, None)
+                if not channels:
+                    del self.subscriptions[address]
+            else:
+                channels[name] = [max(period, self.tick), time.monotonic()]
+            self.condition.notify()
+        return True
+
+    def unsubscribe(self, address) -> None:
+        """Cancel every subscription of a client."""
+        with self.condition:
+            self.subscriptions.pop(address, None)
+
+    def format_frame(self, values: list) -> str:
+        """Build one telemetry frame from (channel name, reading) pairs: CMD_TELEMETRY#NAME:v[:v...]#..."""
+        fields = []
+        for name, value in values:
+            if not isinstance(value, (tuple, list)):
+                value = (value,)
+            fields.append(name + ''.join(":{:.2f}".format(x) for x in value))
+        return "CMD_TELEMETRY#" + "#".join(fields) + "\n"
+
+    def start(self) -> None:
+        """Start the push thread."""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the push thread."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(1)
+            self.thread = None
+
+    def run(self) -> None:
+        """Push one frame per client per tick with every channel that is due, sleeping until the next one is."""
+        while True:
+            with self.condition:
+                while self.running and not self.subscriptions:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                now = time.monotonic()
+                next_due = min(due for channels in self.subscriptions.values() for _, due in channels.values())
+                if next_due > now:
+                    self.condition.wait(next_due - now)
+                    continue
+                # Collect the due channels of every client, then read and send without holding the condition
+                due = {}
+                for address, channels in self.subscriptions.items():
+                    names = []
+                    for name, schedule in channels.items():
+                        if schedule[1] <= now + self.tick / 2:
+                            names.append((name, schedule[0]))
+                            schedule[1] = max(schedule[1] + schedule[0], now)
+                    if names:
+                        due[address] = names
+            if self.connected is not None:
+                connected = set(self.connected())
+                for address in [x for x in due if x not in connected]:
+                    self.unsubscribe(address)
+                    del due[address]
+            for address, names in due.items():
+                values = []
+                for name, period in names:
+                    try:
+                        values.append((name, self.read(name, period)))  # Clients on the same channel share one reading
+                    except Exception as e:
+                        print("Telemetry read of {} failed: {}".format(name, e))
+                if values:
+                    self.send(address, self.format_frame(values))
+                    self.frames_sent += 1
+
+    def get_stats(self) -> dict:
+        """Get the hardware reads and cache hits of each channel, the subscriber count and the frames pushed."""
+        with self.condition:
+            subscribers = len(self.subscriptions)
+        return {'channels': {name: {'reads': channel['reads'], 'cache_hits': channel['cache_hits']} for name, channel in self.channels.items()},
+                'subscribers': subscribers,
+                'frames_sent': self.frames_sent}
+
+if __name__ == '__main__':
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    frames = []
+    hub = TelemetryHub(lambda address, frame: frames.append((address, frame)))  # Create an instance of the TelemetryHub class
+    hub.add_channel("CMD_SONIC", lambda: 23.5, 0.05)
+    hub.add_channel("CMD_LIGHT", lambda: (1.21, 1.37), 0.02)
+    hub.add_channel("CMD_POWER", lambda: 7.8, 0.5)
+    hub.start()
+    hub.subscribe(('10.0.0.2', 50000), "CMD_SONIC", 0.1)
+    hub.subscribe(('10.0.0.2', 50000), "CMD_LIGHT", 0.1)
+    hub.subscribe(('10.0.0.3', 50001), "CMD_SONIC", 0.1)
+    hub.subscribe(('10.0.0.3', 50001), "CMD_POWER", 0.5)
+    time.sleep(1.0)
+    hub.stop()
+    for address, frame in frames[:4]:
+        print(address, frame.strip())
+    print(hub.get_stats())  # Two clients on CMD_SONIC, but one hardware read per period
+    print(hub.snapshot().strip())  # The cached readings, no hardware access
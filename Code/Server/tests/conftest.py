@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server modules are plain scripts in the directory above, imported by name as the car runs them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
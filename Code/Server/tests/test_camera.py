@@ -0,0 +1,22 @@
+import time
+import unittest
+from camera import sensor_time
+
+class SensorTimeTest(unittest.TestCase):
+    def test_boot_time_to_monotonic(self):
+        now = time.monotonic()
+        boot_us = int(time.clock_gettime(time.CLOCK_BOOTTIME) * 1000000)
+        first_us = boot_us - 1000000
+        captured = sensor_time(first_us, 1000000 - 20000, now)  # Captured 20 ms ago
+        self.assertAlmostEqual(now - captured, 0.02, delta=0.005)
+
+    def test_implausible_times_fall_back_to_now(self):
+        now = time.monotonic()
+        boot_us = int(time.clock_gettime(time.CLOCK_BOOTTIME) * 1000000)
+        self.assertEqual(sensor_time(None, 5, now), now)
+        self.assertEqual(sensor_time(boot_us, None, now), now)
+        self.assertEqual(sensor_time(boot_us, 500000, now), now)     # In the future
+        self.assertEqual(sensor_time(boot_us, -2000000, now), now)   # More than a second old
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+import cv2
+from camera_opencv import ReplayCamera
+
+class SaveVideoTest(unittest.TestCase):
+    def record(self, name, duration=0.5):
+        camera = ReplayCamera(fps=40.0, stream_size=(160, 120))
+        self.addCleanup(camera.close)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        filename = os.path.join(directory.name, name)
+        camera.save_video(filename, duration)
+        self.assertFalse(camera.streaming)  # Recording started the stream, so it stops it again
+        return cv2.VideoCapture(filename)
+
+    def test_records_the_stream(self):
+        video = self.record('video.mp4')
+        self.assertTrue(video.isOpened())
+        self.assertGreater(video.get(cv2.CAP_PROP_FRAME_COUNT), 5)
+        self.assertAlmostEqual(video.get(cv2.CAP_PROP_FPS), 40.0, delta=8.0)  # Plays back at the capture rate
+        ok, image = video.read()
+        self.assertTrue(ok)
+        self.assertEqual(image.shape, (120, 160, 3))
+        video.release()
+
+    def test_avi_as_mjpg(self):
+        video = self.record('video.avi')
+        self.assertEqual(int(video.get(cv2.CAP_PROP_FOURCC)), cv2.VideoWriter_fourcc(*'MJPG'))
+        video.release()
+
+    def test_running_stream_kept(self):
+        camera = ReplayCamera(fps=40.0, stream_size=(160, 120))
+        self.addCleanup(camera.close)
+        camera.start_stream()
+        with tempfile.TemporaryDirectory() as directory:
+            camera.save_video(os.path.join(directory, 'video.mp4'), 0.2)
+        self.assertTrue(camera.streaming)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from command_schema import COMMANDS, COMMANDS_BY_ID, SCHEMA, tag_binary, tag_text
+from message import ParsedCommand, parse_command
+
+class CommandSpecTest(unittest.TestCase):
+    def test_ids_unique(self):
+        self.assertEqual(len(COMMANDS_BY_ID), len(SCHEMA))
+        self.assertEqual(len(COMMANDS), len(SCHEMA))
+
+    def test_binary_round_trip(self):
+        for spec in SCHEMA:
+            args = tuple(high for low, high in spec.ranges)
+            frame = spec.encode_binary(*args)
+            self.assertEqual(spec.decode_binary(frame), args, spec.name)
+            self.assertEqual(parse_command(frame), ParsedCommand(spec.name, args), spec.name)
+            args = tuple(low for low, high in spec.ranges)
+            self.assertEqual(spec.decode_binary(spec.encode_binary(*args)), args, spec.name)
+
+    def test_text_round_trip(self):
+        spec = COMMANDS['CMD_M_MOTOR']
+        line = spec.encode_text(-90, 2000, 270, -4095)
+        self.assertEqual(line, 'CMD_M_MOTOR#-90#2000#270#-4095\n')
+        self.assertEqual(spec.decode_text(line.strip().split('#')[1:]), (-90, 2000, 270, -4095))
+        self.assertEqual(parse_command(line.strip()), ParsedCommand('CMD_M_MOTOR', (-90, 2000, 270, -4095)))
+
+    def test_decode_text_legacy_tokens(self):
+        spec = COMMANDS['CMD_MODE']
+        self.assertEqual(spec.decode_text([b'two']), (1,))
+        self.assertEqual(COMMANDS['CMD_SERVO'].decode_text(['0', ' 89.6 ', '']), (0, 90))
+        self.assertEqual(COMMANDS['CMD_SERVO'].decode_text(['0', 'x']), (0, 0))
+
+    def test_text_to_binary(self):
+        spec = COMMANDS['CMD_SERVO']
+        self.assertEqual(spec.text_to_binary('CMD_SERVO#1#120\n'), spec.encode_binary(1, 120))
+        self.assertIsNone(spec.text_to_binary('CMD_SERVO#1\n'))        # Too few arguments
+        self.assertIsNone(spec.text_to_binary('CMD_SERVO#1#181\n'))    # Out of range
+
+    def test_validate(self):
+        self.assertTrue(COMMANDS['CMD_MOTOR'].validate((4095, -4095, 0, 0)))
+        self.assertFalse(COMMANDS['CMD_MOTOR'].validate((4096, 0, 0, 0)))
+        self.assertFalse(COMMANDS['CMD_MOTOR'].validate((0, 0, 0)))
+        self.assertTrue(COMMANDS['CMD_SONIC'].validate(()))              # min_args=0
+        self.assertFalse(COMMANDS['CMD_SONIC'].validate((2,)))
+
+    def test_wide_arguments(self):
+        # CMD_PING carries microsecond timestamps, so its binary frame needs 64-bit arguments
+        spec = COMMANDS['CMD_PING']
+        args = (5, 1700000000123456, 4, 1700000000000001)
+        self.assertEqual(spec.decode_binary(spec.encode_binary(*args)), args)
+
+class ParseCommandTest(unittest.TestCase):
+    def test_tagged_text(self):
+        command = parse_command(tag_text(17, 'CMD_POWER').encode('utf-8'))
+        self.assertEqual(command, ParsedCommand('CMD_POWER', (), 17))
+        self.assertEqual(command.request_id, 17)
+        self.assertEqual(parse_command(b'CMD_POWER').request_id, None)  # The untagged frame is cached apart
+
+    def test_tagged_binary(self):
+        frame = tag_binary(4294967295, COMMANDS['CMD_SERVO'].encode_binary(2, 45))
+        self.assertEqual(parse_command(frame), ParsedCommand('CMD_SERVO', (2, 45), 4294967295))
+
+    def test_malformed(self):
+        self.assertIsNone(parse_command(b'@x#CMD_POWER'))
+        self.assertIsNone(parse_command(bytes([0xA5, 250, 0, 0])))  # Unknown command id
+        self.assertIsNone(parse_command(COMMANDS['CMD_MOTOR'].encode_binary(1, 2, 3, 4)[:-1]))
+        self.assertIsNone(parse_command(tag_binary(1, b'')))
+
+if __name__ == '__main__':
+    unittest.main()
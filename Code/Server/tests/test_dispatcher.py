@@ -0,0 +1,116 @@
+import threading
+import unittest
+from dispatcher import CommandCoalescer, PriorityDispatcher
+from message import parse_command
+
+class SetpointCoalescingTest(unittest.TestCase):
+    def drain(self, dispatcher):
+        items = []
+        while True:
+            item = dispatcher.get(timeout=0)
+            if item is None:
+                return [(command.command, command.args) for _, command, _, _ in items]
+            items.append(item)
+
+    def test_newest_setpoint_per_actuator(self):
+        dispatcher = PriorityDispatcher()
+        for frame in (b'CMD_M_MOTOR#0#1000#0#0', b'CMD_SERVO#0#80', b'CMD_BUZZER#1', b'CMD_M_MOTOR#0#1500#0#0',
+                      b'CMD_SERVO#1#100', b'CMD_SERVO#0#85', b'CMD_BUZZER#0'):
+            dispatcher.put('client', frame)
+        self.assertEqual(self.drain(dispatcher),
+                         [('CMD_M_MOTOR', (0, 1500, 0, 0)), ('CMD_BUZZER', (1,)), ('CMD_SERVO', (1, 100)),
+                          ('CMD_SERVO', (0, 85)), ('CMD_BUZZER', (0,))])
+        self.assertEqual(dispatcher.get_stats()['coalesced'], 2)
+
+    def test_motor_commands_share_one_actuator(self):
+        dispatcher = PriorityDispatcher()
+        dispatcher.put('client', b'CMD_MOTOR#1#1#1#1')
+        dispatcher.put('client', b'CMD_M_MOTOR#0#1500#0#0')
+        self.assertEqual(self.drain(dispatcher), [('CMD_M_MOTOR', (0, 1500, 0, 0))])
+
+    def test_non_setpoints_kept(self):
+        dispatcher = PriorityDispatcher()
+        for frame in (b'CMD_LED#1#255#0#0', b'CMD_LED#1#0#0#0', b'CMD_POWER', b'CMD_POWER'):
+            dispatcher.put('client', frame)
+        self.assertEqual(len(self.drain(dispatcher)), 4)
+        self.assertEqual(dispatcher.get_stats()['coalesced'], 0)
+
+    def test_actuator_keys(self):
+        coalescer = CommandCoalescer()
+        self.assertEqual(coalescer.actuator_key(parse_command(b'CMD_MOTOR#1#1#1#1')), 'motor')
+        self.assertEqual(coalescer.actuator_key(parse_command(b'CMD_SERVO#1#90')), ('servo', 1))
+        self.assertIsNone(coalescer.actuator_key(parse_command(b'CMD_SERVO')))
+        self.assertIsNone(coalescer.actuator_key(parse_command(b'CMD_BUZZER#1')))
+
+class PriorityDispatcherTest(unittest.TestCase):
+    def drain(self, dispatcher):
+        items = []
+        while True:
+            item = dispatcher.get(timeout=0)
+            if item is None:
+                return items
+            items.append(item)
+
+    def test_served_by_class_priority(self):
+        dispatcher = PriorityDispatcher()
+        for frame in (b'CMD_POWER', b'CMD_LED#1#255#0#0', b'CMD_BUZZER#1', b'CMD_M_MOTOR#0#1500#0#0', b'CMD_SONIC#1', b'CMD_LED#2#0#255#0'):
+            dispatcher.put('client', frame)
+        items = self.drain(dispatcher)
+        self.assertEqual([(command.command, class_name) for _, command, class_name, _ in items],
+                         [('CMD_M_MOTOR', 'motion'), ('CMD_BUZZER', 'actuator'), ('CMD_LED', 'led'), ('CMD_LED', 'led'),
+                          ('CMD_POWER', 'telemetry'), ('CMD_SONIC', 'telemetry')])
+        self.assertEqual(items[2][1].args[0], 1)  # FIFO within a class
+
+    def test_stop_drops_queued_motion(self):
+        dropped = []
+        dispatcher = PriorityDispatcher(on_drop=lambda address, command: dropped.append(command))
+        dispatcher.put('client', b'CMD_M_MOTOR#0#1500#0#0')
+        dispatcher.put('client', b'CMD_CAR_ROTATE#0#1500#0#1500')
+        dispatcher.put('client', b'CMD_LED#1#255#0#0')
+        dispatcher.put('client', b'CMD_MOTOR#0#0#0#0')
+        items = self.drain(dispatcher)
+        self.assertEqual([(command.command, class_name) for _, command, class_name, _ in items],
+                         [('CMD_MOTOR', 'stop'), ('CMD_LED', 'led')])
+        self.assertEqual([command.command for command in dropped], ['CMD_M_MOTOR', 'CMD_CAR_ROTATE'])
+
+    def test_mode_zero_is_a_stop(self):
+        dispatcher = PriorityDispatcher()
+        self.assertEqual(dispatcher.classify(parse_command(b'CMD_MODE#0')), 'stop')
+        self.assertEqual(dispatcher.classify(parse_command(b'CMD_MODE#two')), 'motion')
+        self.assertEqual(dispatcher.classify(parse_command(b'CMD_M_MOTOR#90#0#270#0')), 'stop')
+        self.assertEqual(dispatcher.classify(parse_command(b'CMD_UNKNOWN#1')), PriorityDispatcher.DEFAULT_CLASS)
+
+    def test_newer_setpoint_replaces_queued(self):
+        dropped = []
+        dispatcher = PriorityDispatcher(on_drop=lambda address, command: dropped.append(command))
+        dispatcher.put('a', b'@1#CMD_SERVO#0#80')
+        dispatcher.put('b', b'CMD_SERVO#1#100')
+        dispatcher.put('a', b'@2#CMD_SERVO#0#85')
+        items = self.drain(dispatcher)
+        self.assertEqual([(address, command.args) for address, command, _, _ in items], [('b', (1, 100)), ('a', (0, 85))])
+        self.assertEqual([command.request_id for command in dropped], [1])
+        self.assertEqual(dispatcher.get_stats()['coalesced'], 1)
+        dispatcher.put('a', b'CMD_SERVO#0#90')  # The served setpoint is gone from the table, so nothing is dropped
+        self.assertEqual(len(self.drain(dispatcher)), 1)
+        self.assertEqual(len(dropped), 1)
+
+    def test_invalid_frames_counted(self):
+        dispatcher = PriorityDispatcher()
+        dispatcher.put('client', b'@x#CMD_POWER')
+        self.assertIsNone(dispatcher.get(timeout=0))
+        self.assertEqual(dispatcher.get_stats()['invalid'], 1)
+
+    def test_close_releases_waiting_thread(self):
+        dispatcher = PriorityDispatcher()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(dispatcher.get()))
+        thread.start()
+        dispatcher.close()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [None])
+        dispatcher.put('client', b'CMD_POWER')  # Ignored once closed
+        self.assertIsNone(dispatcher.get(timeout=0))
+
+if __name__ == '__main__':
+    unittest.main()
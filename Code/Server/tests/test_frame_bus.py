@@ -0,0 +1,69 @@
+import threading
+import unittest
+from frame_bus import FrameBus
+
+class FrameBusTest(unittest.TestCase):
+    def test_in_order_consumer_counts_frames_lost_from_ring(self):
+        bus = FrameBus(size=4)
+        consumer = bus.consumer('recorder')
+        for i in range(1, 11):
+            bus.publish(b'%d' % i, timestamp=float(i))
+        frames = []
+        while True:
+            frame = consumer.next(timeout=0)
+            if frame is None:
+                break
+            frames.append(frame.seq)
+        self.assertEqual(frames, [7, 8, 9, 10])  # Only the last 4 frames are still in the ring
+        self.assertEqual(consumer.get_stats(), {'seq': 10, 'received': 4, 'dropped': 6})
+
+    def test_newest_consumer_skips_backlog(self):
+        bus = FrameBus(size=4)
+        consumer = bus.consumer('video')
+        bus.publish(b'1')
+        self.assertEqual(consumer.newest(timeout=0).seq, 1)
+        for i in range(2, 5):
+            bus.publish(b'%d' % i)
+        frame = consumer.newest(timeout=0)
+        self.assertEqual((frame.seq, frame.data), (4, b'4'))
+        self.assertEqual(consumer.get_stats(), {'seq': 4, 'received': 2, 'dropped': 2})
+        self.assertIsNone(consumer.newest(timeout=0))
+
+    def test_consumers_share_frames(self):
+        bus = FrameBus()
+        first, second = bus.consumer('a'), bus.consumer('b')
+        self.assertIs(bus.consumer('a'), first)
+        data = bytearray(b'jpeg')
+        bus.write(data)
+        self.assertIs(first.next(timeout=0).data, second.next(timeout=0).data)  # The same bytes, never a copy
+        self.assertEqual(bus.get_stats()['frames'], 1)
+
+    def test_consumer_starts_at_current_frame(self):
+        bus = FrameBus()
+        bus.publish(b'old')
+        consumer = bus.consumer('late')
+        self.assertIsNone(consumer.next(timeout=0))
+        self.assertEqual(consumer.get_stats()['dropped'], 0)
+
+    def test_stamps(self):
+        bus = FrameBus(clock=lambda: 5.0)
+        self.assertEqual(bus.publish(b'x').timestamp, 5.0)
+        frame = bus.publish(b'y', timestamp=4.5)
+        self.assertEqual((frame.timestamp, frame.published), (4.5, 5.0))
+
+    def test_close_releases_waiting_consumer(self):
+        bus = FrameBus()
+        consumer = bus.consumer('vision')
+        results = []
+        thread = threading.Thread(target=lambda: results.append(consumer.next()))
+        thread.start()
+        bus.close()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [None])
+        bus.reset()
+        bus.publish(b'again')
+        self.assertEqual(consumer.next(timeout=0).seq, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from multiprocessing import shared_memory
+import numpy as np
+from frame_ring import ALIGN, RESULT, RESULT_OFFSET, RING_HEADER, SLOT_HEADER, SLOTS_OFFSET, SharedFrameRing
+
+class SharedFrameRingTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = SharedFrameRing(size=(40, 30), slots=4)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def frame(self, value):
+        return np.full((30, 40), value, dtype=np.uint8)
+
+    def test_layout(self):
+        self.assertLessEqual(RING_HEADER.size, RESULT_OFFSET)
+        self.assertLessEqual(RESULT_OFFSET + RESULT.size, SLOTS_OFFSET)
+        self.assertEqual(SLOTS_OFFSET % ALIGN, 0)
+        self.assertEqual(self.ring.slot_size % ALIGN, 0)
+        self.assertGreaterEqual(self.ring.slot_size, SLOT_HEADER.size + 40 * 30)
+        self.assertGreaterEqual(self.ring.shm.size, SLOTS_OFFSET + 4 * self.ring.slot_size)
+
+    def test_result_does_not_touch_slot_zero(self):
+        seq = 0
+        for value in range(1, 5):
+            seq = self.ring.publish(self.frame(value), timestamp=float(value))
+        self.assertEqual(seq % self.ring.slots, 0)  # Frame 4 is in the first slot, right after the result record
+        self.ring.publish_result(seq, 4.0, 4.5, 91.5, 0.75, 10, 2)
+        view, captured = self.ring.read(seq)
+        self.assertTrue((view == 4).all())
+        self.assertEqual(captured, 4.0)
+        self.assertTrue(self.ring.valid(seq))
+        result = self.ring.result()
+        self.assertEqual((result.seq, result.captured, result.started, result.angle, result.confidence, result.processed, result.torn),
+                         (4, 4.0, 4.5, 91.5, 0.75, 10, 2))
+        self.ring.publish(self.frame(5))
+        self.assertEqual(self.ring.result(), result)  # Writing a frame leaves the result alone too
+
+    def test_overwritten_frame_is_torn(self):
+        seq = self.ring.publish(self.frame(1))
+        view, _ = self.ring.read(seq)
+        for value in range(2, 6):
+            self.ring.publish(self.frame(value))
+        self.assertFalse(self.ring.valid(seq))
+        self.assertTrue((view == 5).all())  # The view now shows frame 5, which valid() caught
+        self.assertIsNone(self.ring.read(seq))
+
+    def test_attach_by_name(self):
+        self.assertIsNone(self.ring.result())
+        reader = SharedFrameRing(self.ring.name)
+        try:
+            self.assertEqual((reader.size, reader.slots), ((40, 30), 4))
+            self.assertIsNone(reader.wait(timeout=0))
+            seq = self.ring.publish(self.frame(7), timestamp=1.5)
+            self.assertEqual(reader.wait(timeout=1.0), seq)
+            view, captured = reader.read(seq)
+            self.assertTrue((view == 7).all())
+            self.assertEqual(captured, 1.5)
+            del view
+            self.assertIsNone(reader.wait(timeout=0))  # The frame read is not handed back again
+            reader.publish_result(seq, 1.5, 1.6, 90.0, 1.0, 1, 0)
+            self.assertEqual(self.ring.result().seq, seq)
+        finally:
+            reader.close()
+
+    def test_rejects_other_segment(self):
+        shm = shared_memory.SharedMemory(create=True, size=256)
+        try:
+            with self.assertRaises(ValueError):
+                SharedFrameRing(shm.name)
+        finally:
+            shm.close()
+            shm.unlink()
+
+if __name__ == '__main__':
+    unittest.main()
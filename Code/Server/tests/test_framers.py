@@ -0,0 +1,62 @@
+import unittest
+from command_schema import COMMANDS, tag_binary, tag_text
+from message import CommandFramer
+from tcp_server import DelimiterFramer, LengthPrefixFramer
+
+class DelimiterFramerTest(unittest.TestCase):
+    def test_keeps_partial_frame(self):
+        buffer = bytearray(b'CMD_POWER\n\nCMD_SONIC#1\nCMD_LI')
+        frames, consumed = DelimiterFramer().split(buffer, len(buffer))
+        self.assertEqual(frames, [b'CMD_POWER', b'CMD_SONIC#1'])  # Empty lines are skipped
+        self.assertEqual(bytes(buffer[consumed:]), b'CMD_LI')
+
+    def test_stops_at_end(self):
+        buffer = bytearray(b'CMD_POWER\nCMD_SONIC#1\n')
+        frames, consumed = DelimiterFramer().split(buffer, 10)
+        self.assertEqual(frames, [b'CMD_POWER'])
+        self.assertEqual(consumed, 10)
+
+class LengthPrefixFramerTest(unittest.TestCase):
+    def test_split_across_reads(self):
+        data = b'\x03\x00\x00\x00abc\x00\x00\x00\x00\x05\x00\x00\x00hel'
+        frames, consumed = LengthPrefixFramer().split(data, len(data))
+        self.assertEqual(frames, [b'abc', b''])
+        self.assertEqual(data[consumed:], b'\x05\x00\x00\x00hel')
+        rest = data[consumed:] + b'lo'
+        self.assertEqual(LengthPrefixFramer().split(rest, len(rest)), ([b'hello'], len(rest)))
+
+    def test_incomplete_header(self):
+        self.assertEqual(LengthPrefixFramer().split(b'\x03\x00', 2), ([], 0))
+
+class CommandFramerTest(unittest.TestCase):
+    def test_mixed_text_and_binary(self):
+        motor = COMMANDS['CMD_MOTOR'].encode_binary(1000, -1000, 0, 4095)
+        servo = tag_binary(7, COMMANDS['CMD_SERVO'].encode_binary(0, 90))
+        buffer = bytearray(b'CMD_POWER\r\n' + motor + tag_text(3, 'CMD_SONIC#1\n').encode('utf-8') + servo)
+        frames, consumed = CommandFramer().split(buffer, len(buffer))
+        self.assertEqual(frames, [b'CMD_POWER', motor, b'@3#CMD_SONIC#1', servo])
+        self.assertEqual(consumed, len(buffer))
+
+    def test_waits_for_whole_binary_frame(self):
+        motor = COMMANDS['CMD_MOTOR'].encode_binary(1, 2, 3, 4)
+        framer = CommandFramer()
+        for end in range(len(motor)):
+            self.assertEqual(framer.split(motor, end), ([], 0))
+        tagged = tag_binary(1, motor)
+        self.assertEqual(framer.split(tagged, len(tagged) - 1), ([], 0))
+        self.assertEqual(framer.split(tagged, len(tagged)), ([tagged], len(tagged)))
+
+    def test_every_split_point(self):
+        # However the stream is cut into reads, the same frames come out in the same order
+        stream = b'CMD_LED#1#255#0#0\n' + COMMANDS['CMD_M_MOTOR'].encode_binary(90, 2000, 90, 2000) + b'CMD_POWER\n'
+        framer = CommandFramer()
+        expected, _ = framer.split(stream, len(stream))
+        for cut in range(len(stream) + 1):
+            first, consumed = framer.split(stream, cut)
+            rest = stream[consumed:]
+            second, rest_consumed = framer.split(rest, len(rest))
+            self.assertEqual(first + second, expected)
+            self.assertEqual(consumed + rest_consumed, len(stream))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import queue
+import tempfile
+import unittest
+import numpy as np
+from frame_ring import SharedFrameRing
+from local_control import LocalCar, LocalControlServer, is_local_address
+from telemetry import TelemetryHub
+
+class LocalControlTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'car.sock')
+        self.commands = queue.Queue()
+        self.disconnected = queue.Queue()
+        self.hub = TelemetryHub(lambda address, frame: None)
+        self.hub.add_channel('CMD_SONIC', lambda: 23.5)
+        self.hub.add_channel('CMD_LIGHT', lambda: (1.21, 1.37))
+        self.ring = None
+        self.server = LocalControlServer(lambda address, command: self.commands.put((address, command)), self.hub.snapshot,
+                                         self.path, on_disconnect=self.disconnected.put, vision=self.vision)
+        self.server.start()
+        self.car = LocalCar(self.path)
+
+    def tearDown(self):
+        self.car.sock.close()
+        self.server.stop()
+        if self.ring is not None:
+            self.ring.close()
+        self.directory.cleanup()
+
+    def vision(self, address, state):
+        # Stands in for the server feeding its camera into a ring
+        if state and self.ring is None:
+            self.ring = SharedFrameRing(size=(8, 6), slots=2)
+        elif not state and self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        return self.ring.name if self.ring is not None else None
+
+    def received(self, count):
+        return [self.commands.get(timeout=1.0) for _ in range(count)]
+
+    def test_binary_setpoints_round_trip(self):
+        # Little-endian duties whose last byte is 0x09 to 0x0D (whitespace) or 0x0A (newline) included
+        duties = (1000, 2000, 2304, 2560, 3000, 3583, 4000, 4095, -4095, -2551)
+        for duty in duties:
+            self.car.set_motor_model(duty, 0, -duty, duty)
+        for angle in (9, 10, 13, 32, 180):
+            self.car.set_servo_pwm(1, angle)
+        items = self.received(len(duties) + 5)
+        self.assertEqual([command.args for _, command in items[:len(duties)]], [(duty, 0, -duty, duty) for duty in duties])
+        self.assertEqual([command.args for _, command in items[len(duties):]], [(1, angle) for angle in (9, 10, 13, 32, 180)])
+        self.assertTrue(all(is_local_address(address) for address, _ in items))
+        self.assertEqual(self.server.get_stats()['invalid'], 0)
+
+    def test_out_of_range_sent_as_text(self):
+        self.car.set_servo_pwm(0, 200)  # Does not fit the schema, so it goes as a text line
+        address, command = self.commands.get(timeout=1.0)
+        self.assertEqual((command.command, command.args), ('CMD_SERVO', (0, 200)))
+
+    def test_snapshot(self):
+        self.assertEqual(self.car.snapshot(), {'CMD_SONIC': (23.5,), 'CMD_LIGHT': (1.21, 1.37)})
+        self.assertEqual(self.car.snapshot(max_age_ms=0), {'CMD_SONIC': (23.5,), 'CMD_LIGHT': (1.21, 1.37)})
+        self.assertEqual(self.server.get_stats()['snapshots'], 2)
+        self.assertTrue(self.commands.empty())  # Answered on the server thread, never delivered
+
+    def test_vision_ring(self):
+        name = self.car.vision_ring()
+        self.assertEqual(name, self.ring.name)
+        ring = SharedFrameRing(name, track=False)
+        try:
+            seq = self.ring.publish(np.full((6, 8), 42, dtype=np.uint8))
+            view, _ = ring.read(seq)
+            self.assertTrue((view == 42).all())
+            del view
+        finally:
+            ring.close()
+        self.assertIsNone(self.car.vision_ring(0))
+        self.assertTrue(self.commands.empty())
+
+    def test_close_stops_then_disconnects(self):
+        self.car.close()
+        address, command = self.commands.get(timeout=1.0)
+        self.assertEqual((command.command, command.args), ('CMD_MOTOR', (0, 0, 0, 0)))
+        self.assertEqual(self.disconnected.get(timeout=1.0), address)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import time
+import unittest
+from command_schema import ACK_OK, ACK_UNKNOWN, ACK_REJECTED, ACK_FAILED, COMMANDS
+from registry import CommandRegistry
+
+class CommandRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.registry = CommandRegistry()
+        self.registry.register_command(COMMANDS['CMD_SERVO'], lambda address, args: self.calls.append((address, list(args))))
+
+    def test_arity_rejected(self):
+        self.assertEqual(self.registry.dispatch_status('CMD_SERVO', [0]), (ACK_REJECTED, 0.0))
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.registry.get_stats()['CMD_SERVO']['rejected'], 1)
+
+    def test_range_rejected(self):
+        self.assertEqual(self.registry.dispatch_status('CMD_SERVO', [0, 181])[0], ACK_REJECTED)
+        self.assertEqual(self.registry.dispatch_status('CMD_SERVO', [8, 90])[0], ACK_REJECTED)
+        self.assertEqual(self.registry.dispatch_status('CMD_SERVO', [0, -1])[0], ACK_REJECTED)
+        self.assertEqual(self.calls, [])
+        stats = self.registry.get_stats()['CMD_SERVO']
+        self.assertEqual((stats['calls'], stats['rejected']), (0, 3))
+
+    def test_extra_args_trimmed(self):
+        self.assertEqual(self.registry.dispatch_status('CMD_SERVO', [1, 90, 5], 'client')[0], ACK_OK)
+        self.assertEqual(self.calls, [('client', [1, 90])])
+
+    def test_unknown(self):
+        self.assertEqual(self.registry.dispatch_status('CMD_NOPE', [1]), (ACK_UNKNOWN, 0.0))
+        self.assertFalse(self.registry.dispatch('CMD_NOPE', []))
+        self.assertEqual(self.registry.unknown, 2)
+        self.assertNotIn('CMD_NOPE', self.registry.get_stats())
+
+    def test_handler_failure(self):
+        def fail(address, args):
+            raise ValueError('broken')
+        self.registry.register('CMD_BUZZER', fail, min_args=1, max_args=1)
+        status, elapsed = self.registry.dispatch_status('CMD_BUZZER', [1])
+        self.assertEqual(status, ACK_FAILED)
+        self.assertGreaterEqual(elapsed, 0.0)
+        stats = self.registry.get_stats()['CMD_BUZZER']
+        self.assertEqual((stats['calls'], stats['errors'], stats['count']), (1, 1, 1))  # A failed call is still timed
+
+    def test_unregister(self):
+        self.registry.unregister('CMD_SERVO')
+        self.assertEqual(self.registry.dispatch_status('CMD_SERVO', [0, 90])[0], ACK_UNKNOWN)
+
+    def test_timing_per_handler(self):
+        self.registry.register('CMD_BUZZER', lambda address, args: time.sleep(0.005), min_args=1, max_args=1)
+        for _ in range(3):
+            status, elapsed = self.registry.dispatch_status('CMD_BUZZER', [1])
+            self.assertEqual(status, ACK_OK)
+            self.assertGreaterEqual(elapsed, 0.005)
+        self.assertTrue(self.registry.dispatch('CMD_SERVO', [0, 90]))
+        stats = self.registry.get_stats()
+        self.assertEqual((stats['CMD_BUZZER']['calls'], stats['CMD_BUZZER']['count']), (3, 3))
+        self.assertGreaterEqual(stats['CMD_BUZZER']['mean_ms'], 5.0)
+        self.assertGreaterEqual(stats['CMD_BUZZER']['max_ms'], stats['CMD_BUZZER']['p50_ms'])
+        self.assertEqual((stats['CMD_SERVO']['calls'], stats['CMD_SERVO']['count']), (1, 1))
+        self.assertLess(stats['CMD_SERVO']['max_ms'], stats['CMD_BUZZER']['mean_ms'])  # Each handler keeps its own histogram
+
+    def test_benchmark(self):
+        stats = self.registry.benchmark('CMD_SERVO', [0, 90], 50)
+        self.assertEqual((stats['calls'], stats['count']), (50, 50))
+
+if __name__ == '__main__':
+    unittest.main()
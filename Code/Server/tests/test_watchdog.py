@@ -0,0 +1,258 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+from command_schema import COMMANDS, HEARTBEAT_INTERVAL, HEARTBEAT_MS, WATCHDOG_TIMEOUT
+from dispatcher import PriorityDispatcher
+from message import CommandFramer, parse_command
+from parameter import ParameterManager
+from tcp_server import TCPServer
+from watchdog import Watchdog
+
+TIMEOUT = 0.05  # Short, so the tests stay quick
+MARGIN = 0.2    # Scheduling slack for a loaded test machine; the car's budget is checked against its own timeout
+
+class WatchdogTest(unittest.TestCase):
+    def setUp(self):
+        self.expired = []
+        self.fired = threading.Event()
+        self.watchdog = Watchdog(TIMEOUT, self.on_expire)
+        self.watchdog.start()
+
+    def tearDown(self):
+        self.watchdog.stop()
+
+    def on_expire(self, silence):
+        self.expired.append((time.monotonic(), silence))
+        self.fired.set()
+
+    def test_fires_once_after_timeout(self):
+        armed_at = time.monotonic()
+        self.watchdog.arm()
+        self.assertTrue(self.fired.wait(TIMEOUT + MARGIN))
+        fired_at, silence = self.expired[0]
+        self.assertGreaterEqual(fired_at - armed_at, TIMEOUT)
+        self.assertLess(fired_at - armed_at, TIMEOUT + MARGIN)
+        self.assertGreaterEqual(silence, TIMEOUT)
+        time.sleep(3 * TIMEOUT)
+        self.assertEqual(len(self.expired), 1)  # Disarmed after firing until armed again
+        stats = self.watchdog.get_stats()
+        self.assertFalse(stats['armed'])
+        self.assertEqual(stats['expirations'], 1)
+
+    def test_feeding_keeps_it_quiet(self):
+        self.watchdog.arm()
+        end = time.monotonic() + 4 * TIMEOUT
+        while time.monotonic() < end:
+            self.watchdog.feed()
+            time.sleep(TIMEOUT / 5)
+        self.assertEqual(self.expired, [])
+        fed_at = time.monotonic()
+        self.assertTrue(self.fired.wait(TIMEOUT + MARGIN))
+        self.assertLess(self.expired[0][0] - fed_at, TIMEOUT + MARGIN)
+        self.assertGreater(self.watchdog.get_stats()['feeds'], 0)
+
+    def test_only_the_armed_client_feeds(self):
+        self.watchdog.arm('driver')
+        end = time.monotonic() + 3 * TIMEOUT
+        while time.monotonic() < end and not self.fired.is_set():
+            self.watchdog.feed('viewer')     # Another client, a UDP sender or a local program
+            self.watchdog.feed(None)
+            time.sleep(TIMEOUT / 5)
+        self.assertTrue(self.fired.is_set())
+        self.assertFalse(self.watchdog.is_armed('driver'))
+        self.assertEqual(self.watchdog.get_stats()['feeds'], 0)
+
+    def test_each_client_has_its_own_deadline(self):
+        self.watchdog.arm('first')
+        self.watchdog.arm('second')
+        end = time.monotonic() + 3 * TIMEOUT
+        while time.monotonic() < end and not self.fired.is_set():
+            self.watchdog.feed('first')
+            time.sleep(TIMEOUT / 5)
+        self.assertTrue(self.fired.is_set())  # The silent second client still stops the car
+        self.assertTrue(self.watchdog.is_armed('first'))
+        self.assertFalse(self.watchdog.is_armed('second'))
+        self.watchdog.disarm('first')
+        self.assertFalse(self.watchdog.armed)
+        self.watchdog.arm('first')
+        self.watchdog.arm('second')
+        self.watchdog.disarm_all()
+        self.assertEqual(self.watchdog.get_stats()['clients'], 0)
+
+    def test_not_armed_or_disarmed(self):
+        self.watchdog.feed()
+        self.assertFalse(self.fired.wait(3 * TIMEOUT))
+        self.watchdog.arm()
+        self.watchdog.disarm()
+        self.assertFalse(self.fired.wait(3 * TIMEOUT))
+        self.assertEqual(self.watchdog.get_stats()['feeds'], 0)  # Feeds while disarmed do not count
+
+    def test_failing_action_keeps_thread(self):
+        calls = []
+        def on_expire(silence):
+            calls.append(silence)
+            if len(calls) == 1:
+                raise OSError("I2C write failed")
+            self.fired.set()
+        self.watchdog.on_expire = on_expire
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.watchdog.arm()
+            time.sleep(TIMEOUT + MARGIN)
+            self.watchdog.arm()
+            self.assertTrue(self.fired.wait(TIMEOUT + MARGIN))
+        self.assertEqual(len(calls), 2)
+        self.assertIn("I2C write failed", output.getvalue())
+
+class SilentClientTest(unittest.TestCase):
+    """
+    The command port wired as main.py wires it: every valid command feeds its own client's deadline, a ping from a
+    heartbeat client arms it, a disconnect or an expiry queues CMD_MODE#0 on the dispatcher, and the dispatch thread
+    zeroes the motors. The cut-off is measured from the client's last message to the motors being zeroed.
+    """
+    HEARTBEAT = 0.02
+    TIMEOUT = 4 * HEARTBEAT  # 80 ms: the sub-100 ms cut, with a spare heartbeat for a loaded test machine
+
+    def setUp(self):
+        self.stopped_at = None
+        self.stopped = threading.Event()
+        self.dispatcher = PriorityDispatcher()
+        self.deadman_command = parse_command(b'CMD_MODE#0')
+        self.watchdog = Watchdog(self.TIMEOUT, lambda silence: self.deadman_stop())
+        self.watchdog.start()
+        self.server = TCPServer(framer=CommandFramer(), max_frame_size=4096, dead_peer_timeout=2.0)
+        self.server.on_disconnect = lambda address: self.deadman_stop()
+        self.server.start('127.0.0.1', 0, max_clients=2, listen_count=2)
+        self.running = True
+        self.threads = [threading.Thread(target=self.receive, daemon=True), threading.Thread(target=self.dispatch, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        self.clients = []
+
+    def tearDown(self):
+        self.running = False
+        self.watchdog.stop()
+        self.dispatcher.close()
+        for client in self.clients:
+            client.close()
+        self.server.close()
+        for thread in self.threads:
+            thread.join(1)
+
+    def deadman_stop(self):
+        self.watchdog.disarm_all()
+        self.dispatcher.put_command(('deadman', 0), self.deadman_command)
+
+    def receive(self):
+        while self.running:
+            try:
+                address, frame = self.server.message_queue.get(timeout=0.05)
+            except Exception:
+                continue
+            command = parse_command(frame)
+            if command is None:
+                continue
+            self.watchdog.feed(address)
+            if command.command == 'CMD_PING':
+                if not self.watchdog.is_armed(address):
+                    self.watchdog.arm(address)
+            else:
+                self.dispatcher.put_command(address, command)
+
+    def dispatch(self):
+        while True:
+            item = self.dispatcher.get()
+            if item is None:
+                return
+            command = item[1]
+            if command.command == 'CMD_MODE' and command.args == (0,) and self.stopped_at is None:
+                self.stopped_at = time.monotonic()
+                self.stopped.set()
+
+    def connect(self):
+        client = socket.create_connection(self.server.server_socket.getsockname())
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.clients.append(client)
+        return client
+
+    def drive(self, client, heartbeats=5, other=None):
+        """Drive with heartbeats, return when the last one was sent."""
+        client.sendall(COMMANDS['CMD_MOTOR'].encode_text(1500, 1500, 1500, 1500).encode('utf-8'))
+        for seq in range(1, heartbeats + 1):
+            client.sendall(COMMANDS['CMD_PING'].encode_text(seq, 0, 0, 0).encode('utf-8'))
+            last_sent = time.monotonic()
+            time.sleep(self.HEARTBEAT)
+        self.assertIsNone(self.stopped_at)  # Heartbeats on time never stop the car
+        return last_sent
+
+    def test_silent_client_stopped_within_timeout(self):
+        client = self.connect()
+        last_sent = self.drive(client)
+        self.assertTrue(self.stopped.wait(self.TIMEOUT + MARGIN))
+        self.assertGreaterEqual(self.stopped_at - last_sent, self.TIMEOUT - self.HEARTBEAT)
+        self.assertLess(self.stopped_at - last_sent, self.TIMEOUT + MARGIN)
+
+    def test_other_client_does_not_keep_silent_driver_alive(self):
+        driver, viewer = self.connect(), self.connect()
+        last_sent = self.drive(driver)
+        end = time.monotonic() + self.TIMEOUT + MARGIN
+        while time.monotonic() < end and not self.stopped.is_set():
+            viewer.sendall(b'CMD_POWER\n')  # Traffic from another client, as a telemetry poller sends
+            time.sleep(self.HEARTBEAT / 2)
+        self.assertTrue(self.stopped.is_set())
+        self.assertLess(self.stopped_at - last_sent, self.TIMEOUT + MARGIN)
+
+    def test_reset_client_stopped_at_once(self):
+        client = self.connect()
+        self.drive(client)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        closed_at = time.monotonic()
+        client.close()
+        self.clients.remove(client)
+        self.assertTrue(self.stopped.wait(MARGIN))
+        self.assertLess(self.stopped_at - closed_at, self.TIMEOUT)  # The disconnect, not the watchdog
+
+class WatchdogSettingsTest(unittest.TestCase):
+    def test_default_allows_lost_heartbeats(self):
+        # main.py never uses less than 3 heartbeats either, so a couple of late pings cannot stop the car
+        self.assertGreaterEqual(WATCHDOG_TIMEOUT, 3 * HEARTBEAT_INTERVAL)
+
+    def test_sub_100ms_cut_reachable(self):
+        # The shortest heartbeat a server may ask for keeps 3 heartbeats well under 100 ms
+        self.assertLess(3 * HEARTBEAT_MS[0] / 1000.0, 0.1)
+        spec = COMMANDS['CMD_PROTOCOL']
+        self.assertEqual(spec.encode_text(8, 20), 'CMD_PROTOCOL#8#20\n')
+        self.assertTrue(spec.validate((8, 20)))
+        self.assertEqual(spec.encode_text(8), 'CMD_PROTOCOL#8\n')
+        self.assertTrue(spec.validate((8,)))  # Clients still send the version alone
+
+    def test_timeout_setting(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                params = {'Connect_Version': 2, 'Pcb_Version': 2, 'Pi_Version': 2}
+                with open(ParameterManager.PARAM_FILE, 'w') as file:
+                    json.dump(params, file)
+                manager = ParameterManager()
+                self.assertEqual(manager.get_watchdog_timeout(0.5), 0.5)
+                self.assertEqual(manager.get_heartbeat_interval(0.1), 0.1)
+                for value, expected in ((60, 0.06), (0, 0.5), ('300', 0.5), (True, 0.5)):
+                    params['Watchdog_Timeout_Ms'] = value
+                    params['Heartbeat_Interval_Ms'] = value
+                    with open(ParameterManager.PARAM_FILE, 'w') as file:
+                        json.dump(params, file)
+                    self.assertEqual(manager.get_watchdog_timeout(0.5), expected, value)
+                    self.assertEqual(manager.get_heartbeat_interval(0.5), expected, value)
+            finally:
+                os.chdir(cwd)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+import random     # Import random for the lossy relays of the benchmark
+import socket     # Import socket for the datagram socket
+import threading  # Import threading for the receive thread
+import time       # Import time for the send timestamps and the benchmark
+from command_schema import UDP_MAGIC, UDP_HEADER, UDP_COMMANDS, UDP_PORT  # Import the UDP datagram layout
+from message import parse_command  # Import the thread-safe command parser
+from dispatcher import CommandCoalescer  # Import the actuator keys used for last-writer-wins
+from stats import LatencyHistogram  # Import the latency histogram of datagram transit times
+
+SEQ_MODULO = 1 << 32  # Sequence numbers are 32 bits and wrap around
+
+def seq_newer(seq: int, last: int) -> bool:
+    """Check whether seq comes after last, allowing for wrap-around (serial number arithmetic)."""
+    return 0 < (seq - last) % SEQ_MODULO < SEQ_MODULO // 2
+
+def encode_datagram(seq: int, frame: bytes, timestamp_us: int = None) -> bytes:
+    """Wrap one command frame in the UDP control header."""
+    if timestamp_us is None:
+        timestamp_us = int(time.time() * 1000000)
+    return UDP_HEADER.pack(UDP_MAGIC, seq % SEQ_MODULO, timestamp_us) + frame
+
+class UdpControlServer:
+    def __init__(self, deliver, allowed=None, commands: tuple = UDP_COMMANDS, to_local=None):
+        """
+        Initialize the UdpControlServer class, a datagram port for idempotent setpoint commands.
+        Parameters:
+        deliver (callable): Called as deliver(address, ParsedCommand) for each accepted setpoint, e.g. PriorityDispatcher.put_command.
+        allowed (callable): Returns the IPs allowed to send, e.g. those with a TCP command connection; None allows all.
+        commands (tuple): Command names accepted over UDP; anything else must use TCP.
+        to_local (callable): Called as to_local(ip, timestamp_us) to move a send time to the local clock, e.g. LinkMonitor.to_local.
+        """
+        self.deliver = deliver
+        self.allowed = allowed
+        self.commands = set(commands)
+        self.to_local = to_local
+        self.coalescer = CommandCoalescer()
+        self.server_socket = None
+        self.thread = None
+        self.running = False
+        self.last_seq = {}        # Newest sequence number per (sender address, actuator)
+        self.received = 0         # Datagrams received
+        self.accepted = 0         # Setpoints handed to deliver()
+        self.stale = 0            # Datagrams older than one already applied to the same actuator
+        self.rejected = 0         # Datagrams from senders that are not allowed, with commands that are not setpoints or with a request id
+        self.malformed = 0        # Datagrams with a bad header or command
+        self.transit = LatencyHistogram()  # Receive time minus send time; meaningful when both clocks agree or to_local corrects them
+
+    def start(self, ip: str, port: int = UDP_PORT) -> None:
+        """Bind the datagram socket and start the receive thread."""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((ip, port))
+        self.server_socket.settimeout(0.5)  # Lets the thread notice stop()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print(f"UDP control listening on {ip}:{self.server_socket.getsockname()[1]}")
+
+    def stop(self) -> None:
+        """Stop the receive thread and close the socket."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1)
+            self.thread = None
+        if self.server_socket is not None:
+            self.server_socket.close()
+            self.server_socket = None
+
+    def run(self) -> None:
+        """Receive datagrams until stopped."""
+        while self.running:
+            try:
+                data, address = self.server_socket.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.handle(data, address)
+
+    def handle(self, data: bytes, address) -> bool:
+        """Check one datagram and deliver its setpoint if it is the newest for its actuator."""
+        self.received += 1
+        if len(data) <= UDP_HEADER.size:
+            self.malformed += 1
+            return False
+        magic, seq, timestamp_us = UDP_HEADER.unpack_from(data)
+        if magic != UDP_MAGIC:
+            self.malformed += 1
+            return False
+        if self.allowed is not None and address[0] not in self.allowed():
+            self.rejected += 1
+            return False
+        command = parse_command(data[UDP_HEADER.size:])
+        if command is None:
+            self.malformed += 1
+            return False
+        if command.command not in self.commands or command.request_id is not None:
+            self.rejected += 1  # Tagged requests are acknowledged on the TCP connection, so they must use it
+            return False
+        slot = (address, self.coalescer.actuator_key(command))
+        last = self.last_seq.get(slot)
+        if last is not None and not seq_newer(seq, last):
+            self.stale += 1  # Reordered or duplicated: a newer setpoint for this actuator has already been applied
+            return False
+        self.last_seq[slot] = seq
+        if self.to_local is not None:
+            timestamp_us = self.to_local(address[0], timestamp_us)
+        self.transit.record(max(0.0, time.time() - timestamp_us / 1000000.0))
+        self.accepted += 1
+        self.deliver(address, command)
+        return True
+
+    def forget(self, ip: str) -> None:
+        """Forget the sequence numbers of a sender, e.g. when its TCP connection closes."""
+        for slot in [x for x in self.last_seq if x[0][0] == ip]:
+            del self.last_seq[slot]
+
+    def get_stats(self) -> dict:
+        """Get the datagram counters and the transit time percentiles."""
+        return {'received': self.received,
+                'accepted': self.accepted,
+                'stale': self.stale,
+                'rejected': self.rejected,
+                'malformed': self.malformed,
+                'transit': self.transit.get_stats()}
+
+if __name__ == '__main__':
+    # Motor response under loss on loopback: commands go through a lossy relay to the dispatcher, once over
+    # TCP and once over UDP. A TCP relay cannot drop bytes, so a lost segment is modelled the way the kernel
+    # handles it: the segment and everything behind it wait for a retransmission timeout (head-of-line blocking).
+    # Response time of command i = time until the dispatcher hands out command i or a newer one.
+    from tcp_server import TCPServer
+    from message import CommandFramer
+    from dispatcher import PriorityDispatcher
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    LOSS = 0.05           # Probability that a packet is lost
+    RTO = 0.2             # Linux minimum retransmission timeout
+    COUNT = 400           # Commands per run
+    INTERVAL = 0.01       # 100 Hz teleoperation
+
+    def run_benchmark(send, dispatcher):
+        applied = []
+        def consume():
+            while True:
+                item = dispatcher.get()
+                if item is None:
+                    return
+                applied.append((time.monotonic(), item[1].args[0]))
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        sent = []
+        for seq in range(COUNT):
+            sent.append(time.monotonic())
+            send(seq, ("CMD_MOTOR#{}#0#0#0\n".format(seq)).encode('utf-8'))
+            time.sleep(INTERVAL)
+        time.sleep(RTO * 3)
+        dispatcher.close()
+        consumer.join()
+        latency = LatencyHistogram()
+        newest, index = -1, 0
+        for applied_at, seq in applied:
+            if seq <= newest:
+                continue
+            while index <= seq:
+                latency.record(applied_at - sent[index])
+                index += 1
+            newest = seq
+        return latency.get_stats(), COUNT - index
+
+    # TCP through a relay that stalls the stream for one RTO on each lost segment
+    dispatcher = PriorityDispatcher()
+    tcp = TCPServer(framer=CommandFramer(), max_frame_size=4096)
+    tcp.start('127.0.0.1', 0)
+    tcp_port = tcp.server_socket.getsockname()[1]
+    def feed():
+        while True:
+            address, frame = tcp.message_queue.get()
+            if frame is None:
+                return
+            dispatcher.put(address, frame)
+    threading.Thread(target=feed, daemon=True).start()
+    relay_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    relay_listener.bind(('127.0.0.1', 0))
+    relay_listener.listen(1)
+    def tcp_relay():
+        inbound, _ = relay_listener.accept()
+        outbound = socket.create_connection(('127.0.0.1', tcp_port))
+        outbound.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            data = inbound.recv(4096)
+            if not data:
+                break
+            if random.random() < LOSS:
+                time.sleep(RTO)
+            outbound.sendall(data)
+        outbound.close()
+    threading.Thread(target=tcp_relay, daemon=True).start()
+    client = socket.create_connection(relay_listener.getsockname())
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    tcp_stats, tcp_lost = run_benchmark(lambda seq, frame: client.sendall(frame), dispatcher)
+    client.close()
+    tcp.close()
+
+    # UDP through a relay that drops datagrams
+    dispatcher = PriorityDispatcher()
+    udp = UdpControlServer(dispatcher.put_command)
+    udp.start('127.0.0.1', 0)
+    udp_address = udp.server_socket.getsockname()
+    relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    relay.bind(('127.0.0.1', 0))
+    def udp_relay():
+        while True:
+            data, _ = relay.recvfrom(2048)
+            if random.random() >= LOSS:
+                relay.sendto(data, udp_address)
+    threading.Thread(target=udp_relay, daemon=True).start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_stats, udp_lost = run_benchmark(lambda seq, frame: sender.sendto(encode_datagram(seq, frame.strip()), relay.getsockname()), dispatcher)
+    udp.stop()
+
+    print("{:.0f}% loss, {} commands at {:.0f} Hz".format(LOSS * 100, COUNT, 1 / INTERVAL))
+    for name, stats, lost in (("TCP", tcp_stats, tcp_lost), ("UDP", udp_stats, udp_lost)):
+        print("{}: response p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms  never applied {}".format(name, stats['p50_ms'], stats['p99_ms'], stats['max_ms'], lost))
+    print(udp.get_stats())
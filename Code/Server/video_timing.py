@@ -0,0 +1,129 @@
+import threading  # Import threading for the lock on the set of timed viewers
+import time       # Import time for the send timestamps and the wall clock conversion
+from stats import LatencyHistogram  # Import the histogram of each stage
+from command_schema import VIDEO_HEADER, VIDEO_TIMED_HEADER, VIDEO_TIMED_MAGIC  # Import the video frame headers
+
+class VideoTiming:
+    # Stages of a frame on the car, in order: sensor exposure to JPEG ready, JPEG ready to hand-off to the video
+    # server, hand-off to the first byte leaving for a viewer (its frame queue), first to last byte handed to the kernel
+    STAGES = ('encode', 'handoff', 'queued', 'sending', 'capture_to_sent')
+
+    def __init__(self):
+        """Initialize the VideoTiming class, the per-stage latency of the frames sent to the video viewers."""
+        self.stages = {name: LatencyHistogram() for name in self.STAGES}
+        self.lock = threading.Lock()
+        self.timed_ips = set()  # Viewers on these hosts agreed to version 8 and get the timed header
+
+    def set_timed(self, ip: str, timed: bool) -> None:
+        """Send the timed header, or the plain length, to the viewers on a host."""
+        with self.lock:
+            if timed:
+                self.timed_ips.add(ip)
+            else:
+                self.timed_ips.discard(ip)
+
+    def is_timed(self, ip: str) -> bool:
+        """Check whether viewers on a host get the timed header."""
+        return ip in self.timed_ips
+
+    def frame(self, frame) -> 'FrameSend':
+        """Start timing a frame bus Frame handed to the video server now."""
+        now = time.monotonic()
+        encoded = frame.published if frame.published is not None else frame.timestamp
+        self.stages['encode'].record(max(0.0, encoded - frame.timestamp))
+        self.stages['handoff'].record(now - encoded)
+        return FrameSend(self, frame.seq, frame.timestamp, encoded, now, len(frame.data))
+
+    def get_stats(self) -> dict:
+        """Get the percentiles of each stage in milliseconds."""
+        return {name: histogram.get_stats() for name, histogram in self.stages.items()}
+
+class FrameSend:
+    __slots__ = ('timing', 'seq', 'captured', 'encoded', 'handed_off', 'length', 'started')
+
+    def __init__(self, timing: VideoTiming, seq: int, captured: float, encoded: float, handed_off: float, length: int):
+        """Initialize the FrameSend class, one frame on its way to the viewers; times are time.monotonic()."""
+        self.timing = timing
+        self.seq = seq
+        self.captured = captured
+        self.encoded = encoded
+        self.handed_off = handed_off
+        self.length = length
+        self.started = {}  # Viewer address -> time its first byte was handed to the kernel
+
+    def header(self, address) -> bytes:
+        """Build the header for a viewer as its send starts, so the timed header carries the send start time."""
+        now = time.monotonic()
+        self.timing.stages['queued'].record(now - self.handed_off)
+        self.started[address] = now
+        if not self.timing.is_timed(address[0]):
+            return VIDEO_HEADER.pack(self.length)
+        to_wall_us = lambda t: int((t + time.time() - now) * 1000000)  # Monotonic to wall clock, which the viewer's link monitor can map
+        return VIDEO_TIMED_HEADER.pack(VIDEO_TIMED_MAGIC, self.length, self.seq & 0xFFFFFFFF,
+                                       to_wall_us(self.captured), to_wall_us(self.encoded), to_wall_us(now))
+
+    def sent(self, address) -> None:
+        """Record that the last byte for a viewer was handed to the kernel."""
+        now = time.monotonic()
+        started = self.started.pop(address, None)
+        if started is not None:
+            self.timing.stages['sending'].record(now - started)
+        self.timing.stages['capture_to_sent'].record(now - self.captured)
+
+if __name__ == '__main__':
+    # A replay camera at 30 fps through the video server to two loopback viewers, one that agreed to version 8 and
+    # reads the timed header, one that did not; the timed viewer splits the latency the same way the client does.
+    import socket
+    from camera_opencv import ReplayCamera
+    from server import Server
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    timing = VideoTiming()  # Create an instance of the VideoTiming class
+    camera = ReplayCamera(fps=30.0)
+    server = Server()
+    server.ip_address = '127.0.0.1'
+    server.start_tcp_servers(command_port=0, video_port=0, max_video_clients=2)
+    address = server.video_server.server_socket.getsockname()
+    timing.set_timed('127.0.0.1', True)
+    results = {}
+    def view(name, timed):
+        sock = socket.create_connection(address)
+        reader = sock.makefile('rb')
+        frames, one_way = 0, LatencyHistogram()
+        while True:
+            first = reader.read(4)
+            if len(first) < 4:
+                break
+            length, = VIDEO_HEADER.unpack(first)
+            if length == VIDEO_TIMED_MAGIC:
+                rest = reader.read(VIDEO_TIMED_HEADER.size - 4)
+                _, length, seq, captured_us, encoded_us, send_us = VIDEO_TIMED_HEADER.unpack(first + rest)
+            data = reader.read(length)
+            if len(data) < length:
+                break
+            frames += 1
+            if length != len(data) or data[:2] != b'\xff\xd8':
+                print(name, "bad frame")
+            if timed and length:
+                one_way.record(time.time_ns() // 1000 / 1000000.0 - captured_us / 1000000.0)
+        results[name] = (frames, one_way.get_stats())
+    viewers = [threading.Thread(target=view, args=('timed', True)), threading.Thread(target=view, args=('plain', False))]
+    for viewer in viewers:
+        viewer.start()
+    while len(server.video_server.get_client_addresses()) < 2:
+        time.sleep(0.01)
+    camera.start_stream()
+    video = camera.get_consumer('video')
+    end = time.monotonic() + 3.0
+    while time.monotonic() < end:
+        frame = video.newest(timeout=1.0)
+        if frame is not None:
+            server.broadcast_video_frame(frame.data, timing.frame(frame))
+    camera.close()
+    time.sleep(0.2)
+    server.stop_tcp_servers()
+    for viewer in viewers:
+        viewer.join()
+    for name, stats in timing.get_stats().items():
+        print("{:<16} p50 {:.3f} ms  p90 {:.3f} ms  p99 {:.3f} ms  ({} samples)".format(name, stats['p50_ms'], stats['p90_ms'], stats['p99_ms'], stats['count']))
+    for name, (frames, stats) in results.items():
+        print("viewer {:<6} {} frames{}".format(name, frames, ", capture to received p50 {:.3f} ms".format(stats['p50_ms']) if stats['count'] else ""))
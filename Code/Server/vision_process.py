@@ -0,0 +1,255 @@
+import multiprocessing  # Import multiprocessing for the vision worker process
+import threading        # Import threading for the thread feeding the ring
+import time             # Import time for the capture timestamps
+import numpy as np      # Import numpy to size the ring from the camera's frame layout
+from frame_bus import y_plane  # Import the Y plane view, to size the ring the way vision_frame() crops
+from frame_ring import SharedFrameRing  # Import the shared memory ring and its result record
+
+def vision_worker(name: str, analyse, stop, roi: tuple = None, track: bool = True) -> None:
+    """
+    Run analyse(gray) -> (angle, confidence, ...) on the newest frame of a SharedFrameRing until stop is set.
+    Frames are read in place from the shared pages; a result whose frame was overwritten during the analysis is
+    dropped and counted as torn. roi crops each frame (as fractions) before the analysis, as a view.
+    """
+    ring = SharedFrameRing(name, track=track)
+    processed, torn = 0, 0
+    try:
+        while not stop.is_set():
+            seq = ring.wait(timeout=0.5)
+            if seq is None:
+                continue
+            frame = ring.read(seq)
+            if frame is None:
+                torn += 1
+                continue
+            gray, captured = frame
+            started = time.monotonic()
+            result = analyse(y_plane(gray, ring.size, roi) if roi is not None else gray)
+            del gray, frame  # Let go of the view before the ring can close
+            if not ring.valid(seq):
+                torn += 1
+                continue
+            processed += 1
+            ring.publish_result(seq, captured, started, result[0], result[1], processed, torn)
+    finally:
+        ring.close()
+
+class VisionFeed:
+    def __init__(self, camera, roi: tuple = None, slots: int = 4):
+        """
+        Initialize the VisionFeed class, which copies the Y plane of each camera frame into a SharedFrameRing from a
+        thread, for a vision process to map by name. It runs where the camera is open: in the server, for programs
+        that attach through the local control socket, or in VisionProcess itself.
+        Parameters:
+        camera: A camera_opencv or camera.Camera backend; it must be streaming.
+        roi (tuple): (x, y, width, height) of the frame to send, as fractions; None for the whole frame.
+        slots (int): Frames in the ring.
+        """
+        self.camera = camera
+        self.roi = roi
+        self.slots = slots
+        self.ring = None
+        self.thread = None
+        self.running = False
+        self.errors = 0  # Frames the camera failed to hand over
+
+    @property
+    def name(self) -> str:
+        """The name of the ring, None while stopped."""
+        return self.ring.name if self.ring is not None else None
+
+    def start(self) -> None:
+        """Create the ring and start feeding it."""
+        if self.running:
+            return
+        width, height = self.camera.lores_size
+        shape = y_plane(np.empty((height * 3 // 2, width), dtype=np.uint8), (width, height), self.roi).shape
+        self.ring = SharedFrameRing(size=(shape[1], shape[0]), slots=self.slots)
+        self.running = True
+        self.thread = threading.Thread(target=self.feed, daemon=True)
+        self.thread.start()
+
+    def feed(self) -> None:
+        """Copy each vision frame into the ring, stamped when the camera handed it over."""
+        while self.running:
+            try:
+                with self.camera.vision_frame(self.roi) as gray:
+                    if gray is not None and self.running:
+                        self.ring.publish(gray, time.monotonic())
+            except Exception as e:
+                self.errors += 1
+                print("Vision feed: {}".format(e))
+                time.sleep(0.1)
+
+    def get_stats(self) -> dict:
+        """Get the ring name, the frames fed and the capture errors."""
+        ring = self.ring
+        return {'ring': ring.name if ring is not None else None,
+                'frames': ring.newest() if ring is not None else 0,
+                'errors': self.errors}
+
+    def stop(self) -> None:
+        """Stop feeding and remove the ring; processes still attached keep their mapping until they close it."""
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join(1)
+        self.ring.close()
+        self.ring = None
+
+class VisionProcess:
+    def __init__(self, source, analyse, roi: tuple = None, slots: int = 4):
+        """
+        Initialize the VisionProcess class, lane vision in its own process, so OpenCV and the Python around it run on
+        another core instead of taking the GIL from the command and motor threads.
+        The worker maps the frames of a SharedFrameRing in place and writes each result back to the ring's result
+        record, which latest() reads without waiting. Only one VisionProcess may analyse a given ring.
+        Parameters:
+        source: A camera_opencv or camera.Camera backend that is streaming, fed into a new ring by a VisionFeed here;
+                or the name of a ring another program feeds, such as the server's from LocalCar.vision_ring().
+        analyse (callable): Module-level function gray -> (angle, confidence, ...), e.g. cam_utils.lane_direction;
+                            the worker is spawned, so it is imported by name there.
+        roi (tuple): (x, y, width, height) of the frame to analyse, as fractions; None for the whole frame.
+        slots (int): Frames in the ring, when this process feeds it.
+        """
+        self.feed = VisionFeed(source, roi, slots) if not isinstance(source, str) else None
+        self.ring_name = source if isinstance(source, str) else None
+        self.analyse = analyse
+        self.roi = roi
+        self.ring = None
+        self.process = None
+        self.running = False
+        self.context = multiprocessing.get_context('spawn')  # Never fork a process that holds the camera and the GPIO
+        self.stop_event = self.context.Event()
+
+    def start(self) -> None:
+        """Start the feed, if this process feeds the ring, and the worker."""
+        if self.running:
+            return
+        if self.feed is not None:
+            self.feed.start()
+            self.ring = self.feed.ring
+            args = (self.ring.name, self.analyse, self.stop_event)  # The feed already cropped the frames
+        else:
+            self.ring = SharedFrameRing(self.ring_name, track=False)
+            args = (self.ring.name, self.analyse, self.stop_event, self.roi, False)
+        self.stop_event.clear()
+        self.process = self.context.Process(target=vision_worker, args=args, daemon=True)
+        self.process.start()
+        self.running = True
+
+    def latest(self):
+        """Get the newest VisionResult without waiting, or None before the first."""
+        return self.ring.result() if self.ring is not None else None
+
+    def is_alive(self) -> bool:
+        """Check whether the worker process is running."""
+        return self.process is not None and self.process.is_alive()
+
+    def get_stats(self) -> dict:
+        """Get the frames sent, the frames analysed and torn, and the age of the newest result."""
+        result = self.latest()
+        return {'frames': self.ring.newest() if self.ring is not None else 0,
+                'processed': result.processed if result else 0,
+                'torn': result.torn if result else 0,
+                'result_age_ms': (time.monotonic() - result.captured) * 1000 if result else None,
+                'alive': self.is_alive()}
+
+    def stop(self) -> None:
+        """Stop the worker, then the feed and its ring, or let go of the ring another program feeds."""
+        if not self.running:
+            return
+        self.running = False
+        self.stop_event.set()
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self.feed is not None:
+            self.feed.stop()
+        else:
+            self.ring.close()
+        self.ring = None
+
+def python_direction(gray) -> tuple:
+    """
+    A stand-in for cam_utils.lane_direction with the same shape of work (OpenCV edges, then a Python loop over the
+    contour segments) and no pdf2image dependency, for benchmarks off the car.
+    """
+    import cv2
+    contours, _ = cv2.findContours(cv2.Canny(gray, 50, 150), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    angle_sum, total_length = 0.0, 0.0
+    for contour in contours:
+        points = contour.reshape(-1, 2).tolist()
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            length = ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
+            angle = np.degrees(np.arctan2(y1 - y2, x2 - x1)) % 180
+            angle_sum += min(135.0, max(45.0, angle)) * length
+            total_length += length
+    return (angle_sum / total_length if total_length else 90.0), min(1.0, total_length / (4.0 * gray.shape[0]))
+
+if __name__ == '__main__':
+    # A 100 Hz control loop (the motor update period) while vision runs on every frame of a 30 fps replay camera,
+    # first in a thread of the same process, as get_direction() does, then in the vision process. The late wake-ups
+    # of the control loop are the jitter the motors see.
+    # python3 vision_process.py [seconds]
+    import sys
+    from camera_opencv import ReplayCamera
+    from stats import LatencyHistogram
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    ROI = (0.0, 0.3, 1.0, 0.7)
+    def control_loop(seconds, read):
+        lateness = LatencyHistogram()
+        period = 0.01
+        next_time = time.monotonic() + period
+        end = time.monotonic() + seconds
+        while next_time < end:
+            time.sleep(max(0.0, next_time - time.monotonic()))
+            lateness.record(time.monotonic() - next_time)
+            read()
+            next_time += period
+        return lateness.get_stats()
+    def report(name, stats, vision_count, ages):
+        print("{:<12} control lateness p50 {:.3f} ms  p99 {:.3f} ms  max {:.3f} ms   vision {:.0f} frames/s  result age p50 {:.1f} ms".format(
+            name, stats['p50_ms'], stats['p99_ms'], stats['max_ms'], vision_count / SECONDS, sorted(ages)[len(ages) // 2] * 1000 if ages else 0.0))
+
+    camera = ReplayCamera(fps=30.0)
+    camera.start_stream()
+    time.sleep(0.5)
+    idle = control_loop(SECONDS / 2, lambda: None)
+    report('idle', idle, 0, [])
+
+    # Vision in a thread of this process
+    running = True
+    thread_results = []
+    def vision_thread():
+        while running:
+            with camera.vision_frame(ROI) as gray:
+                if gray is not None:
+                    captured = time.monotonic()
+                    thread_results.append((captured, python_direction(gray)))
+    thread = threading.Thread(target=vision_thread)
+    thread.start()
+    ages = []
+    stats = control_loop(SECONDS, lambda: ages.append(time.monotonic() - thread_results[-1][0]) if thread_results else None)
+    running = False
+    thread.join()
+    report('thread', stats, len(thread_results), ages)
+
+    # Vision in its own process
+    vision = VisionProcess(camera, python_direction, ROI)  # Create an instance of the VisionProcess class
+    vision.start()
+    while vision.latest() is None:
+        time.sleep(0.01)
+    first = vision.latest().processed
+    ages = []
+    def read():
+        result = vision.latest()
+        ages.append(time.monotonic() - result.captured)
+    stats = control_loop(SECONDS, read)
+    result = vision.latest()
+    report('process', stats, result.processed - first, ages)
+    print("process: {} frames sent, {} analysed, {} torn, angle {:.1f} confidence {:.2f}".format(
+        vision.get_stats()['frames'], result.processed, result.torn, result.angle, result.confidence))
+    vision.stop()
+    camera.close()
@@ -0,0 +1,190 @@
+import threading  # Import threading for the watchdog thread and its condition
+import time       # Import time for the deadline
+from stats import LatencyHistogram  # Import the histogram of how late the watchdog fired
+
+class Watchdog:
+    def __init__(self, timeout: float, on_expire, clock=time.monotonic):
+        """
+        Initialize the Watchdog class, a deadman timer that calls on_expire when an armed client is not heard from in time.
+        Each client that arms it has its own deadline, pushed back only by its own feeds, so traffic from another
+        client, a UDP sender or a local program never keeps a frozen driver alive.
+        Parameters:
+        timeout (float): Seconds without a feed from an armed client before on_expire runs.
+        on_expire (callable): Called as on_expire(silence) from the watchdog thread, with the seconds since that client's last feed.
+        clock (callable): Returns the time in seconds.
+        """
+        self.timeout = timeout
+        self.on_expire = on_expire
+        self.clock = clock
+        self.condition = threading.Condition()  # Signals the watchdog thread when it is armed, disarmed or stopped
+        self.last_feed = {}          # Armed client -> time of its last feed
+        self.running = False
+        self.thread = None
+        self.feeds = 0               # Feeds from armed clients
+        self.expirations = 0         # Times on_expire ran
+        self.last_silence = 0.0      # Seconds without a feed at the last expiry
+        self.overshoot = LatencyHistogram()  # How long after the deadline on_expire started
+
+    @property
+    def armed(self) -> bool:
+        """Whether any client is being watched."""
+        return bool(self.last_feed)
+
+    def is_armed(self, client=None) -> bool:
+        """Check whether a client is being watched."""
+        return client in self.last_feed
+
+    def arm(self, client=None) -> None:
+        """Start watching a client, as if fed now."""
+        with self.condition:
+            self.last_feed[client] = self.clock()
+            self.condition.notify()
+
+    def disarm(self, client=None) -> None:
+        """Stop watching a client until it arms the watchdog again."""
+        with self.condition:
+            self.last_feed.pop(client, None)
+            self.condition.notify()
+
+    def disarm_all(self) -> None:
+        """Stop watching every client."""
+        with self.condition:
+            self.last_feed.clear()
+            self.condition.notify()
+
+    def feed(self, client=None) -> None:
+        """Push a client's deadline back. Called for every command, so it only stores the time; feeds from clients
+        that did not arm the watchdog are ignored."""
+        if client in self.last_feed:
+            with self.condition:
+                if client in self.last_feed:  # Not disarmed in the meantime
+                    self.last_feed[client] = self.clock()
+                    self.feeds += 1
+
+    def start(self) -> None:
+        """Start the watchdog thread."""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the watchdog thread."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(1)
+            self.thread = None
+
+    def run(self) -> None:
+        """Sleep until the earliest client deadline and fire if no feed moved it; the silent client is disarmed."""
+        while True:
+            with self.condition:
+                while self.running and not self.last_feed:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                now = self.clock()
+                client, last_feed = min(self.last_feed.items(), key=lambda item: item[1])
+                deadline = last_feed + self.timeout
+                if now < deadline:
+                    self.condition.wait(deadline - now)
+                    continue
+                del self.last_feed[client]
+                self.expirations += 1
+                self.last_silence = now - last_feed
+                self.overshoot.record(now - deadline)
+                silence = self.last_silence
+            try:
+                self.on_expire(silence)
+            except Exception as e:
+                print("Watchdog action failed: {}".format(e))
+
+    def get_stats(self) -> dict:
+        """Get the state, feed and expiry counts, the last silence and how late the watchdog fired."""
+        return {'armed': self.armed,
+                'clients': len(self.last_feed),
+                'timeout_ms': self.timeout * 1000,
+                'feeds': self.feeds,
+                'expirations': self.expirations,
+                'last_silence_ms': self.last_silence * 1000,
+                'overshoot': self.overshoot.get_stats()}
+
+if __name__ == '__main__':
+    # Self-test against simulated silent clients on loopback, wired the way main.py wires the command port:
+    # every valid command feeds its client's deadline, a ping (from a version 6 client) arms it, and a disconnect stops the motors at once.
+    # Cut-off latency = time from the client's last message (or its disconnect) to the motors being zeroed.
+    import socket
+    import struct
+    from tcp_server import TCPServer
+    from message import CommandFramer, parse_command
+    from command_schema import COMMANDS, WATCHDOG_TIMEOUT, HEARTBEAT_INTERVAL
+    print('Program is starting ... ')  # Print a message indicating the start of the program
+    TRIALS = 20
+    motor = {'duty': (0, 0, 0, 0), 'cut_at': None}
+    def set_motor_model(*duty):
+        motor['duty'] = duty
+        if duty == (0, 0, 0, 0) and motor['cut_at'] is None:
+            motor['cut_at'] = time.monotonic()
+    watchdog = Watchdog(WATCHDOG_TIMEOUT, lambda silence: set_motor_model(0, 0, 0, 0))  # Create an instance of the Watchdog class
+    watchdog.start()
+    server = TCPServer(framer=CommandFramer(), max_frame_size=4096, dead_peer_timeout=2.0)
+    server.on_disconnect = lambda address: set_motor_model(0, 0, 0, 0)
+    server.start('127.0.0.1', 0)
+    def receive():
+        while True:
+            address, frame = server.message_queue.get()
+            command = parse_command(frame)
+            if command is None:
+                continue
+            watchdog.feed(address)
+            if command.command == 'CMD_PING' and not watchdog.is_armed(address):
+                watchdog.arm(address)
+            elif command.command == 'CMD_MOTOR':
+                set_motor_model(*command.args)
+    threading.Thread(target=receive, daemon=True).start()
+    ping = COMMANDS['CMD_PING']
+    motor_frame = COMMANDS['CMD_MOTOR'].encode_text(1500, 1500, 1500, 1500).encode('utf-8')
+
+    def trial(silent: bool) -> float:
+        motor['cut_at'] = None
+        client = socket.create_connection(server.server_socket.getsockname())
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.sendall(motor_frame)
+        for seq in range(1, 11):  # Heartbeats while driving
+            client.sendall(ping.encode_text(seq, 0, 0, 0).encode('utf-8'))
+            last_sent = time.monotonic()
+            time.sleep(HEARTBEAT_INTERVAL)
+        if not silent:
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            last_sent = time.monotonic()
+            client.close()  # Reset: the peer is gone at once
+        deadline = time.monotonic() + 1.0
+        while motor['cut_at'] is None and time.monotonic() < deadline:
+            time.sleep(0.001)
+        if silent:
+            client.close()  # Frozen client: the socket stayed open and quiet until the motors were cut
+        time.sleep(0.05)
+        return (motor['cut_at'] - last_sent) if motor['cut_at'] is not None else float('inf')
+
+    for silent, name in ((True, "silent client (socket open, no traffic)"), (False, "client reset (socket closed)")):
+        latency = LatencyHistogram()
+        for _ in range(TRIALS):
+            latency.record(trial(silent))
+        stats = latency.get_stats()
+        print("{}: cut-off p50 {:.1f} ms  max {:.1f} ms over {} trials".format(name, stats['p50_ms'], stats['max_ms'], stats['count']))
+    print("Watchdog timeout {:.0f} ms, heartbeat every {:.0f} ms".format(WATCHDOG_TIMEOUT * 1000, HEARTBEAT_INTERVAL * 1000))
+    print(watchdog.get_stats()['overshoot'])
+    probe = socket.create_connection(server.server_socket.getsockname())
+    time.sleep(0.05)
+    with server.clients_lock:
+        accepted = list(server.clients.keys())[0]
+    print("Command socket options: SO_KEEPALIVE={} TCP_KEEPIDLE={} TCP_KEEPCNT={} TCP_USER_TIMEOUT={} ms".format(
+        accepted.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE),
+        accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT), accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT)))
+    probe.close()
+    watchdog.stop()
+    server.close()